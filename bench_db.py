@@ -0,0 +1,136 @@
+"""Микробенчмарк чтения пользователя и активного абонемента.
+
+Замеряет задержку Database.get_user и Database.get_active_subscription на
+заполненной базе в трех режимах:
+    кэш              — повторное чтение из кэша в памяти;
+    соединение       — запрос через долгоживущее соединение потока, мимо кэша;
+    новое соединение — sqlite3.connect на каждый запрос, как было до пула
+                       соединений и WAL.
+
+Пример запуска:
+    python bench_db.py --users 100000 --calls 20000 --threads 4
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+from database import Database
+
+
+class PerCallConnectionDatabase(Database):
+    """Database, открывающая новое соединение на каждый запрос без настроек прагм"""
+
+    def get_connection(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+
+def seed(db: Database, users: int):
+    """Заполняет пустую базу пользователями с одним активным абонементом у каждого"""
+    with db.get_connection() as conn:
+        if conn.execute('SELECT COUNT(*) FROM users').fetchone()[0] >= users:
+            return
+    with db.write_connection() as conn:
+        conn.execute(f'''
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {users})
+            INSERT OR IGNORE INTO users (telegram_id, first_name, last_name, phone)
+            SELECT 100000 + i, 'Игрок', 'Номер ' || i, '+7900' || printf('%07d', i) FROM n
+        ''')
+        conn.execute('''
+            INSERT OR IGNORE INTO subscriptions
+            (user_id, subscription_number, initial_amount, current_balance, start_date)
+            SELECT id, 'B-' || id, 2000000, 1000000 + id % 1000000, date('now') FROM users
+        ''')
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def measure(call: Callable, keys: List[int], threads: int) -> Tuple[List[float], float]:
+    """Задержки отдельных вызовов и общее время прогона"""
+    def run(chunk: List[int]) -> List[float]:
+        latencies = []
+        for key in chunk:
+            started = time.perf_counter()
+            call(key)
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    chunks = [keys[index::threads] for index in range(threads)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = [value for chunk in executor.map(run, chunks) for value in chunk]
+    return latencies, time.perf_counter() - started
+
+
+def run(args) -> Dict[str, Tuple[List[float], float]]:
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix='bench-'), 'bench.db')
+    db = Database(db_path, cache_size=args.users)
+    per_call = PerCallConnectionDatabase(db_path)
+    seed(db, args.users)
+
+    with db.get_connection() as conn:
+        users = conn.execute('SELECT telegram_id, id FROM users').fetchall()
+    rng = random.Random(args.seed)
+    sample = [rng.choice(users) for _ in range(args.calls)]
+    telegram_ids = [telegram_id for telegram_id, _ in sample]
+    user_ids = [user_id for _, user_id in sample]
+
+    # Прогреваем кэш всеми выбранными ключами
+    for telegram_id, user_id in sample:
+        db.get_user(telegram_id)
+        db.get_active_subscription(user_id)
+
+    cases = [
+        ('get_user: кэш', db.get_user, telegram_ids),
+        ('get_user: соединение', db._fetch_user, telegram_ids),
+        ('get_user: новое соединение', per_call._fetch_user, telegram_ids),
+        ('subscription: кэш', db.get_active_subscription, user_ids),
+        ('subscription: соединение', db._fetch_active_subscription, user_ids),
+        ('subscription: новое соединение', per_call._fetch_active_subscription, user_ids),
+    ]
+    results = {name: measure(call, keys, args.threads) for name, call, keys in cases}
+    per_call.close()
+    db.close()
+    results['db_path'] = db_path
+    return results
+
+
+def report(args, results: Dict):
+    print(f"Микробенчмарк чтения {datetime.now():%Y-%m-%d %H:%M:%S}")
+    print(f"Пользователей: {args.users}, вызовов: {args.calls}, потоков: {args.threads}")
+    print(f"База данных: {results.pop('db_path')}\n")
+
+    header = f"{'режим':<32}{'p50, мкс':>10}{'p95, мкс':>10}{'p99, мкс':>10}{'вызовов/с':>12}"
+    print(header)
+    print('-' * len(header))
+    for name, (latencies, elapsed) in results.items():
+        print(f"{name:<32}"
+              f"{percentile(latencies, 50) * 1e6:>10.1f}"
+              f"{percentile(latencies, 95) * 1e6:>10.1f}"
+              f"{percentile(latencies, 99) * 1e6:>10.1f}"
+              f"{len(latencies) / elapsed:>12.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Задержка чтения пользователя и абонемента')
+    parser.add_argument('--users', type=int, default=10000, help='число пользователей в базе')
+    parser.add_argument('--calls', type=int, default=10000, help='число вызовов в каждом режиме')
+    parser.add_argument('--threads', type=int, default=1, help='число потоков, читающих одновременно')
+    parser.add_argument('--seed', type=int, default=1, help='зерно выбора пользователей')
+    parser.add_argument('--db', help='путь к файлу БД (по умолчанию — временный файл)')
+    args = parser.parse_args()
+
+    report(args, run(args))
+
+
+if __name__ == '__main__':
+    main()
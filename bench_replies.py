@@ -0,0 +1,138 @@
+"""Микробенчмарк процессорного времени на подготовку ответа.
+
+Для каждого вида ответа бота собирает текст и клавиатуру так же, как
+обработчик, и сериализует запрос sendMessage в JSON, как это делает Bot API
+перед отправкой. Меряется процессорное время (time.process_time), а не
+настенное: сеть и база данных в замер не входят.
+
+Строки «без кэша» собирают ту же клавиатуру заново на каждый ответ — так
+отвечал бот до того, как постоянные клавиатуры стали создаваться один раз.
+
+Пример запуска:
+    python bench_replies.py --calls 20000 --rounds 10
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Tuple
+
+from telegram import ReplyKeyboardMarkup
+from telegram.constants import ParseMode
+
+from keyboards import (
+    get_booking_date_keyboard, get_booking_options, get_directory_options, get_history_navigation_keyboard,
+    get_main_menu, get_time_slots_keyboard
+)
+from templates import HISTORY_TITLE, render_balance, render_history, render_profile, render_stats
+
+PRICES = {(duration, participants): 50000 * participants
+          for duration in (60, 90, 120) for participants in (1, 2, 3, 4)}
+COURTS = {1: 'Корт 1 (Хард)', 2: 'Корт 2 (Хард)', 3: 'Корт 3 (Грунт)', 4: 'Корт 4 (Грунт)'}
+
+
+def sample_data(rng: random.Random, count: int) -> Dict[str, List]:
+    """Разные пользователи, абонементы и страницы истории, чтобы кэши форматирования не были идеальными"""
+    today = date.today()
+    days = [(today - timedelta(days=rng.randrange(700))).isoformat() for _ in range(count)]
+    subscriptions = [{
+        'subscription_number': f'AB-{index}',
+        'initial_amount': 2000000,
+        'current_balance': rng.randrange(0, 2000000),
+        'start_date': days[index],
+        'end_date': days[-index] if index % 2 else None,
+    } for index in range(count)]
+    users = [{
+        'first_name': 'Иван', 'last_name': f'Петров-{index}', 'phone': f'+7900{index:07d}',
+        'registration_date': days[index],
+    } for index in range(count)]
+    stats = [{
+        'spent': rng.randrange(0, 5000000), 'count': rng.randrange(50),
+        'by_participants': {participants: rng.randrange(20) for participants in range(1, 5)},
+    } for _ in range(count)]
+    pages = [[{
+        'session_date': rng.choice(days), 'duration_minutes': rng.choice((60, 90, 120)),
+        'participants_count': rng.randrange(1, 5), 'amount_paid': rng.randrange(50000, 200000),
+        'court_type': rng.choice((None, *COURTS.values())), 'coach_name': rng.choice((None, 'Иванов Иван')),
+    } for _ in range(10)] for _ in range(count)]
+    slots = [[f'{hour:02d}:{minute:02d}' for hour in range(8, 22) for minute in (0, 30)
+              if rng.random() < 0.7] for _ in range(count)]
+    return {'subscriptions': subscriptions, 'users': users, 'stats': stats, 'pages': pages, 'slots': slots}
+
+
+def cases(data: Dict[str, List]) -> List[Tuple[str, Callable]]:
+    """(вид ответа, функция номер -> (текст, клавиатура))"""
+    options = get_booking_options(PRICES, 1)
+    today = date.today()
+
+    def menu_rebuilt(_):
+        return "Главное меню", ReplyKeyboardMarkup(get_main_menu().keyboard, resize_keyboard=True)
+
+    def slots_rebuilt(index):
+        slots = data['slots'][index]
+        rows = [slots[i:i + 4] for i in range(0, len(slots), 4)] + [['❌ Отмена']]
+        return "Свободное время", ReplyKeyboardMarkup(rows, resize_keyboard=True)
+
+    return [
+        ('главное меню', lambda _: ("Главное меню", get_main_menu())),
+        ('главное меню без кэша', menu_rebuilt),
+        ('длительность', lambda _: ("Выберите продолжительность", options.duration_keyboard)),
+        ('участники', lambda _: ("Сколько человек?", options.participants_keyboard(60))),
+        ('корт', lambda _: ("Выберите корт", get_directory_options('courts', COURTS, 1).keyboard)),
+        ('день', lambda _: ("Когда тренировка?", get_booking_date_keyboard(today, 7))),
+        ('свободное время', lambda index: ("Свободное время", get_time_slots_keyboard(data['slots'][index]))),
+        ('свободное время без кэша', slots_rebuilt),
+        ('баланс', lambda index: (render_balance(data['subscriptions'][index]), get_main_menu())),
+        ('статистика', lambda index: (render_stats('month', data['stats'][index]), get_main_menu())),
+        ('профиль', lambda index: (render_profile(data['users'][index], data['subscriptions'][index], index),
+                                   get_main_menu())),
+        ('история', lambda index: (render_history(HISTORY_TITLE, data['pages'][index]),
+                                   get_history_navigation_keyboard('2024-01-01|10:00:00|1', '2024-02-01|10:00:00|2'))),
+    ]
+
+
+def measure(build: Callable, calls: int, variants: int) -> float:
+    """Процессорное время на один ответ, секунды"""
+    started = time.process_time()
+    for index in range(calls):
+        text, markup = build(index % variants)
+        json.dumps({'chat_id': 1, 'text': text, 'parse_mode': ParseMode.HTML, 'reply_markup': markup.to_dict()})
+    return (time.process_time() - started) / calls
+
+
+def run(args) -> Dict[str, List[float]]:
+    data = sample_data(random.Random(args.seed), args.variants)
+    results = {}
+    for name, build in cases(data):
+        build(0)
+        results[name] = [measure(build, args.calls, args.variants) for _ in range(args.rounds)]
+    return results
+
+
+def report(args, results: Dict[str, List[float]]):
+    print(f"Процессорное время на ответ: {args.calls} ответов x {args.rounds} прогонов, "
+          f"{args.variants} вариантов данных\n")
+    header = f"{'ответ':<28}{'медиана, мкс':>14}{'лучший, мкс':>13}{'разброс, %':>12}"
+    print(header)
+    print('-' * len(header))
+    for name, rounds in results.items():
+        median = statistics.median(rounds)
+        spread = (max(rounds) - min(rounds)) / median * 100 if median else 0
+        print(f"{name:<28}{median * 1e6:>14.2f}{min(rounds) * 1e6:>13.2f}{spread:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Процессорное время на подготовку ответов бота')
+    parser.add_argument('--calls', type=int, default=5000, help='число ответов каждого вида в прогоне')
+    parser.add_argument('--rounds', type=int, default=5, help='число прогонов')
+    parser.add_argument('--variants', type=int, default=1000, help='число разных наборов данных')
+    parser.add_argument('--seed', type=int, default=1, help='зерно генерации данных')
+    args = parser.parse_args()
+
+    report(args, run(args))
+
+
+if __name__ == '__main__':
+    main()
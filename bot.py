@@ -1,7 +1,11 @@
 import logging
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ConversationHandler
-from database import Database
+from telegram.ext import (
+    Application, ApplicationBuilder, CallbackQueryHandler, CommandHandler, MessageHandler, filters, ConversationHandler
+)
+from database import Database, AsyncDatabase
 from handlers import Handlers
+from notifier import SendQueue
+from persistence import SQLitePersistence
 from config import config
 import os
 
@@ -13,20 +17,38 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def main():
-    # Создаем папку для базы данных если её нет
-    os.makedirs(os.path.dirname(config.DB_PATH) if os.path.dirname(config.DB_PATH) else '.', exist_ok=True)
+def build_application(db: AsyncDatabase, builder: ApplicationBuilder = None,
+                      persistence_interval: float = config.PERSISTENCE_INTERVAL) -> Application:
+    """Создает приложение и регистрирует все обработчики бота"""
+    if builder is None:
+        builder = Application.builder().token(config.BOT_TOKEN).concurrent_updates(config.CONCURRENT_UPDATES)
+    # Состояния диалогов и user_data сохраняются в БД и переживают перезапуск
+    builder.persistence(SQLitePersistence(db, update_interval=persistence_interval))
 
-    # Инициализация базы данных
-    db = Database(config.DB_PATH)
-    handlers = Handlers(db)
+    async def post_stop(application: Application):
+        # Досылаем сообщения, оставшиеся в очереди: после stop() бот еще
+        # инициализирован, а к post_shutdown его HTTP-клиент уже закрыт
+        await send_queue.stop()
 
-    # Создание приложения
-    application = Application.builder().token(config.BOT_TOKEN).build()
+    builder.post_stop(post_stop)
+    application = builder.build()
+
+    send_queue = SendQueue(
+        application.bot,
+        rate=config.SEND_RATE,
+        chat_rate=config.SEND_CHAT_RATE,
+        max_size=config.SEND_QUEUE_SIZE
+    )
+    handlers = Handlers(db, send_queue)
 
-    # Обработчик начала работы и регистрации
+    # Обработчик регистрации и многошаговых сценариев меню
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler('start', handlers.start)],
+        entry_points=[
+            CommandHandler('start', handlers.start),
+            MessageHandler(filters.Regex('^🎾 Добавить тренировку$'), handlers.add_training_start),
+            MessageHandler(filters.Regex('^📊 Статистика$'), handlers.show_stats_start),
+            MessageHandler(filters.Regex('^📝 Новый абонемент$'), handlers.new_subscription_start),
+        ],
         states={
             config.STATES['REGISTER_FIRST_NAME']: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.register_first_name)
@@ -49,34 +71,105 @@ def main():
             config.STATES['TRAINING_PARTICIPANTS']: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.training_participants)
             ],
+            config.STATES['TRAINING_PARTNERS']: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.training_partners)
+            ],
             config.STATES['TRAINING_COURT']: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.training_court)
             ],
             config.STATES['TRAINING_COACH']: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.training_coach)
             ],
+            config.STATES['TRAINING_DATE']: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.training_date)
+            ],
+            config.STATES['TRAINING_TIME']: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.training_time)
+            ],
             config.STATES['STATS_PERIOD']: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.show_stats)
             ],
         },
-        fallbacks=[CommandHandler('cancel', handlers.cancel)]
+        fallbacks=[CommandHandler('cancel', handlers.cancel)],
+        name='main',
+        persistent=True
     )
 
     # Добавляем обработчики
     application.add_handler(conv_handler)
-    application.add_handler(MessageHandler(filters.Regex('^🎾 Добавить тренировку$'), handlers.add_training_start))
+    application.add_handler(CommandHandler('setprice', handlers.set_price))
+    application.add_handler(CommandHandler('cachestats', handlers.cache_stats))
+    application.add_handler(CommandHandler('export', handlers.export_ledger))
+    application.add_handler(CommandHandler('club', handlers.club_summary))
+    application.add_handler(CommandHandler('coach', handlers.coach_directory))
+    application.add_handler(CommandHandler('court', handlers.court_directory))
+    application.add_handler(CommandHandler('broadcast', handlers.broadcast))
     application.add_handler(MessageHandler(filters.Regex('^💰 Баланс абонемента$'), handlers.show_balance))
-    application.add_handler(MessageHandler(filters.Regex('^📊 Статистика$'), handlers.show_stats_start))
-    application.add_handler(MessageHandler(filters.Regex('^📝 Новый абонемент$'), handlers.new_subscription_start))
     application.add_handler(MessageHandler(filters.Regex('^📋 История тренировок$'), handlers.show_training_history))
+    application.add_handler(CallbackQueryHandler(handlers.training_history_page, pattern='^history:'))
+    application.add_handler(CallbackQueryHandler(handlers.invitation_response, pattern='^invite:'))
     application.add_handler(MessageHandler(filters.Regex('^👤 Профиль$'), handlers.show_profile))
     application.add_handler(MessageHandler(filters.Regex('^❌ Отмена$'), handlers.cancel))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.unknown_command))
 
+    # Фоновая проверка абонементов; JobQueue доступна с дополнением python-telegram-bot[job-queue]
+    if application.job_queue is not None:
+        application.job_queue.run_repeating(
+            handlers.notify_subscriptions, interval=config.ALERT_INTERVAL, first=config.ALERT_INTERVAL,
+            name='subscription_alerts'
+        )
+        application.job_queue.run_repeating(
+            handlers.ledger_maintenance, interval=config.LEDGER_INTERVAL, first=config.LEDGER_INTERVAL,
+            name='ledger_maintenance'
+        )
+    else:
+        logger.warning("JobQueue недоступна: уведомления и сверка балансов отключены")
+
+    return application
+
+
+def main():
+    # Создаем папку для базы данных если её нет
+    os.makedirs(os.path.dirname(config.DB_PATH) if os.path.dirname(config.DB_PATH) else '.', exist_ok=True)
+
+    # Инициализация базы данных
+    db = AsyncDatabase(
+        Database(config.DB_PATH, cache_size=config.CACHE_SIZE, cache_ttl=config.CACHE_TTL,
+                 analytics_ttl=config.ANALYTICS_TTL),
+        workers=config.DB_POOL_SIZE
+    )
+
+    # Создание приложения
+    application = build_application(db)
+
     # Запуск бота
-    print("Бот запущен...")
-    application.run_polling()
+    try:
+        if config.WEBHOOK_URL:
+            run_webhook(application)
+        else:
+            print("Бот запущен...")
+            application.run_polling()
+    finally:
+        db.close()
+
+
+def run_webhook(application: Application):
+    """Запуск в режиме webhook: Telegram сам присылает обновления на локальный HTTP-сервер.
+
+    Для локальной проверки достаточно отправить JSON обновления POST-запросом на
+    http://<WEBHOOK_LISTEN>:<WEBHOOK_PORT>/<WEBHOOK_PATH> с заголовком
+    X-Telegram-Bot-Api-Secret-Token, если задан WEBHOOK_SECRET.
+    """
+    webhook_url = f"{config.WEBHOOK_URL.rstrip('/')}/{config.WEBHOOK_PATH}"
+    print(f"Бот запущен в режиме webhook: {webhook_url}")
+    application.run_webhook(
+        listen=config.WEBHOOK_LISTEN,
+        port=config.WEBHOOK_PORT,
+        url_path=config.WEBHOOK_PATH,
+        webhook_url=webhook_url,
+        secret_token=config.WEBHOOK_SECRET
+    )
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
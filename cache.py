@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+from itertools import count
+from typing import Any, Dict, Hashable, Optional
+
+# Маркер промаха: отличает отсутствие записи в кэше от закэшированного None
+MISSING = object()
+
+
+class TTLCache:
+    """Потокобезопасный кэш ограниченного размера с временем жизни записей.
+
+    При переполнении вытесняется запись, к которой дольше всего не обращались.
+    Значение None тоже кэшируется, поэтому отсутствие объекта в БД не
+    приводит к повторным запросам.
+
+    Чтобы прочитанное до изменения значение не попало в кэш после
+    invalidate, читатель берет generation(key) до запроса к БД и передает
+    его в set: если ключ за это время инвалидировали, запись пропускается.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        # Поколения недавно инвалидированных ключей; для вытесненных из
+        # этого словаря действует _floor — не меньше любого из их поколений
+        self._generations = OrderedDict()
+        self._counter = count(1)
+        self._floor = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """Возвращает значение или default (по умолчанию — маркер промаха MISSING)"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires_at, value = item
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def generation(self, key: Hashable) -> int:
+        with self._lock:
+            return self._generations.get(key, self._floor)
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None):
+        """Сохраняет значение; с generation — только если ключ с тех пор не инвалидировали"""
+        with self._lock:
+            if generation is not None and self._generations.get(key, self._floor) != generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+            self._generations[key] = next(self._counter)
+            self._generations.move_to_end(key)
+            while len(self._generations) > self.maxsize:
+                _, oldest = self._generations.popitem(last=False)
+                self._floor = max(self._floor, oldest)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._generations.clear()
+            self._floor = next(self._counter)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
@@ -0,0 +1,138 @@
+"""Служебные команды для обслуживания базы данных бота.
+
+Пример запуска:
+    python cli.py rebuild-stats
+    python cli.py check-stats
+    python cli.py import history.csv
+    python cli.py export --gzip -o ledger.csv.gz
+    python cli.py snapshot-balances
+    python cli.py reconcile --full
+    python cli.py migrate
+"""
+import argparse
+import sys
+
+from config import config
+from database import Database
+from export import write_ledger_csv
+from importer import TrainingImporter, read_records
+from migrations import SCHEMA_VERSION
+from utils import format_amount
+
+
+def rebuild_stats(db: Database, args) -> int:
+    rows = db.rebuild_training_stats()
+    print(f"Статистика пересчитана: {rows} строк")
+    return 0
+
+
+def check_stats(db: Database, args) -> int:
+    mismatches = db.check_training_stats()
+    if not mismatches:
+        print("Статистика согласована с историей тренировок")
+        return 0
+
+    print(f"Найдено расхождений: {len(mismatches)}")
+    for table, source, row in mismatches[:args.limit]:
+        print(f"  [{table}, {source}] {', '.join(map(str, row))}")
+    return 1
+
+
+def import_trainings(db: Database, args) -> int:
+    def progress(stats):
+        print(f"  {stats['rows']} строк, импортировано {stats['imported']}, отклонено {stats['rejected']}, "
+              f"{stats['rows'] / stats['elapsed']:.0f} строк/с", flush=True)
+
+    importer = TrainingImporter(db, chunk_size=args.chunk_size, progress=progress)
+    stats = importer.run(read_records(args.path))
+
+    print(f"Импорт завершен за {stats['elapsed']:.1f} с: импортировано {stats['imported']} "
+          f"из {stats['rows']} строк, отклонено {stats['rejected']}")
+    for line, reason in importer.errors[:args.limit]:
+        print(f"  строка {line}: {reason}")
+    return 1 if stats['rejected'] else 0
+
+
+def export_ledger(db: Database, args) -> int:
+    if args.output:
+        with open(args.output, 'wb') as f:
+            rows = write_ledger_csv(db, f, args.user, compress=args.gzip)
+        print(f"Выгружено {rows} строк в {args.output}", file=sys.stderr)
+    else:
+        rows = write_ledger_csv(db, sys.stdout.buffer, args.user, compress=args.gzip)
+        sys.stdout.flush()
+    return 0
+
+
+def snapshot_balances(db: Database, args) -> int:
+    print(f"Снято снимков балансов: {db.take_balance_snapshots()}")
+    return 0
+
+
+def reconcile(db: Database, args) -> int:
+    mismatches = db.reconcile_balances(full=args.full)
+    if not mismatches:
+        print("Балансы абонементов согласованы с журналом операций")
+        return 0
+
+    print(f"Найдено расхождений: {len(mismatches)}")
+    for subscription_id, number, balance, ledger_balance in mismatches[:args.limit]:
+        print(f"  абонемент {number} (id {subscription_id}): баланс {format_amount(balance)}, "
+              f"по журналу {format_amount(ledger_balance)}")
+    return 1
+
+
+def migrate(db: Database, args) -> int:
+    # Миграции применяются при открытии базы, здесь только показываем результат
+    for number, name, elapsed in db.applied_migrations:
+        print(f"  {number}. {name}: {elapsed:.3f} с")
+    print(f"Версия схемы: {SCHEMA_VERSION}"
+          f"{'' if db.applied_migrations else ' (изменений не требуется)'}")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Обслуживание базы данных бота')
+    parser.add_argument('--db', default=config.DB_PATH, help='путь к файлу БД')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('rebuild-stats', help='пересчитать статистику по истории тренировок') \
+        .set_defaults(func=rebuild_stats)
+
+    check = commands.add_parser('check-stats', help='сверить статистику с историей тренировок')
+    check.add_argument('--limit', type=int, default=20, help='сколько расхождений показать')
+    check.set_defaults(func=check_stats)
+
+    importing = commands.add_parser('import', help='импортировать историю тренировок из CSV или JSON')
+    importing.add_argument('path', help='файл .csv, .json или .jsonl')
+    importing.add_argument('--chunk-size', type=int, default=5000, help='строк в одной транзакции')
+    importing.add_argument('--limit', type=int, default=20, help='сколько ошибок показать')
+    importing.set_defaults(func=import_trainings)
+
+    exporting = commands.add_parser('export', help='выгрузить журнал операций в CSV')
+    exporting.add_argument('--user', type=int, help='telegram_id игрока (по умолчанию — весь клуб)')
+    exporting.add_argument('--gzip', action='store_true', help='сжать выгрузку gzip')
+    exporting.add_argument('-o', '--output', help='файл для выгрузки (по умолчанию — stdout)')
+    exporting.set_defaults(func=export_ledger)
+
+    commands.add_parser('snapshot-balances', help='снять снимки балансов абонементов') \
+        .set_defaults(func=snapshot_balances)
+
+    reconciling = commands.add_parser('reconcile', help='сверить балансы абонементов с журналом операций')
+    reconciling.add_argument('--full', action='store_true', help='считать по всему журналу, а не от снимков')
+    reconciling.add_argument('--limit', type=int, default=20, help='сколько расхождений показать')
+    reconciling.set_defaults(func=reconcile)
+
+    commands.add_parser('migrate', help='обновить схему БД и показать время каждого шага') \
+        .set_defaults(func=migrate)
+
+    args = parser.parse_args()
+    db = Database(args.db)
+    try:
+        return args.func(db, args)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
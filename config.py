@@ -2,6 +2,8 @@ import os
 from dataclasses import dataclass, field
 from dotenv import load_dotenv
 
+from utils import parse_amount
+
 load_dotenv()
 
 
@@ -13,6 +15,46 @@ class Config:
 
     # Настройки БД
     DB_PATH: str = os.getenv('DB_PATH', 'tennis_club.db')
+    DB_POOL_SIZE: int = int(os.getenv('DB_POOL_SIZE', '4'))
+    CACHE_SIZE: int = int(os.getenv('CACHE_SIZE', '10000'))
+    CACHE_TTL: int = int(os.getenv('CACHE_TTL', '300'))
+    # Как долго (в секундах) отчеты для администраторов берутся из кэша
+    ANALYTICS_TTL: int = int(os.getenv('ANALYTICS_TTL', '60'))
+
+    # Режим webhook включается, если задан публичный адрес WEBHOOK_URL
+    WEBHOOK_URL: str = os.getenv('WEBHOOK_URL')
+    WEBHOOK_LISTEN: str = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+    WEBHOOK_PORT: int = int(os.getenv('WEBHOOK_PORT', '8443'))
+    WEBHOOK_PATH: str = os.getenv('WEBHOOK_PATH', 'webhook')
+    WEBHOOK_SECRET: str = os.getenv('WEBHOOK_SECRET')
+
+    # Сколько обновлений обрабатывается параллельно
+    CONCURRENT_UPDATES: int = int(os.getenv('CONCURRENT_UPDATES', '8'))
+
+    # Лимиты исходящих сообщений: всего в секунду и в один чат в секунду
+    SEND_RATE: float = float(os.getenv('SEND_RATE', '25'))
+    SEND_CHAT_RATE: float = float(os.getenv('SEND_CHAT_RATE', '1'))
+    SEND_QUEUE_SIZE: int = int(os.getenv('SEND_QUEUE_SIZE', '1000'))
+
+    # Как часто (в секундах) состояние диалогов сохраняется в БД
+    PERSISTENCE_INTERVAL: float = float(os.getenv('PERSISTENCE_INTERVAL', '10'))
+
+    # Уведомления об абонементах: как часто проверять (с), порог баланса
+    # (задается в рублях, хранится в копейках) и за сколько дней предупреждать об окончании срока
+    ALERT_INTERVAL: float = float(os.getenv('ALERT_INTERVAL', '600'))
+    LOW_BALANCE_THRESHOLD: int = parse_amount(os.getenv('LOW_BALANCE_THRESHOLD', '1500'))
+    EXPIRY_NOTICE_DAYS: int = int(os.getenv('EXPIRY_NOTICE_DAYS', '7'))
+    # Срок действия нового абонемента в днях; 0 — бессрочный
+    SUBSCRIPTION_DAYS: int = int(os.getenv('SUBSCRIPTION_DAYS', '0'))
+
+    # Как часто (в секундах) снимаются балансы и сверяется журнал операций
+    LEDGER_INTERVAL: float = float(os.getenv('LEDGER_INTERVAL', '3600'))
+
+    # Бронирование: часы работы клуба, шаг сетки слотов (мин) и на сколько дней вперед
+    CLUB_OPENING: str = os.getenv('CLUB_OPENING', '08:00')
+    CLUB_CLOSING: str = os.getenv('CLUB_CLOSING', '22:00')
+    SLOT_MINUTES: int = int(os.getenv('SLOT_MINUTES', '30'))
+    BOOKING_DAYS: int = int(os.getenv('BOOKING_DAYS', '7'))
 
     # Состояния бота
     STATES: dict = field(default_factory=lambda: {
@@ -25,7 +67,10 @@ class Config:
         'TRAINING_PARTICIPANTS': 7,
         'TRAINING_COURT': 8,
         'TRAINING_COACH': 9,
-        'STATS_PERIOD': 10
+        'STATS_PERIOD': 10,
+        'TRAINING_PARTNERS': 11,
+        'TRAINING_DATE': 12,
+        'TRAINING_TIME': 13
     })
 
 
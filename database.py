@@ -1,156 +1,126 @@
 import sqlite3
+import asyncio
+import contextvars
+import functools
+import json
 import logging
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Iterator, List, Dict, Optional
+
+import migrations
+from cache import TTLCache, MISSING
+from utils import clean_name, name_key
 
 logger = logging.getLogger(__name__)
 
 
 class Database:
-    def __init__(self, db_path: str):
+    # Настройки соединения: WAL позволяет читателям не ждать писателя,
+    # synchronous=NORMAL в режиме WAL безопасен и заметно ускоряет запись
+    PRAGMAS = (
+        'PRAGMA journal_mode = WAL',
+        'PRAGMA synchronous = NORMAL',
+        'PRAGMA cache_size = -16000',
+        'PRAGMA mmap_size = 268435456',
+        'PRAGMA temp_store = MEMORY',
+    )
+
+    # Справочники тренеров и кортов: таблица -> колонка со ссылкой в training_sessions
+    DIRECTORIES = {'coaches': 'coach_id', 'courts': 'court_id'}
+    # Подписи записей в выборе: у корта в скобках указано покрытие
+    DIRECTORY_LABELS = {'coaches': 'name', 'courts': "name || coalesce(' (' || surface || ')', '')"}
+
+    def __init__(self, db_path: str, cache_size: int = 10000, cache_ttl: float = 300,
+                 analytics_ttl: float = 60):
         self.db_path = db_path
+        # Кэши пользователей (по telegram_id) и активных абонементов (по user_id)
+        self._users = TTLCache(cache_size, cache_ttl)
+        self._subscriptions = TTLCache(cache_size, cache_ttl)
+        # Готовые отчеты для администраторов по периодам
+        self._analytics = TTLCache(16, analytics_ttl)
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._writer = None
+        # Прайс-лист в памяти: (длительность, участники) -> цена в копейках
+        self._prices = {}
+        self.prices_version = 0
+        # Справочники в памяти: таблица -> {id: имя} действующих записей
+        self._directories = {}
+        self.directory_version = 0
         self.init_db()
+        self.load_prices()
+        self.load_directories()
 
-    def get_connection(self):
-        return sqlite3.connect(self.db_path)
-
-    def init_db(self):
-        """Инициализация базы данных"""
-        with self.get_connection() as conn:
-            # Таблица пользователей
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER UNIQUE NOT NULL,
-                    first_name TEXT NOT NULL,
-                    last_name TEXT,
-                    phone TEXT,
-                    registration_date DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    is_active BOOLEAN DEFAULT TRUE
-                )
-            ''')
+    def _connect(self) -> sqlite3.Connection:
+        """Открывает долгоживущее соединение с настроенными прагмами"""
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, cached_statements=256)
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        conn.create_function('name_key', 1, name_key, deterministic=True)
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
 
-            # Таблица абонементов
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS subscriptions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    subscription_number TEXT UNIQUE NOT NULL,
-                    initial_amount DECIMAL(10,2) NOT NULL,
-                    current_balance DECIMAL(10,2) NOT NULL,
-                    start_date DATE NOT NULL,
-                    end_date DATE,
-                    status TEXT DEFAULT 'active',
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-                )
-            ''')
+    def get_connection(self) -> sqlite3.Connection:
+        """Соединение для чтения: одно на поток, создается при первом обращении"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
 
-            # Таблица прайс-листа
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS price_list (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    duration_minutes INTEGER NOT NULL,
-                    participants_count INTEGER NOT NULL,
-                    price DECIMAL(10,2) NOT NULL,
-                    description TEXT,
-                    is_active BOOLEAN DEFAULT TRUE
-                )
-            ''')
+    @contextmanager
+    def write_connection(self):
+        """Единственное соединение для записи, доступ к нему сериализован.
 
-            # Таблица тренировок
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS training_sessions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    session_date DATE NOT NULL,
-                    session_time TIME NOT NULL,
-                    duration_minutes INTEGER NOT NULL,
-                    court_type TEXT,
-                    coach_name TEXT,
-                    notes TEXT,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+        Транзакция открывается через BEGIN IMMEDIATE: блокировка на запись
+        берется сразу, поэтому другой процесс не может вклиниться между
+        проверкой и изменением данных.
+        """
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            with self._writer:
+                self._writer.execute('BEGIN IMMEDIATE')
+                yield self._writer
 
-            # Таблица участников тренировок
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS training_participants (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    training_session_id INTEGER NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    subscription_id INTEGER NOT NULL,
-                    amount_paid DECIMAL(10,2) NOT NULL,
-                    participants_count INTEGER NOT NULL,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (training_session_id) REFERENCES training_sessions(id) ON DELETE CASCADE,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                    FOREIGN KEY (subscription_id) REFERENCES subscriptions(id) ON DELETE CASCADE
-                )
-            ''')
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+        self._writer = None
 
-            # Таблица транзакций
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS transactions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    subscription_id INTEGER NOT NULL,
-                    training_session_id INTEGER,
-                    transaction_type TEXT NOT NULL,
-                    amount DECIMAL(10,2) NOT NULL,
-                    description TEXT,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                    FOREIGN KEY (subscription_id) REFERENCES subscriptions(id) ON DELETE CASCADE,
-                    FOREIGN KEY (training_session_id) REFERENCES training_sessions(id) ON DELETE SET NULL
-                )
-            ''')
-
-            # Заполняем прайс-лист начальными данными
-            self._init_price_list(conn)
-
-            conn.commit()
-
-    def _init_price_list(self, conn):
-        """Инициализация прайс-листа"""
-        prices = [
-            (60, 1, 1500, "Индивидуальная 60 мин"),
-            (90, 1, 2000, "Индивидуальная 90 мин"),
-            (120, 1, 2500, "Индивидуальная 120 мин"),
-            (60, 2, 800, "Вдвоем 60 мин"),
-            (90, 2, 1200, "Вдвоем 90 мин"),
-            (120, 2, 1600, "Вдвоем 120 мин"),
-            (60, 3, 600, "Втроем 60 мин"),
-            (90, 3, 900, "Втроем 90 мин"),
-            (120, 3, 1200, "Втроем 120 мин"),
-            (60, 4, 500, "Вчетвером 60 мин"),
-            (90, 4, 750, "Вчетвером 90 мин"),
-            (120, 4, 1000, "Вчетвером 120 мин"),
-        ]
-
-        for duration, participants, price, description in prices:
-            conn.execute('''
-                INSERT OR IGNORE INTO price_list 
-                (duration_minutes, participants_count, price, description)
-                VALUES (?, ?, ?, ?)
-            ''', (duration, participants, price, description))
+    def init_db(self):
+        """Приводит схему БД к текущей версии; применяет только недостающие миграции"""
+        self.applied_migrations = migrations.migrate(self)
 
     # Методы для работы с пользователями
     def user_exists(self, telegram_id: int) -> bool:
-        with self.get_connection() as conn:
-            result = conn.execute(
-                'SELECT 1 FROM users WHERE telegram_id = ?',
-                (telegram_id,)
-            ).fetchone()
-            return result is not None
+        return self.get_user(telegram_id) is not None
 
     def register_user(self, telegram_id: int, first_name: str, last_name: str = None, phone: str = None):
-        with self.get_connection() as conn:
+        with self.write_connection() as conn:
             conn.execute('''
                 INSERT INTO users (telegram_id, first_name, last_name, phone)
                 VALUES (?, ?, ?, ?)
             ''', (telegram_id, first_name, last_name, phone))
+        self._users.invalidate(telegram_id)
 
     def get_user(self, telegram_id: int) -> Optional[Dict]:
+        user = self._users.get(telegram_id)
+        if user is MISSING:
+            generation = self._users.generation(telegram_id)
+            user = self._fetch_user(telegram_id)
+            self._users.set(telegram_id, user, generation)
+        return user
+
+    def _fetch_user(self, telegram_id: int) -> Optional[Dict]:
         with self.get_connection() as conn:
             cursor = conn.execute(
                 'SELECT * FROM users WHERE telegram_id = ?',
@@ -160,101 +130,728 @@ class Database:
             row = cursor.fetchone()
             return dict(zip(columns, row)) if row else None
 
-    # Методы для работы с абонементами
-    def create_subscription(self, user_id: int, subscription_number: str, initial_amount: float):
+    def get_users_by_phones(self, phones: List[str]) -> Dict[str, Dict]:
+        """Активные пользователи по телефонам в формате format_phone: телефон -> пользователь"""
+        if not phones:
+            return {}
+        placeholders = ', '.join('?' for _ in phones)
         with self.get_connection() as conn:
+            cursor = conn.execute(f'''
+                SELECT * FROM users WHERE phone IN ({placeholders}) AND is_active = TRUE
+            ''', phones)
+            columns = [description[0] for description in cursor.description]
+            users = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        return {user['phone']: user for user in users}
+
+    def get_user_chat_ids(self, after_id: int = 0, limit: int = 1000) -> List[tuple]:
+        """Пачка активных пользователей (id, telegram_id) после after_id — для рассылок"""
+        with self.get_connection() as conn:
+            return conn.execute('''
+                SELECT id, telegram_id FROM users
+                WHERE id > ? AND is_active = TRUE
+                ORDER BY id LIMIT ?
+            ''', (after_id, limit)).fetchall()
+
+    # Методы для работы с абонементами; все суммы — целые копейки
+    def create_subscription(self, user_id: int, subscription_number: str, initial_amount: int,
+                            end_date: str = None):
+        with self.write_connection() as conn:
             cursor = conn.execute('''
-                INSERT INTO subscriptions (user_id, subscription_number, initial_amount, current_balance, start_date)
-                VALUES (?, ?, ?, ?, date('now'))
-            ''', (user_id, subscription_number, initial_amount, initial_amount))
-            return cursor.lastrowid
+                INSERT INTO subscriptions
+                (user_id, subscription_number, initial_amount, current_balance, start_date, end_date)
+                VALUES (?, ?, ?, ?, date('now'), ?)
+            ''', (user_id, subscription_number, initial_amount, initial_amount, end_date))
+            self.record_topup(conn, cursor.lastrowid)
+        self._subscriptions.invalidate(user_id)
+        return cursor.lastrowid
 
     def get_active_subscription(self, user_id: int) -> Optional[Dict]:
+        subscription = self._subscriptions.get(user_id)
+        if subscription is MISSING:
+            # Поколение берем до чтения: списание, закоммиченное во время
+            # запроса, не даст закэшировать старый баланс
+            generation = self._subscriptions.generation(user_id)
+            subscription = self._fetch_active_subscription(user_id)
+            self._subscriptions.set(user_id, subscription, generation)
+        return subscription
+
+    def _fetch_active_subscription(self, user_id: int) -> Optional[Dict]:
         with self.get_connection() as conn:
+            # Унарный плюс убирает условие на баланс из выбора индекса: поиск идет по
+            # (user_id, status, created_at) и сразу в нужном порядке, а не по всем
+            # действующим абонементам клуба с положительным балансом
             cursor = conn.execute('''
                 SELECT * FROM subscriptions 
-                WHERE user_id = ? AND status = 'active' AND current_balance > 0
+                WHERE user_id = ? AND status = 'active' AND +current_balance > 0
                 ORDER BY created_at DESC LIMIT 1
             ''', (user_id,))
             columns = [description[0] for description in cursor.description]
             row = cursor.fetchone()
             return dict(zip(columns, row)) if row else None
 
-    def update_subscription_balance(self, subscription_id: int, amount: float):
-        with self.get_connection() as conn:
-            conn.execute('''
+    def update_subscription_balance(self, subscription_id: int, amount: int, description: str = None):
+        """Списывает amount с абонемента вне тренировок; списание попадает в журнал"""
+        with self.write_connection() as conn:
+            updated = conn.execute('''
                 UPDATE subscriptions 
                 SET current_balance = current_balance - ?
                 WHERE id = ? AND current_balance >= ?
-            ''', (amount, subscription_id, amount))
-            return conn.total_changes > 0
+                RETURNING user_id
+            ''', (amount, subscription_id, amount)).fetchone()
+            if updated is None:
+                return False
+            conn.execute('''
+                INSERT INTO transactions (user_id, subscription_id, transaction_type, amount, description)
+                VALUES (?, ?, 'charge', ?, ?)
+            ''', (updated[0], subscription_id, amount, description))
+        self._subscriptions.invalidate(updated[0])
+        return True
+
+    # Журнал операций и снимки балансов
+    # Пополнения увеличивают баланс, остальные операции (training, charge) уменьшают
+    LEDGER_DELTA = "CASE WHEN transaction_type = 'topup' THEN amount ELSE -amount END"
+    TOPUP_DESCRIPTION = "'Пополнение абонемента ' || subscription_number"
+    # Для абонементов, начатых задним числом (импорт истории), пополнение датируется началом
+    TOPUP_DATE = "CASE WHEN start_date < date(created_at) THEN start_date ELSE created_at END"
+
+    def record_topup(self, conn, subscription_id: int):
+        """Записывает в журнал начальное пополнение абонемента (внутри транзакции записи)"""
+        conn.execute(f'''
+            INSERT INTO transactions (user_id, subscription_id, transaction_type, amount, description, created_at)
+            SELECT user_id, id, 'topup', initial_amount, {self.TOPUP_DESCRIPTION}, {self.TOPUP_DATE}
+            FROM subscriptions WHERE id = ?
+        ''', (subscription_id,))
+
+    def take_balance_snapshots(self) -> int:
+        """Снимает балансы абонементов, по которым были операции после прошлого снимка.
+
+        Новый снимок = предыдущий + операции после него, поэтому читаются только
+        новые записи журнала. Возвращает число снимков.
+        """
+        with self.write_connection() as conn:
+            watermark = conn.execute(
+                'SELECT COALESCE(MAX(last_transaction_id), 0) FROM balance_snapshots'
+            ).fetchone()[0]
+            cursor = conn.execute(f'''
+                INSERT INTO balance_snapshots (subscription_id, last_transaction_id, balance)
+                SELECT t.subscription_id, MAX(t.id),
+                       COALESCE((
+                           SELECT b.balance FROM balance_snapshots b
+                           WHERE b.subscription_id = t.subscription_id
+                           ORDER BY b.last_transaction_id DESC LIMIT 1
+                       ), 0) + SUM({self.LEDGER_DELTA})
+                FROM transactions t
+                WHERE t.id > ?
+                -- Унарный плюс не дает группировать по индексу абонемента: иначе
+                -- планировщик обходит весь журнал вместо операций после watermark
+                GROUP BY +t.subscription_id
+            ''', (watermark,))
+            return cursor.rowcount
+
+    def get_balance_at(self, subscription_id: int, at: str = None) -> int:
+        """Баланс абонемента по журналу на момент at (по умолчанию — текущий).
+
+        Берется последний снимок не позже at и операции после него. Моменты
+        сравниваются как строки 'YYYY-MM-DD HH:MM:SS', как в created_at.
+        """
+        at = at or '9999-12-31'
+        with self.get_connection() as conn:
+            snapshot = conn.execute('''
+                SELECT last_transaction_id, balance FROM balance_snapshots
+                WHERE subscription_id = ? AND taken_at <= ?
+                ORDER BY last_transaction_id DESC LIMIT 1
+            ''', (subscription_id, at)).fetchone()
+            last_id, balance = snapshot or (0, 0)
+            tail = conn.execute(f'''
+                SELECT COALESCE(SUM({self.LEDGER_DELTA}), 0) FROM transactions
+                WHERE subscription_id = ? AND id > ? AND created_at <= ?
+            ''', (subscription_id, last_id, at)).fetchone()[0]
+        return balance + tail
+
+    def reconcile_balances(self, full: bool = False) -> List[tuple]:
+        """Сверяет current_balance всех абонементов с журналом за один проход.
+
+        По умолчанию баланс по журналу считается от последнего снимка, full=True
+        пересчитывает его по всему журналу (заодно проверяя сами снимки).
+        Возвращает расхождения (id, номер абонемента, current_balance, баланс по журналу).
+        """
+        if full:
+            query = f'''
+                SELECT s.id, s.subscription_number, s.current_balance, COALESCE(l.balance, 0)
+                FROM subscriptions s
+                LEFT JOIN (
+                    SELECT subscription_id, SUM({self.LEDGER_DELTA}) AS balance
+                    FROM transactions GROUP BY subscription_id
+                ) l ON l.subscription_id = s.id
+            '''
+        else:
+            query = f'''
+                SELECT s.id, s.subscription_number, s.current_balance,
+                       COALESCE(b.balance, 0) + COALESCE((
+                           SELECT SUM({self.LEDGER_DELTA}) FROM transactions t
+                           WHERE t.subscription_id = s.id AND t.id > COALESCE(b.last_transaction_id, 0)
+                       ), 0)
+                FROM subscriptions s
+                LEFT JOIN balance_snapshots b ON b.subscription_id = s.id AND b.last_transaction_id = (
+                    SELECT MAX(last_transaction_id) FROM balance_snapshots WHERE subscription_id = s.id
+                )
+            '''
+        with self.get_connection() as conn:
+            # Суммы целые, поэтому сравнение точное
+            return [row for row in conn.execute(query) if row[2] != row[3]]
 
     # Методы для работы с тренировками
-    def get_price(self, duration: int, participants: int) -> Optional[float]:
+    def load_prices(self):
+        """Загружает активный прайс-лист в память"""
         with self.get_connection() as conn:
-            result = conn.execute('''
-                SELECT price FROM price_list 
-                WHERE duration_minutes = ? AND participants_count = ? AND is_active = TRUE
-            ''', (duration, participants)).fetchone()
-            return result[0] if result else None
+            rows = conn.execute('''
+                SELECT duration_minutes, participants_count, price FROM price_list
+                WHERE is_active = TRUE
+            ''').fetchall()
+        # Подменяем словарь целиком, чтобы читатели не видели его частично заполненным
+        self._prices = {(duration, participants): price for duration, participants, price in rows}
+        self.prices_version += 1
 
-    def add_training_session(self, user_id: int, subscription_id: int, duration: int,
-                             participants: int, court_type: str = None, coach: str = None):
+    def get_price(self, duration: int, participants: int) -> Optional[int]:
+        return self._prices.get((duration, participants))
+
+    def get_prices(self) -> Dict[tuple, int]:
+        """Активный прайс-лист: (длительность, участники) -> цена в копейках. Словарь не изменяется"""
+        return self._prices
+
+    def set_price(self, duration: int, participants: int, price: int, description: str = None):
+        """Изменяет цену формата тренировки и перезагружает кэш прайс-листа"""
+        with self.write_connection() as conn:
+            conn.execute('''
+                INSERT INTO price_list (duration_minutes, participants_count, price, description)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (duration_minutes, participants_count) DO UPDATE SET
+                    price = excluded.price, is_active = TRUE
+            ''', (duration, participants, price, description))
+        self.load_prices()
+
+    def load_directories(self):
+        """Загружает действующих тренеров и корты в память"""
         with self.get_connection() as conn:
-            # Получаем цену
-            price = self.get_price(duration, participants)
-            if not price:
-                raise ValueError("Цена не найдена для указанных параметров")
-
-            # Проверяем баланс
-            subscription = conn.execute(
-                'SELECT current_balance FROM subscriptions WHERE id = ?',
-                (subscription_id,)
-            ).fetchone()
-
-            if not subscription or subscription[0] < price:
+            self._directories = {
+                table: dict(conn.execute(
+                    f'SELECT id, {self.DIRECTORY_LABELS[table]} FROM {table} WHERE is_active = TRUE ORDER BY name'
+                ))
+                for table in self.DIRECTORIES
+            }
+        self.directory_version += 1
+
+    def get_coaches(self) -> Dict[int, str]:
+        """Действующие тренеры: id -> имя. Словарь не изменяется"""
+        return self._directories['coaches']
+
+    def get_courts(self) -> Dict[int, str]:
+        """Действующие корты: id -> название с покрытием. Словарь не изменяется"""
+        return self._directories['courts']
+
+    def resolve_directory_ids(self, conn, table: str, names: List[str], active: bool = True) -> Dict[str, int]:
+        """id записей справочника по именам; недостающие записи создаются.
+
+        active=False создает их скрытыми: они попадают в историю, но не в выбор
+        при записи. Состояние уже существующих записей не меняется.
+        """
+        keys = {name: name_key(name) for name in names}
+        conn.executemany(
+            f'INSERT OR IGNORE INTO {table} (name, name_key, is_active) VALUES (?, ?, ?)',
+            [(clean_name(name), key, active) for name, key in keys.items()]
+        )
+        placeholders = ', '.join('?' for _ in keys)
+        ids = dict(conn.execute(
+            f'SELECT name_key, id FROM {table} WHERE name_key IN ({placeholders})', list(keys.values())
+        ))
+        return {name: ids[key] for name, key in keys.items()}
+
+    def set_directory_entry(self, table: str, name: str, active: bool, surface: str = None) -> bool:
+        """Добавляет или возвращает (active=True) либо скрывает запись справочника.
+
+        Скрытая запись остается в старых тренировках, но пропадает из выбора.
+        surface — покрытие корта; при повторном добавлении корта без покрытия
+        прежнее сохраняется. Возвращает False, если скрывать нечего.
+        """
+        if table not in self.DIRECTORIES:
+            raise ValueError(f"Неизвестный справочник: {table}")
+        if surface is not None and table != 'courts':
+            raise ValueError("Покрытие указывается только для корта")
+        with self.write_connection() as conn:
+            if active:
+                conn.execute(f'''
+                    INSERT INTO {table} (name, name_key) VALUES (?, ?)
+                    ON CONFLICT (name_key) DO UPDATE SET name = excluded.name, is_active = TRUE
+                ''', (clean_name(name), name_key(name)))
+                if surface is not None:
+                    conn.execute('UPDATE courts SET surface = ? WHERE name_key = ?',
+                                 (clean_name(surface), name_key(name)))
+                changed = True
+            else:
+                changed = conn.execute(
+                    f'UPDATE {table} SET is_active = FALSE WHERE name_key = ? AND is_active = TRUE',
+                    (name_key(name),)
+                ).rowcount > 0
+        self.load_directories()
+        return changed
+
+    def add_training_session(self, user_id: int, subscription_id: int, duration: int,
+                             participants: int, court_id: int = None, coach_id: int = None):
+        """Записывает тренировку и списывает ее стоимость одной транзакцией.
+
+        Возвращает (id тренировки, новый баланс абонемента).
+        """
+        training_id, balances = self.add_group_training(
+            [(user_id, subscription_id)], duration, participants, court_id, coach_id
+        )
+        return training_id, balances[user_id]
+
+    def add_group_training(self, payers: List[tuple], duration: int, participants: int,
+                           court_id: int = None, coach_id: int = None, start: datetime = None,
+                           partner_ids: List[int] = ()):
+        """Записывает групповую тренировку одной транзакцией.
+
+        payers — пары (user_id, subscription_id) записавшихся игроков; с каждого
+        абонемента списывается цена формата. start — время начала заранее
+        забронированной тренировки; без него тренировка записывается на текущий
+        момент. partner_ids — названные игроком партнеры: если кто-то из них уже
+        записан в тренировку того же формата на это время и в ней есть места,
+        игроки добавляются в нее. Иначе создается новая. Занятость корта и
+        тренера проверяется только при бронировании: тренировка «сейчас» уже
+        идет, и запись лишь фиксирует ее. Бронь должна закончиться до полуночи.
+        Возвращает (id тренировки, {user_id: новый баланс}).
+        """
+        price = self.get_price(duration, participants)
+        if not price:
+            raise ValueError("Цена не найдена для указанных параметров")
+        if len(payers) > participants:
+            raise ValueError("Игроков больше, чем мест на тренировке")
+        user_ids = [user_id for user_id, _ in payers]
+        if len(set(user_ids)) != len(user_ids):
+            raise ValueError("Игрок указан дважды")
+
+        booking = start is not None
+        if booking:
+            join_from = start
+            end = start + timedelta(minutes=duration)
+            if end.date() != start.date():
+                raise ValueError("Тренировка должна закончиться до полуночи")
+        else:
+            # Тренировка идет сейчас: присоединяемся к начавшейся не раньше ее длительности назад
+            start = datetime.now().replace(microsecond=0)
+            join_from = start - timedelta(minutes=duration)
+        day = start.date().isoformat()
+        start_time = start.strftime('%H:%M:%S')
+        with self.write_connection() as conn:
+            # Списываем стоимость со всех абонементов одним запросом; если хоть на
+            # одном не хватает средств, транзакция откатывается целиком
+            placeholders = ', '.join('(?, ?)' for _ in payers)
+            updated = conn.execute(f'''
+                UPDATE subscriptions SET current_balance = current_balance - ?
+                WHERE (id, user_id) IN (VALUES {placeholders})
+                  AND status = 'active' AND current_balance >= ?
+                RETURNING user_id, current_balance
+            ''', (price, *(value for user_id, subscription_id in payers for value in (subscription_id, user_id)), price)
+            ).fetchall()
+            balances = dict(updated)
+            if len(balances) != len(payers):
                 raise ValueError("Недостаточно средств на абонементе")
 
-            # Создаем тренировку
-            now = datetime.now()
+            training_id = None
+            if partner_ids:
+                training_id = self._find_partner_session(conn, day, join_from.strftime('%H:%M:%S'), start_time,
+                                                         duration, participants, court_id, coach_id,
+                                                         user_ids, partner_ids)
+            if training_id is None:
+                conflict = booking and self._find_conflict(conn, start, end, court_id, coach_id)
+                if conflict:
+                    raise ValueError(conflict)
+                cursor = conn.execute('''
+                    INSERT INTO training_sessions (session_date, session_time, duration_minutes, court_id, coach_id)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (day, start_time, duration, court_id, coach_id))
+                training_id = cursor.lastrowid
+                new_sessions = 1
+            else:
+                # Корт и тренер тренировки партнера важнее выбранных игроком
+                day, court_id, coach_id = conn.execute(
+                    'SELECT session_date, court_id, coach_id FROM training_sessions WHERE id = ?', (training_id,)
+                ).fetchone()
+                new_sessions = 0
+
+            self._record_participants(conn, training_id, payers, price, day, duration, participants,
+                                      court_id, coach_id, new_sessions)
+
+        for user_id in user_ids:
+            self._subscriptions.invalidate(user_id)
+        return training_id, balances
+
+    def _record_participants(self, conn, training_id: int, payers: List[tuple], price: int, day: str,
+                             duration: int, participants: int, court_id: Optional[int], coach_id: Optional[int],
+                             new_sessions: int):
+        """Участники, списания в журнале и накопительная статистика уже оплаченной тренировки"""
+        # Дату и время берем из самой тренировки: при присоединении они не совпадают со start
+        conn.executemany('''
+            INSERT INTO training_participants
+            (training_session_id, user_id, subscription_id, amount_paid, participants_count,
+             session_date, session_time)
+            SELECT id, ?, ?, ?, ?, session_date, session_time FROM training_sessions WHERE id = ?
+        ''', [(user_id, subscription_id, price, participants, training_id)
+              for user_id, subscription_id in payers])
+
+        description = f"Тренировка: {duration}мин, {participants} чел."
+        conn.executemany('''
+            INSERT INTO transactions 
+            (user_id, subscription_id, training_session_id, transaction_type, amount, description)
+            VALUES (?, ?, ?, 'training', ?, ?)
+        ''', [(user_id, subscription_id, training_id, price, description) for user_id, subscription_id in payers])
+
+        # Обновляем накопительную статистику в той же транзакции; минуты корта
+        # клуб считает один раз на тренировку
+        conn.executemany(self.USER_STATS_UPSERT,
+                         [(user_id, day, participants, duration, price) for user_id, _ in payers])
+        conn.execute(self.CLUB_STATS_UPSERT, (day, coach_id or 0, court_id or 0, participants,
+                                              new_sessions, len(payers), duration * new_sessions,
+                                              price * len(payers)))
+
+        # Приглашения в эту тренировку закрываются, как бы игрок в нее ни попал:
+        # иначе подтверждение списало бы с него оплату второй раз
+        conn.executemany('''
+            UPDATE training_invitations SET status = 'accepted', responded_at = CURRENT_TIMESTAMP
+            WHERE training_session_id = ? AND user_id = ? AND status = 'pending'
+        ''', [(training_id, user_id) for user_id, _ in payers])
+
+    def _find_partner_session(self, conn, day: str, time_from: str, time_to: str, duration: int,
+                              participants: int, court_id: Optional[int], coach_id: Optional[int],
+                              user_ids: List[int], partner_ids: List[int]) -> Optional[int]:
+        """Тренировка того же формата с кем-то из partner_ids, начавшаяся между time_from и time_to.
+
+        Корт и тренер сверяются, только если игрок их выбрал. В тренировке
+        должно хватать мест для user_ids, и никого из них в ней еще нет.
+        """
+        users = ', '.join('?' for _ in user_ids)
+        partners = ', '.join('?' for _ in partner_ids)
+        row = conn.execute(f'''
+            SELECT ts.id FROM training_sessions ts
+            JOIN training_participants tp ON tp.training_session_id = ts.id
+            WHERE ts.session_date = ? AND ts.session_time BETWEEN ? AND ?
+              AND ts.duration_minutes = ? AND tp.participants_count = ?
+              AND (? IS NULL OR ts.court_id = ?) AND (? IS NULL OR ts.coach_id = ?)
+            GROUP BY ts.id
+            HAVING COUNT(*) + ? <= ? AND SUM(tp.user_id IN ({users})) = 0
+               AND SUM(tp.user_id IN ({partners})) > 0
+            ORDER BY ts.session_time DESC LIMIT 1
+        ''', (day, time_from, time_to, duration, participants, court_id, court_id, coach_id, coach_id,
+              len(user_ids), participants, *user_ids, *partner_ids)).fetchone()
+        return row[0] if row else None
+
+    def _find_conflict(self, conn, start: datetime, end: datetime,
+                       court_id: Optional[int], coach_id: Optional[int]) -> Optional[str]:
+        """Описание пересечения с занятым кортом или тренером; None, если оба свободны.
+
+        Сравниваются полные дата и время: тренировка, начавшаяся накануне
+        поздно вечером, может продолжаться после полуночи.
+        """
+        for column, value, busy in (('court_id', court_id, 'Корт занят'), ('coach_id', coach_id, 'Тренер занят')):
+            if value is None:
+                continue
+            # Интервалы [начало, конец) пересекаются, если каждый начинается раньше конца другого
+            row = conn.execute(f'''
+                SELECT session_time, time(session_time, '+' || duration_minutes || ' minutes')
+                FROM training_sessions
+                WHERE {column} = ? AND session_date BETWEEN date(?, '-1 day') AND ?
+                  AND session_date || ' ' || session_time < ?
+                  AND datetime(session_date || ' ' || session_time, '+' || duration_minutes || ' minutes') > ?
+                LIMIT 1
+            ''', (value, start.date().isoformat(), start.date().isoformat(),
+                  end.isoformat(' '), start.isoformat(' '))).fetchone()
+            if row:
+                return f"{busy}: {row[0][:5]}–{row[1][:5]}"
+        return None
+
+    def create_invitations(self, training_id: int, invited_by: int, user_ids: List[int]) -> List[tuple]:
+        """Приглашает партнеров в тренировку; возвращает пары (id приглашения, user_id).
+
+        Уже записанные в тренировку и уже приглашенные в нее партнеры пропускаются.
+        """
+        if not user_ids:
+            return []
+        placeholders = ', '.join('(?)' for _ in user_ids)
+        with self.write_connection() as conn:
+            return conn.execute(f'''
+                INSERT INTO training_invitations (training_session_id, user_id, invited_by)
+                SELECT ?, invited.column1, ? FROM (VALUES {placeholders}) AS invited
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM training_participants
+                    WHERE training_session_id = ? AND user_id = invited.column1
+                )
+                ON CONFLICT DO NOTHING
+                RETURNING id, user_id
+            ''', (training_id, invited_by, *user_ids, training_id)).fetchall()
+
+    def respond_invitation(self, invitation_id: int, user_id: int, accept: bool) -> Dict:
+        """Ответ партнера на приглашение в тренировку.
+
+        При согласии с активного абонемента партнера списывается столько же,
+        сколько заплатил пригласивший, и партнер добавляется в тренировку —
+        одной транзакцией. Если оплатить не удалось, приглашение остается
+        в силе. Приглашение игрока, который уже записан в эту тренировку,
+        недействительно. Возвращает тренировку, telegram_id пригласившего и новый баланс.
+        """
+        status = 'accepted' if accept else 'declined'
+        with self.write_connection() as conn:
+            row = conn.execute('''
+                UPDATE training_invitations SET status = ?, responded_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND user_id = ? AND status = 'pending'
+                  AND NOT EXISTS (
+                      SELECT 1 FROM training_participants
+                      WHERE training_session_id = training_invitations.training_session_id AND user_id = ?
+                  )
+                RETURNING training_session_id, invited_by
+            ''', (status, invitation_id, user_id, user_id)).fetchone()
+            if row is None:
+                raise ValueError("Приглашение уже недействительно")
+            training_id, invited_by = row
+
             cursor = conn.execute('''
-                INSERT INTO training_sessions (session_date, session_time, duration_minutes, court_type, coach_name)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (now.date(), now.time(), duration, court_type, coach))
-            training_id = cursor.lastrowid
+                SELECT ts.session_date, ts.session_time, ts.duration_minutes, ts.court_id, ts.coach_id,
+                       tp.participants_count, tp.amount_paid, u.telegram_id AS invited_by_telegram_id,
+                       (SELECT COUNT(*) FROM training_participants
+                        WHERE training_session_id = ts.id) AS taken
+                FROM training_sessions ts
+                JOIN training_participants tp ON tp.training_session_id = ts.id AND tp.user_id = ?
+                JOIN users u ON u.id = tp.user_id
+                WHERE ts.id = ?
+            ''', (invited_by, training_id))
+            columns = [description[0] for description in cursor.description]
+            row = cursor.fetchone()
+            if row is None:
+                raise ValueError("Тренировка не найдена")
+            invitation = dict(zip(columns, row), training_id=training_id, status=status)
+            if not accept:
+                return invitation
+            if invitation['taken'] >= invitation['participants_count']:
+                raise ValueError("В тренировке не осталось мест")
 
-            # Добавляем участника
-            conn.execute('''
-                INSERT INTO training_participants 
-                (training_session_id, user_id, subscription_id, amount_paid, participants_count)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (training_id, user_id, subscription_id, price, participants))
+            price = invitation['amount_paid']
+            charged = conn.execute('''
+                UPDATE subscriptions SET current_balance = current_balance - ?
+                WHERE id = (
+                    SELECT id FROM subscriptions
+                    WHERE user_id = ? AND status = 'active' AND +current_balance > 0
+                    ORDER BY created_at DESC LIMIT 1
+                ) AND current_balance >= ?
+                RETURNING id, current_balance
+            ''', (price, user_id, price)).fetchone()
+            if charged is None:
+                raise ValueError("Недостаточно средств на абонементе")
+            subscription_id, invitation['balance'] = charged
 
-            # Обновляем баланс
-            conn.execute('''
-                UPDATE subscriptions SET current_balance = current_balance - ? 
-                WHERE id = ?
-            ''', (price, subscription_id))
+            self._record_participants(conn, training_id, [(user_id, subscription_id)], price,
+                                      invitation['session_date'], invitation['duration_minutes'],
+                                      invitation['participants_count'], invitation['court_id'],
+                                      invitation['coach_id'], new_sessions=0)
+
+        self._subscriptions.invalidate(user_id)
+        return invitation
 
-            # Добавляем транзакцию
+    def get_availability(self, start_day: date, days: int, duration: int, courts: List[int],
+                         coach_id: int = None, opening: str = '08:00', closing: str = '22:00',
+                         step: int = 30) -> Dict[tuple, List[str]]:
+        """Свободные времена начала тренировки по дням и кортам: (день, id корта) -> ['HH:MM', ...].
+
+        Занятость за весь период читается одним запросом по индексу дат, затем
+        для каждого дня и корта занятые интервалы сливаются и сетка слотов
+        проверяется одним проходом. Если задан тренер, учитывается и его занятость.
+        """
+        end_day = start_day + timedelta(days=days)
+        with self.get_connection() as conn:
+            rows = conn.execute('''
+                SELECT session_date, session_time, duration_minutes, court_id, coach_id
+                FROM training_sessions
+                WHERE session_date >= ? AND session_date < ?
+            ''', (start_day.isoformat(), end_day.isoformat())).fetchall()
+
+        busy = {}
+        for day, session_time, session_duration, court_id, session_coach_id in rows:
+            start = _minutes(session_time)
+            interval = (start, start + session_duration)
+            if court_id is not None and court_id in courts:
+                busy.setdefault((day, court_id), []).append(interval)
+            if coach_id is not None and session_coach_id == coach_id:
+                busy.setdefault((day, None), []).append(interval)
+
+        first, last = _minutes(opening), _minutes(closing) - duration
+        candidates = range(first, last + 1, step)
+        availability = {}
+        for offset in range(days):
+            day = (start_day + timedelta(days=offset)).isoformat()
+            coach_busy = busy.get((day, None), [])
+            for court in courts:
+                starts = _free_starts(busy.get((day, court), []) + coach_busy, candidates, duration)
+                availability[(day, court)] = [f"{start // 60:02d}:{start % 60:02d}" for start in starts]
+        return availability
+
+    def cache_stats(self) -> Dict:
+        """Счетчики попаданий и промахов кэшей для мониторинга"""
+        return {
+            'users': self._users.stats(),
+            'subscriptions': self._subscriptions.stats(),
+        }
+
+    # Выгрузка журнала операций
+    def iter_ledger(self, telegram_id: int = None, batch_size: int = 1000) -> Iterator[tuple]:
+        """Построчно отдает журнал операций вместе с данными тренировок.
+
+        Первым элементом идут названия колонок. Строки читаются с курсора
+        пачками, поэтому расход памяти не зависит от размера журнала.
+        """
+        query = '''
+            SELECT t.id, t.created_at, u.telegram_id, u.first_name, u.last_name,
+                   s.subscription_number, t.transaction_type, t.amount,
+                   ts.session_date, ts.session_time, ts.duration_minutes, tp.participants_count,
+                   c.name AS court_type, co.name AS coach_name, t.description
+            FROM transactions t
+            JOIN users u ON u.id = t.user_id
+            JOIN subscriptions s ON s.id = t.subscription_id
+            LEFT JOIN training_sessions ts ON ts.id = t.training_session_id
+            LEFT JOIN courts c ON c.id = ts.court_id
+            LEFT JOIN coaches co ON co.id = ts.coach_id
+            LEFT JOIN training_participants tp
+                ON tp.training_session_id = t.training_session_id AND tp.user_id = t.user_id
+        '''
+        params = []
+        if telegram_id is not None:
+            query += ' WHERE u.telegram_id = ?'
+            params.append(telegram_id)
+        query += ' ORDER BY t.id'
+
+        cursor = self.get_connection().execute(query, params)
+        try:
+            yield tuple(description[0] for description in cursor.description)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+
+    # Методы для хранения состояния бота
+    def load_bot_state(self, kind: str) -> Dict[str, str]:
+        with self.get_connection() as conn:
+            rows = conn.execute('SELECT key, data FROM bot_state WHERE kind = ?', (kind,))
+            return dict(rows.fetchall())
+
+    def save_bot_state(self, items: List[tuple]):
+        """Сохраняет пакет изменений (kind, key, data) одной транзакцией; data=None удаляет запись"""
+        upserts = [item for item in items if item[2] is not None]
+        deletes = [(kind, key) for kind, key, data in items if data is None]
+        with self.write_connection() as conn:
+            conn.executemany('''
+                INSERT INTO bot_state (kind, key, data) VALUES (?, ?, ?)
+                ON CONFLICT (kind, key) DO UPDATE SET data = excluded.data, updated_at = CURRENT_TIMESTAMP
+            ''', upserts)
+            conn.executemany('DELETE FROM bot_state WHERE kind = ? AND key = ?', deletes)
+
+    # Уведомления об абонементах
+    ALERTS_STATE = ('job', 'subscription_alerts')
+
+    def collect_subscription_alerts(self, low_balance: int, expiry_days: int,
+                                    max_transactions: int = 10000) -> List[Dict]:
+        """Находит абонементы, о которых пора предупредить владельца.
+
+        Балансы проверяются только у абонементов с новыми списаниями любого
+        типа с прошлого запуска (не больше max_transactions за раз), сроки —
+        только у тех, чья дата окончания вошла в окно уведомления с прошлого
+        запуска. Абонемент считается исчерпанным, когда остатка не хватает ни
+        на одну тренировку из прайс-листа; в статус exhausted он переводится
+        при нулевом балансе, просроченный — в статус expired.
+        Возвращает список уведомлений с ключами kind, telegram_id,
+        subscription_number, balance и end_date.
+        """
+        today = datetime.now().date()
+        horizon = (today + timedelta(days=expiry_days)).isoformat()
+        cheapest = min(self.get_prices().values(), default=1)
+        alerts = []
+        statuses = []
+        user_ids = set()
+
+        with self.write_connection() as conn:
+            row = conn.execute('SELECT data FROM bot_state WHERE kind = ? AND key = ?', self.ALERTS_STATE).fetchone()
+            last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM transactions').fetchone()[0]
+            if row:
+                state = json.loads(row[0])
+            else:
+                # Первый запуск: прошлые списания не разбираем, окно сроков начинаем с сегодня
+                state = {'last_transaction_id': last_id, 'horizon': (today - timedelta(days=1)).isoformat()}
+            last_id = min(last_id, state['last_transaction_id'] + max_transactions)
+
+            # Баланс до новых списаний = текущий + их сумма: так видно, что порог пересечен именно сейчас
+            changed = conn.execute('''
+                SELECT s.id, s.user_id, u.telegram_id, s.subscription_number, s.current_balance, c.spent, s.end_date
+                FROM (
+                    SELECT subscription_id, SUM(amount) AS spent FROM transactions
+                    WHERE id > ? AND id <= ? AND transaction_type != 'topup'
+                    GROUP BY subscription_id
+                ) c
+                JOIN subscriptions s ON s.id = c.subscription_id
+                JOIN users u ON u.id = s.user_id
+                WHERE s.status = 'active'
+            ''', (state['last_transaction_id'], last_id)).fetchall()
+            for subscription_id, user_id, telegram_id, number, balance, spent, end_date in changed:
+                if balance <= 0 or balance < cheapest <= balance + spent:
+                    kind = 'exhausted'
+                    if balance <= 0:
+                        statuses.append(('exhausted', subscription_id))
+                        user_ids.add(user_id)
+                elif balance < low_balance <= balance + spent:
+                    kind = 'low_balance'
+                else:
+                    continue
+                alerts.append({'kind': kind, 'telegram_id': telegram_id, 'subscription_number': number,
+                               'balance': balance, 'end_date': end_date})
+
+            if state['horizon'] < horizon:
+                expiring = conn.execute('''
+                    SELECT u.telegram_id, s.subscription_number, s.current_balance, s.end_date
+                    FROM subscriptions s JOIN users u ON u.id = s.user_id
+                    WHERE s.status = 'active' AND s.end_date > ? AND s.end_date <= ? AND s.end_date >= ?
+                ''', (state['horizon'], horizon, today.isoformat())).fetchall()
+                alerts.extend({'kind': 'expiring', 'telegram_id': telegram_id, 'subscription_number': number,
+                               'balance': balance, 'end_date': end_date}
+                              for telegram_id, number, balance, end_date in expiring)
+
+            expired = conn.execute('''
+                SELECT s.id, s.user_id, u.telegram_id, s.subscription_number, s.current_balance, s.end_date
+                FROM subscriptions s JOIN users u ON u.id = s.user_id
+                WHERE s.status = 'active' AND s.end_date < ?
+            ''', (today.isoformat(),)).fetchall()
+            for subscription_id, user_id, telegram_id, number, balance, end_date in expired:
+                statuses.append(('expired', subscription_id))
+                user_ids.add(user_id)
+                alerts.append({'kind': 'expired', 'telegram_id': telegram_id, 'subscription_number': number,
+                               'balance': balance, 'end_date': end_date})
+
+            conn.executemany('UPDATE subscriptions SET status = ? WHERE id = ?', statuses)
+
+            state = {'last_transaction_id': last_id, 'horizon': max(state['horizon'], horizon)}
             conn.execute('''
-                INSERT INTO transactions 
-                (user_id, subscription_id, training_session_id, transaction_type, amount, description)
-                VALUES (?, ?, ?, 'training', ?, ?)
-            ''', (user_id, subscription_id, training_id, price,
-                  f"Тренировка: {duration}мин, {participants} чел."))
+                INSERT INTO bot_state (kind, key, data) VALUES (?, ?, ?)
+                ON CONFLICT (kind, key) DO UPDATE SET data = excluded.data, updated_at = CURRENT_TIMESTAMP
+            ''', (*self.ALERTS_STATE, json.dumps(state)))
 
-            conn.commit()
-            return training_id
+        for user_id in user_ids:
+            self._subscriptions.invalidate(user_id)
+        return alerts
 
     # Методы для статистики
-    def get_spent_amount(self, user_id: int, period: str = 'month') -> float:
+    def get_spent_amount(self, user_id: int, period: str = 'month') -> int:
         with self.get_connection() as conn:
             date_filter = self._get_date_filter(period)
             result = conn.execute('''
-                SELECT COALESCE(SUM(amount), 0) FROM transactions 
-                WHERE user_id = ? AND transaction_type = 'training' 
-                AND created_at >= ?
+                SELECT COALESCE(SUM(amount), 0) FROM user_training_stats
+                WHERE user_id = ? AND day >= ?
             ''', (user_id, date_filter)).fetchone()
             return result[0] if result else 0
 
@@ -262,19 +859,162 @@ class Database:
         with self.get_connection() as conn:
             date_filter = self._get_date_filter(period)
             query = '''
-                SELECT COUNT(*) FROM training_participants tp
-                JOIN training_sessions ts ON tp.training_session_id = ts.id
-                WHERE tp.user_id = ? AND ts.session_date >= ?
+                SELECT COALESCE(SUM(trainings), 0) FROM user_training_stats
+                WHERE user_id = ? AND day >= ?
             '''
             params = [user_id, date_filter]
 
             if participants:
-                query += ' AND tp.participants_count = ?'
+                query += ' AND participants_count = ?'
                 params.append(participants)
 
             result = conn.execute(query, params).fetchone()
             return result[0] if result else 0
 
+    def get_stats_summary(self, user_id: int, period: str = 'month') -> Dict:
+        """Сводная статистика за период одним запросом: сумма, количество
+        и разбивка по числу участников"""
+        with self.get_connection() as conn:
+            date_filter = self._get_date_filter(period)
+            rows = conn.execute('''
+                SELECT participants_count, SUM(trainings), SUM(amount)
+                FROM user_training_stats
+                WHERE user_id = ? AND day >= ?
+                GROUP BY participants_count
+            ''', (user_id, date_filter)).fetchall()
+
+            by_participants = {participants: count for participants, count, _ in rows}
+            return {
+                'spent': sum(amount for _, _, amount in rows),
+                'count': sum(by_participants.values()),
+                'by_participants': by_participants,
+            }
+
+    # Пополнение накопительной статистики одной тренировкой игрока:
+    # (user_id, день, участники, минуты, сумма)
+    USER_STATS_UPSERT = '''
+        INSERT INTO user_training_stats (user_id, day, participants_count, trainings, minutes, amount)
+        VALUES (?, ?, ?, 1, ?, ?)
+        ON CONFLICT (user_id, day, participants_count) DO UPDATE SET
+            trainings = trainings + 1,
+            minutes = minutes + excluded.minutes,
+            amount = amount + excluded.amount
+    '''
+
+    # Пополнение статистики клуба: (день, тренер, корт, участники,
+    # тренировок, игроков, минут корта, сумма)
+    CLUB_STATS_UPSERT = '''
+        INSERT INTO club_training_stats
+        (day, coach_id, court_id, participants_count, sessions, participants, minutes, amount)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (day, coach_id, court_id, participants_count) DO UPDATE SET
+            sessions = sessions + excluded.sessions,
+            participants = participants + excluded.participants,
+            minutes = minutes + excluded.minutes,
+            amount = amount + excluded.amount
+    '''
+
+    # Накопительные таблицы и запросы, пересчитывающие их по полной истории
+    STATS_ROLLUPS = {
+        'user_training_stats': '''
+            SELECT tp.user_id, ts.session_date, tp.participants_count,
+                   COUNT(*), SUM(ts.duration_minutes), SUM(tp.amount_paid)
+            FROM training_participants tp
+            JOIN training_sessions ts ON tp.training_session_id = ts.id
+            GROUP BY tp.user_id, ts.session_date, tp.participants_count
+        ''',
+        'club_training_stats': '''
+            SELECT day, coach_id, court_id, participants_count,
+                   COUNT(*), SUM(players), SUM(duration_minutes), SUM(amount)
+            FROM (
+                SELECT ts.session_date AS day, COALESCE(ts.coach_id, 0) AS coach_id,
+                       COALESCE(ts.court_id, 0) AS court_id, tp.participants_count,
+                       ts.duration_minutes, COUNT(*) AS players, SUM(tp.amount_paid) AS amount
+                FROM training_participants tp
+                JOIN training_sessions ts ON tp.training_session_id = ts.id
+                GROUP BY ts.id, tp.participants_count
+            )
+            GROUP BY day, coach_id, court_id, participants_count
+        ''',
+    }
+
+    def rebuild_training_stats(self) -> int:
+        """Пересчитывает накопительную статистику по истории; возвращает число строк"""
+        with self.write_connection() as conn:
+            rows = sum(self._rebuild_rollup(conn, table, query) for table, query in self.STATS_ROLLUPS.items())
+        self._analytics.clear()
+        return rows
+
+    def _rebuild_rollup(self, conn, table: str, query: str) -> int:
+        conn.execute(f'DELETE FROM {table}')
+        return conn.execute(f'INSERT INTO {table} {query}').rowcount
+
+    def check_training_stats(self) -> List[tuple]:
+        """Сверяет накопительную статистику с историей.
+
+        Возвращает расхождения в виде (таблица, источник, строка), где источник —
+        'history' или 'rollup'; пустой список означает, что данные согласованы.
+        """
+        mismatches = []
+        with self.get_connection() as conn:
+            for table, query in self.STATS_ROLLUPS.items():
+                for source, first, second in (('history', query, f'SELECT * FROM {table}'),
+                                              ('rollup', f'SELECT * FROM {table}', query)):
+                    rows = conn.execute(f'{first} EXCEPT {second}').fetchall()
+                    mismatches.extend((table, source, row) for row in rows)
+        return mismatches
+
+    # Аналитика клуба для администраторов
+    def get_club_summary(self, period: str = 'month') -> Dict:
+        """Выручка и загрузка клуба за период по накопительной статистике.
+
+        Результат кэшируется на ANALYTICS_TTL секунд, поэтому повторные
+        запросы администраторов не обращаются к БД.
+        """
+        summary = self._analytics.get(period)
+        if summary is not MISSING:
+            return summary
+
+        date_filter = self._get_date_filter(period)
+        with self.get_connection() as conn:
+            # Группировка идет по целочисленным id, имена подставляются из справочников
+            by_coach = conn.execute('''
+                SELECT COALESCE(co.name, ''), SUM(s.sessions), SUM(s.minutes), SUM(s.amount)
+                FROM club_training_stats s LEFT JOIN coaches co ON co.id = s.coach_id
+                WHERE s.day >= ?
+                GROUP BY s.coach_id ORDER BY SUM(s.sessions) DESC
+            ''', (date_filter,)).fetchall()
+            by_court = conn.execute('''
+                SELECT COALESCE(c.name, ''), SUM(s.sessions), SUM(s.minutes), SUM(s.amount)
+                FROM club_training_stats s LEFT JOIN courts c ON c.id = s.court_id
+                WHERE s.day >= ?
+                GROUP BY s.court_id ORDER BY SUM(s.sessions) DESC
+            ''', (date_filter,)).fetchall()
+            by_format = conn.execute('''
+                SELECT participants_count, SUM(sessions), SUM(participants), SUM(amount)
+                FROM club_training_stats WHERE day >= ?
+                GROUP BY participants_count ORDER BY participants_count
+            ''', (date_filter,)).fetchall()
+            active_subscriptions, liabilities = conn.execute('''
+                SELECT COUNT(*), COALESCE(SUM(current_balance), 0)
+                FROM subscriptions WHERE status = 'active'
+            ''').fetchone()
+
+        summary = {
+            'revenue': sum(row[3] for row in by_format),
+            'sessions': sum(row[1] for row in by_format),
+            'participants': sum(row[2] for row in by_format),
+            'minutes': sum(row[2] for row in by_court),
+            'by_coach': by_coach,
+            'by_court': by_court,
+            'by_format': by_format,
+            'active_subscriptions': active_subscriptions,
+            'liabilities': liabilities,
+            'generated_at': datetime.now(),
+        }
+        self._analytics.set(period, summary)
+        return summary
+
     def _get_date_filter(self, period: str) -> str:
         """Возвращает дату для фильтрации по периоду"""
         today = datetime.now().date()
@@ -287,17 +1027,121 @@ class Database:
         else:  # all time
             return '2000-01-01'
 
-    def get_user_trainings(self, user_id: int, limit: int = 10) -> List[Dict]:
-        with self.get_connection() as conn:
-            cursor = conn.execute('''
-                SELECT ts.session_date, ts.duration_minutes, tp.participants_count, 
-                       tp.amount_paid, ts.court_type, ts.coach_name
-                FROM training_participants tp
-                JOIN training_sessions ts ON tp.training_session_id = ts.id
-                WHERE tp.user_id = ?
-                ORDER BY ts.session_date DESC, ts.session_time DESC
-                LIMIT ?
-            ''', (user_id, limit))
+    def get_user_trainings(self, user_id: int, limit: int = 10,
+                           before: tuple = None, after: tuple = None) -> List[Dict]:
+        """Страница истории тренировок, от новых к старым.
+
+        Пагинация по ключу (session_date, session_time, id): before возвращает
+        тренировки старше курсора, after — новее. В отличие от OFFSET, стоимость
+        страницы не зависит от того, насколько глубоко пролистана история.
+        """
+        # Дата и время тренировки продублированы в training_participants: страница
+        # читается из индекса (user_id, session_date, session_time, training_session_id)
+        # уже упорядоченной, без сортировки всей истории игрока
+        query = '''
+            SELECT tp.training_session_id, tp.session_date, tp.session_time,
+                   ts.duration_minutes, tp.participants_count,
+                   tp.amount_paid, c.name AS court_type, co.name AS coach_name
+            FROM training_participants tp
+            JOIN training_sessions ts ON tp.training_session_id = ts.id
+            LEFT JOIN courts c ON c.id = ts.court_id
+            LEFT JOIN coaches co ON co.id = ts.coach_id
+            WHERE tp.user_id = ?
+        '''
+        params = [user_id]
+        order = 'DESC'
+
+        if before:
+            query += ' AND (tp.session_date, tp.session_time, tp.training_session_id) < (?, ?, ?)'
+            params.extend(before)
+        elif after:
+            query += ' AND (tp.session_date, tp.session_time, tp.training_session_id) > (?, ?, ?)'
+            params.extend(after)
+            order = 'ASC'
+
+        query += (f' ORDER BY tp.session_date {order}, tp.session_time {order},'
+                  f' tp.training_session_id {order} LIMIT ?')
+        params.append(limit)
 
+        with self.get_connection() as conn:
+            cursor = conn.execute(query, params)
             columns = [description[0] for description in cursor.description]
-            return [dict(zip(columns, row)) for row in cursor.fetchall()]
\ No newline at end of file
+            trainings = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        if after:
+            trainings.reverse()
+        return trainings
+
+
+def _minutes(value: str) -> int:
+    """'HH:MM' или 'HH:MM:SS' -> минуты от начала суток"""
+    return int(value[:2]) * 60 + int(value[3:5])
+
+
+def _free_starts(intervals: List[tuple], candidates: range, duration: int) -> List[int]:
+    """Начала слотов длиной duration, не пересекающиеся ни с одним из занятых интервалов"""
+    # Сливаем интервалы: после этого они не пересекаются и упорядочены и по началу, и по концу
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    free = []
+    index = 0
+    for start in candidates:
+        while index < len(merged) and merged[index][1] <= start:
+            index += 1
+        if index == len(merged) or merged[index][0] >= start + duration:
+            free.append(start)
+    return free
+
+
+class AsyncDatabase:
+    """Асинхронная обертка над Database.
+
+    Каждый метод Database доступен как корутина: запрос выполняется в
+    выделенном потоке, поэтому медленный запрос не блокирует цикл событий
+    и обработку обновлений из других чатов.
+    """
+
+    def __init__(self, db: Database, workers: int = 4):
+        self.db = db
+        # Каждый поток пула держит собственное соединение для чтения,
+        # запись сериализуется внутри Database
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db')
+
+    def __getattr__(self, name):
+        method = getattr(self.db, name)
+        if not callable(method):
+            return method
+
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            # Как и asyncio.to_thread, передаем контекст вызывающей задачи в поток
+            context = contextvars.copy_context()
+            call = functools.partial(context.run, method, *args, **kwargs)
+            return await loop.run_in_executor(self._executor, call)
+
+        # Кэшируем обертку, чтобы не создавать ее при каждом обращении
+        setattr(self, name, wrapper)
+        return wrapper
+
+    def get_price(self, duration: int, participants: int) -> Optional[int]:
+        """Цена берется из памяти, поэтому вызывается без пула потоков"""
+        return self.db.get_price(duration, participants)
+
+    def get_prices(self) -> Dict[tuple, int]:
+        return self.db.get_prices()
+
+    def get_coaches(self) -> Dict[int, str]:
+        return self.db.get_coaches()
+
+    def get_courts(self) -> Dict[int, str]:
+        return self.db.get_courts()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.db.close()
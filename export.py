@@ -0,0 +1,36 @@
+"""Потоковая выгрузка журнала операций в CSV."""
+import csv
+import gzip
+import io
+from typing import BinaryIO
+
+from database import Database
+from utils import amount_to_str
+
+
+def write_ledger_csv(db: Database, fileobj: BinaryIO, telegram_id: int = None, compress: bool = False) -> int:
+    """Пишет журнал операций в CSV (по желанию сжатый gzip); возвращает число строк без заголовка"""
+    stream = gzip.GzipFile(fileobj=fileobj, mode='wb') if compress else fileobj
+    # utf-8-sig, чтобы Excel корректно открывал кириллицу
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    writer = csv.writer(text)
+
+    rows = 0
+    try:
+        ledger = db.iter_ledger(telegram_id)
+        header = next(ledger)
+        writer.writerow(header)
+        # Суммы хранятся в копейках, в файл пишем рубли
+        amount = header.index('amount')
+        for row in ledger:
+            row = list(row)
+            row[amount] = amount_to_str(row[amount])
+            writer.writerow(row)
+            rows += 1
+    finally:
+        # Отсоединяем обертку, чтобы закрытие не закрыло исходный файл
+        text.flush()
+        text.detach()
+        if compress:
+            stream.close()
+    return rows
@@ -1,8 +1,18 @@
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
 from telegram.constants import ParseMode
+import asyncio
 import logging
-from database import Database
+import re
+import tempfile
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+from database import AsyncDatabase
+from export import write_ledger_csv
+from notifier import SendQueue
+from templates import (
+    render_balance, render_stats, render_profile, render_history, HISTORY_TITLE, HISTORY_TITLE_LATEST
+)
 from keyboards import *
 from utils import *
 from config import config
@@ -11,14 +21,15 @@ logger = logging.getLogger(__name__)
 
 
 class Handlers:
-    def __init__(self, db: Database):
+    def __init__(self, db: AsyncDatabase, send_queue: SendQueue):
         self.db = db
+        self.send_queue = send_queue
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
         telegram_id = user.id
 
-        if self.db.user_exists(telegram_id):
+        if await self.db.user_exists(telegram_id):
             await update.message.reply_text(
                 f"С возвращением, {user.first_name}! 🎾\n"
                 "Выберите действие в меню:",
@@ -58,7 +69,7 @@ class Handlers:
         context.user_data['phone'] = formatted_phone
 
         # Регистрируем пользователя
-        self.db.register_user(
+        await self.db.register_user(
             telegram_id=update.effective_user.id,
             first_name=context.user_data['first_name'],
             last_name=context.user_data['last_name'],
@@ -79,29 +90,15 @@ class Handlers:
         )
 
     async def show_balance(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user = self.db.get_user(update.effective_user.id)
-        subscription = self.db.get_active_subscription(user['id'])
+        user = await self.db.get_user(update.effective_user.id)
+        subscription = await self.db.get_active_subscription(user['id'])
 
-        if subscription:
-            message = (
-                f"💰 <b>Ваш абонемент</b>\n"
-                f"Номер: {subscription['subscription_number']}\n"
-                f"Начальная сумма: {format_amount(subscription['initial_amount'])}\n"
-                f"Текущий баланс: <b>{format_amount(subscription['current_balance'])}</b>\n"
-                f"Дата начала: {format_date(subscription['start_date'])}"
-            )
-        else:
-            message = (
-                "❌ У вас нет активного абонемента.\n"
-                "Добавьте новый абонемент через меню."
-            )
-
-        await update.message.reply_text(message, parse_mode=ParseMode.HTML)
+        await update.message.reply_text(render_balance(subscription), parse_mode=ParseMode.HTML)
 
     async def new_subscription_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(
             "Введите номер нового абонемента:",
-            reply_markup=ReplyKeyboardRemove()
+            reply_markup=remove_keyboard()
         )
         return config.STATES['NEW_SUBSCRIPTION_NUMBER']
 
@@ -112,15 +109,19 @@ class Handlers:
 
     async def new_subscription_amount(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
-            amount = float(update.message.text.replace(',', '.'))
+            amount = parse_amount(update.message.text)
             if amount <= 0:
                 raise ValueError
 
-            user = self.db.get_user(update.effective_user.id)
-            subscription_id = self.db.create_subscription(
+            user = await self.db.get_user(update.effective_user.id)
+            end_date = None
+            if config.SUBSCRIPTION_DAYS:
+                end_date = (datetime.now().date() + timedelta(days=config.SUBSCRIPTION_DAYS)).isoformat()
+            subscription_id = await self.db.create_subscription(
                 user_id=user['id'],
                 subscription_number=context.user_data['subscription_number'],
-                initial_amount=amount
+                initial_amount=amount,
+                end_date=end_date
             )
 
             await update.message.reply_text(
@@ -136,8 +137,8 @@ class Handlers:
             return config.STATES['NEW_SUBSCRIPTION_AMOUNT']
 
     async def add_training_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user = self.db.get_user(update.effective_user.id)
-        subscription = self.db.get_active_subscription(user['id'])
+        user = await self.db.get_user(update.effective_user.id)
+        subscription = await self.db.get_active_subscription(user['id'])
 
         if not subscription:
             await update.message.reply_text(
@@ -149,42 +150,76 @@ class Handlers:
 
         await update.message.reply_text(
             "Выберите продолжительность тренировки:",
-            reply_markup=get_duration_keyboard()
+            reply_markup=self._booking_options().duration_keyboard
         )
         return config.STATES['TRAINING_DURATION']
 
     async def training_duration(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         duration_text = update.message.text
-        if duration_text == '❌ Отмена':
+        if duration_text == CANCEL:
             await update.message.reply_text("Отменено", reply_markup=get_main_menu())
             return ConversationHandler.END
 
-        duration = int(duration_text.split()[0])
+        options = self._booking_options()
+        duration = options.parse_duration(duration_text)
+        if duration is None:
+            await update.message.reply_text(
+                "Выберите продолжительность кнопкой ниже:",
+                reply_markup=options.duration_keyboard
+            )
+            return config.STATES['TRAINING_DURATION']
         context.user_data['duration'] = duration
 
         await update.message.reply_text(
             "Сколько человек было на тренировке?",
-            reply_markup=get_participants_keyboard()
+            reply_markup=options.participants_keyboard(duration)
         )
         return config.STATES['TRAINING_PARTICIPANTS']
 
     async def training_participants(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         participants_text = update.message.text
-        if participants_text == '❌ Отмена':
+        if participants_text == CANCEL:
             await update.message.reply_text("Отменено", reply_markup=get_main_menu())
             return ConversationHandler.END
 
-        participants = int(participants_text.split()[0])
+        options = self._booking_options()
+        duration = context.user_data['duration']
+        participants = options.parse_participants(duration, participants_text)
+        if participants is None:
+            keyboard = options.participants_keyboard(duration)
+            if keyboard is None:
+                # Формат убрали из прайс-листа, пока пользователь выбирал
+                await update.message.reply_text(
+                    "Выберите продолжительность тренировки:",
+                    reply_markup=options.duration_keyboard
+                )
+                return config.STATES['TRAINING_DURATION']
+            await update.message.reply_text(
+                "Выберите число участников кнопкой ниже:",
+                reply_markup=keyboard
+            )
+            return config.STATES['TRAINING_PARTICIPANTS']
         context.user_data['participants'] = participants
 
         # Показываем стоимость
-        price = self.db.get_price(context.user_data['duration'], participants)
-        if price:
+        price = self.db.get_price(duration, participants)
+        context.user_data['partners'] = []
+        if price and participants > 1:
+            context.user_data['price'] = price
+            await update.message.reply_text(
+                f"Стоимость тренировки для каждого: {format_amount(price)}\n"
+                f"Если партнеры зарегистрированы в боте, введите их телефоны через запятую "
+                f"(до {participants - 1}) — им придет приглашение, и оплата спишется с их "
+                f"абонементов после подтверждения. Иначе нажмите «Пропустить».",
+                reply_markup=get_partners_keyboard()
+            )
+            return config.STATES['TRAINING_PARTNERS']
+        elif price:
             context.user_data['price'] = price
             await update.message.reply_text(
                 f"Стоимость тренировки: {format_amount(price)}\n"
-                f"Выберите тип покрытия корта:",
-                reply_markup=get_court_type_keyboard()
+                f"Выберите корт:",
+                reply_markup=self._court_options().keyboard
             )
             return config.STATES['TRAINING_COURT']
         else:
@@ -195,34 +230,181 @@ class Handlers:
             )
             return ConversationHandler.END
 
+    async def training_partners(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        text = update.message.text
+        if text == CANCEL:
+            await update.message.reply_text("Отменено", reply_markup=get_main_menu())
+            return ConversationHandler.END
+
+        if text != SKIP:
+            error = await self._resolve_partners(update, context, text)
+            if error:
+                await update.message.reply_text(f"❌ {error}\nПопробуйте еще раз:", reply_markup=get_partners_keyboard())
+                return config.STATES['TRAINING_PARTNERS']
+
+        await update.message.reply_text("Выберите корт:", reply_markup=self._court_options().keyboard)
+        return config.STATES['TRAINING_COURT']
+
+    async def _resolve_partners(self, update: Update, context: ContextTypes.DEFAULT_TYPE, text: str) -> Optional[str]:
+        """Находит партнеров по телефонам и сохраняет их в user_data; возвращает текст ошибки.
+
+        Ошибка одна на все ненайденные телефоны: по ответу бота нельзя узнать,
+        кто зарегистрирован под номером и что у него с абонементом.
+        """
+        phones = [phone.strip() for phone in re.split(r'[,;\n]', text) if phone.strip()]
+        invalid = [phone for phone in phones if not validate_phone(phone)]
+        if invalid:
+            return f"Неверный формат телефона: {', '.join(invalid)}"
+        phones = list(dict.fromkeys(format_phone(phone) for phone in phones))
+        if len(phones) >= context.user_data['participants']:
+            return f"Партнеров может быть не больше {context.user_data['participants'] - 1}"
+
+        users = await self.db.get_users_by_phones(phones)
+        if any(phone not in users for phone in phones):
+            return "Не удалось пригласить партнеров: проверьте, что они зарегистрированы в боте с этими телефонами"
+        if any(users[phone]['telegram_id'] == update.effective_user.id for phone in phones):
+            return "Укажите телефоны партнеров, а не свой"
+
+        context.user_data['partners'] = [
+            {'user_id': users[phone]['id'], 'telegram_id': users[phone]['telegram_id']} for phone in phones
+        ]
+        return None
+
+    def _booking_options(self) -> BookingOptions:
+        return get_booking_options(self.db.get_prices(), self.db.prices_version)
+
+    def _court_options(self) -> DirectoryOptions:
+        return get_directory_options('courts', self.db.get_courts(), self.db.directory_version)
+
+    def _coach_options(self) -> DirectoryOptions:
+        return get_directory_options('coaches', self.db.get_coaches(), self.db.directory_version)
+
     async def training_court(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        court_type = update.message.text
-        if court_type == 'Пропустить':
-            court_type = None
-        context.user_data['court_type'] = court_type
+        text = update.message.text
+        court_id = None
+        if text != SKIP:
+            court_id = self._court_options().parse(text)
+            if court_id is None:
+                await update.message.reply_text(
+                    "Выберите корт кнопкой ниже:",
+                    reply_markup=self._court_options().keyboard
+                )
+                return config.STATES['TRAINING_COURT']
+        context.user_data['court_id'] = court_id
+        context.user_data['court_type'] = self.db.get_courts()[court_id] if court_id else None
 
         await update.message.reply_text(
-            "Введите имя тренера (или 'Пропустить'):",
-            reply_markup=ReplyKeyboardRemove()
+            "Выберите тренера (или «Пропустить»):",
+            reply_markup=self._coach_options().keyboard
         )
         return config.STATES['TRAINING_COACH']
 
     async def training_coach(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        coach = update.message.text
-        if coach.lower() == 'пропустить':
-            coach = None
+        text = update.message.text
+        coach_id = None
+        if text != SKIP:
+            coach_id = self._coach_options().parse(text)
+            if coach_id is None:
+                await update.message.reply_text(
+                    "Выберите тренера кнопкой ниже:",
+                    reply_markup=self._coach_options().keyboard
+                )
+                return config.STATES['TRAINING_COACH']
+        context.user_data['coach_id'] = coach_id
+        context.user_data['coach'] = self.db.get_coaches()[coach_id] if coach_id else None
+
+        await update.message.reply_text(
+            "Когда тренировка? «Сейчас» — записать текущую, или выберите день для бронирования:",
+            reply_markup=get_booking_date_keyboard(datetime.now().date(), config.BOOKING_DAYS)
+        )
+        return config.STATES['TRAINING_DATE']
+
+    async def training_date(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        text = update.message.text
+        if text == CANCEL:
+            await update.message.reply_text("Отменено", reply_markup=get_main_menu())
+            return ConversationHandler.END
+        if text == NOW:
+            return await self._book_training(update, context)
+
+        today = datetime.now().date()
+        day = booking_days(today, config.BOOKING_DAYS).get(text)
+        if day is None:
+            await update.message.reply_text(
+                "Выберите день кнопкой ниже:",
+                reply_markup=get_booking_date_keyboard(today, config.BOOKING_DAYS)
+            )
+            return config.STATES['TRAINING_DATE']
+
+        slots = await self._free_slots(context, day)
+        if not slots:
+            await update.message.reply_text(
+                f"❌ На {format_date(day)} свободного времени нет. Выберите другой день:",
+                reply_markup=get_booking_date_keyboard(today, config.BOOKING_DAYS)
+            )
+            return config.STATES['TRAINING_DATE']
+
+        context.user_data['day'] = day
+        await update.message.reply_text(
+            f"Свободное время на {format_date(day)}. Выберите начало тренировки или введите его в формате ЧЧ:ММ:",
+            reply_markup=get_time_slots_keyboard(slots)
+        )
+        return config.STATES['TRAINING_TIME']
 
-        user = self.db.get_user(update.effective_user.id)
-        subscription = self.db.get_active_subscription(user['id'])
+    async def training_time(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        text = update.message.text.strip()
+        if text == CANCEL:
+            await update.message.reply_text("Отменено", reply_markup=get_main_menu())
+            return ConversationHandler.END
 
         try:
-            training_id = self.db.add_training_session(
-                user_id=user['id'],
-                subscription_id=subscription['id'],
+            start = datetime.strptime(f"{context.user_data['day']} {text}", '%Y-%m-%d %H:%M')
+        except ValueError:
+            start = None
+        # Введенное вручную время принимается, только если это один из свободных слотов:
+        # так соблюдаются часы работы клуба и сетка расписания
+        slots = await self._free_slots(context, context.user_data['day'])
+        if start is None or f"{start:%H:%M}" not in slots:
+            await update.message.reply_text(
+                "❌ Выберите свободное время кнопкой ниже или введите его в формате ЧЧ:ММ:"
+                if slots else "❌ Свободного времени на этот день не осталось",
+                reply_markup=get_time_slots_keyboard(slots) if slots else get_main_menu()
+            )
+            return config.STATES['TRAINING_TIME'] if slots else ConversationHandler.END
+
+        return await self._book_training(update, context, start)
+
+    async def _free_slots(self, context: ContextTypes.DEFAULT_TYPE, day: str) -> List[str]:
+        """Свободные начала тренировки на день для выбранных корта и тренера, не раньше текущего момента"""
+        court = context.user_data.get('court_id')
+        availability = await self.db.get_availability(
+            date.fromisoformat(day), 1, context.user_data['duration'], [court], context.user_data.get('coach_id'),
+            opening=config.CLUB_OPENING, closing=config.CLUB_CLOSING, step=config.SLOT_MINUTES
+        )
+        slots = availability[(day, court)]
+        now = datetime.now()
+        if day == now.date().isoformat():
+            slots = [slot for slot in slots if slot > now.strftime('%H:%M')]
+        return slots
+
+    async def _book_training(self, update: Update, context: ContextTypes.DEFAULT_TYPE, start: datetime = None):
+        coach = context.user_data['coach']
+        user = await self.db.get_user(update.effective_user.id)
+        subscription = await self.db.get_active_subscription(user['id'])
+
+        try:
+            if not subscription:
+                raise ValueError("Нет активного абонемента")
+
+            partners = context.user_data.get('partners', [])
+            training_id, balances = await self.db.add_group_training(
+                [(user['id'], subscription['id'])],
                 duration=context.user_data['duration'],
                 participants=context.user_data['participants'],
-                court_type=context.user_data['court_type'],
-                coach=coach
+                court_id=context.user_data.get('court_id'),
+                coach_id=context.user_data.get('coach_id'),
+                start=start,
+                partner_ids=[partner['user_id'] for partner in partners]
             )
 
             message = (
@@ -230,10 +412,29 @@ class Handlers:
                 f"Продолжительность: {context.user_data['duration']} мин\n"
                 f"Участников: {context.user_data['participants']}\n"
                 f"Стоимость: {format_amount(context.user_data['price'])}\n"
-                f"Тип корта: {context.user_data['court_type'] or 'Не указан'}\n"
+                f"Корт: {context.user_data['court_type'] or 'Не указан'}\n"
                 f"Тренер: {coach or 'Не указан'}\n"
-                f"Баланс: {format_amount(subscription['current_balance'])}"
+                f"Баланс: {format_amount(balances[user['id']])}"
             )
+            if start:
+                message += f"\nНачало: {format_date(start.date().isoformat())} {start:%H:%M}"
+
+            # Партнеры платят сами, когда подтвердят участие
+            invitations = await self.db.create_invitations(
+                training_id, user['id'], [partner['user_id'] for partner in partners]
+            )
+            if invitations:
+                message += f"\nПриглашения отправлены: {len(invitations)}"
+            chat_ids = {partner['user_id']: partner['telegram_id'] for partner in partners}
+            for invitation_id, partner_id in invitations:
+                await self.send_queue.enqueue(
+                    chat_ids[partner_id],
+                    f"🎾 {user['first_name']} приглашает вас на тренировку: "
+                    f"{context.user_data['duration']} мин, {context.user_data['participants']} чел."
+                    f"{f' — {start:%d.%m.%Y %H:%M}' if start else ''}\n"
+                    f"После подтверждения с вашего абонемента спишется {format_amount(context.user_data['price'])}",
+                    reply_markup=get_invitation_keyboard(invitation_id)
+                )
 
         except ValueError as e:
             message = f"❌ Ошибка: {str(e)}"
@@ -241,6 +442,36 @@ class Handlers:
         await update.message.reply_text(message, reply_markup=get_main_menu())
         return ConversationHandler.END
 
+    async def invitation_response(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Партнер подтверждает или отклоняет приглашение на тренировку"""
+        query = update.callback_query
+        await query.answer()
+
+        _, action, invitation_id = query.data.split(':')
+        user = await self.db.get_user(update.effective_user.id)
+        if not user:
+            return
+        try:
+            invitation = await self.db.respond_invitation(int(invitation_id), user['id'], action == 'accept')
+        except ValueError as e:
+            # Кнопки остаются: например, после пополнения абонемента можно подтвердить снова
+            await query.message.reply_text(f"❌ {e}")
+            return
+
+        name = f"{user['first_name']} {user['last_name'] or ''}".strip()
+        when = f"{format_date(invitation['session_date'])} {invitation['session_time'][:5]}"
+        if invitation['status'] == 'accepted':
+            await query.edit_message_text(
+                f"{query.message.text}\n\n✅ Участие подтверждено\n"
+                f"Списано: {format_amount(invitation['amount_paid'])}\n"
+                f"Баланс: {format_amount(invitation['balance'])}"
+            )
+            notice = f"✅ {name} подтвердил(а) участие в тренировке {when}"
+        else:
+            await query.edit_message_text(f"{query.message.text}\n\n❌ Приглашение отклонено")
+            notice = f"❌ {name} отклонил(а) приглашение на тренировку {when}"
+        await self.send_queue.enqueue(invitation['invited_by_telegram_id'], notice)
+
     async def show_stats_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(
             "Выберите период для статистики:",
@@ -262,80 +493,311 @@ class Handlers:
         }
 
         period = period_map.get(period_text, 'month')
-        user = self.db.get_user(update.effective_user.id)
-
-        # Получаем статистику
-        spent_amount = self.db.get_spent_amount(user['id'], period)
-        training_count = self.db.get_training_count(user['id'], period)
-
-        # Статистика по типам тренировок
-        individual = self.db.get_training_count(user['id'], period, 1)
-        pair = self.db.get_training_count(user['id'], period, 2)
-        group_3 = self.db.get_training_count(user['id'], period, 3)
-        group_4 = self.db.get_training_count(user['id'], period, 4)
-
-        message = (
-            f"📊 <b>Статистика за {get_period_name(period)}</b>\n\n"
-            f"💰 Потрачено: <b>{format_amount(spent_amount)}</b>\n"
-            f"🎾 Всего тренировок: <b>{training_count}</b>\n\n"
-            f"<b>По типам тренировок:</b>\n"
-            f"• Индивидуальные: {individual}\n"
-            f"• Вдвоем: {pair}\n"
-            f"• Втроем: {group_3}\n"
-            f"• Вчетвером: {group_4}"
-        )
+        user = await self.db.get_user(update.effective_user.id)
+
+        # Получаем статистику и разбивку по типам тренировок одним запросом
+        stats = await self.db.get_stats_summary(user['id'], period)
 
-        await update.message.reply_text(message, parse_mode=ParseMode.HTML, reply_markup=get_main_menu())
+        await update.message.reply_text(
+            render_stats(period, stats), parse_mode=ParseMode.HTML, reply_markup=get_main_menu()
+        )
         return ConversationHandler.END
 
+    HISTORY_PAGE_SIZE = 10
+
     async def show_training_history(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user = self.db.get_user(update.effective_user.id)
-        trainings = self.db.get_user_trainings(user['id'], limit=10)
+        user = await self.db.get_user(update.effective_user.id)
+        message, keyboard = await self._training_history_page(user['id'])
 
-        if not trainings:
+        if message is None:
             await update.message.reply_text("У вас еще нет тренировок.")
             return
 
-        message = "📋 <b>Последние тренировки:</b>\n\n"
-        for training in trainings:
-            message += (
-                f"📅 {format_date(training['session_date'])}\n"
-                f"   ⏱ {training['duration_minutes']} мин"
-                f" | 👥 {training['participants_count']} чел."
-                f" | 💰 {format_amount(training['amount_paid'])}\n"
-            )
-            if training['court_type'] or training['coach_name']:
-                message += f"   🎾 {training['court_type'] or ''}"
-                if training['coach_name']:
-                    message += f" | 👨‍🏫 {training['coach_name']}"
-                message += "\n"
-            message += "\n"
+        await update.message.reply_text(message, parse_mode=ParseMode.HTML, reply_markup=keyboard)
 
-        await update.message.reply_text(message, parse_mode=ParseMode.HTML)
+    async def training_history_page(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Листание истории кнопками «Старше»/«Новее»"""
+        query = update.callback_query
+        await query.answer()
+
+        _, direction, cursor = query.data.split(':', 2)
+        session_date, session_time, session_id = cursor.split('|')
+        cursor = (session_date, session_time, int(session_id))
+
+        user = await self.db.get_user(update.effective_user.id)
+        if direction == 'older':
+            message, keyboard = await self._training_history_page(user['id'], before=cursor)
+        else:
+            message, keyboard = await self._training_history_page(user['id'], after=cursor)
+
+        if message is not None:
+            await query.edit_message_text(message, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+
+    async def _training_history_page(self, user_id: int, before: tuple = None, after: tuple = None):
+        """Текст страницы истории и кнопки навигации; (None, None), если страница пуста"""
+        # Запрашиваем на одну запись больше, чтобы узнать, есть ли следующая страница
+        trainings = await self.db.get_user_trainings(
+            user_id, limit=self.HISTORY_PAGE_SIZE + 1, before=before, after=after
+        )
+        if not trainings:
+            return None, None
+
+        has_more = len(trainings) > self.HISTORY_PAGE_SIZE
+        if after:
+            trainings = trainings[-self.HISTORY_PAGE_SIZE:]
+            has_older, has_newer = True, has_more
+        else:
+            trainings = trainings[:self.HISTORY_PAGE_SIZE]
+            has_older, has_newer = has_more, before is not None
+
+        message = render_history(HISTORY_TITLE if before or after else HISTORY_TITLE_LATEST, trainings)
+        keyboard = get_history_navigation_keyboard(
+            older_cursor=self._history_cursor(trainings[-1]) if has_older else None,
+            newer_cursor=self._history_cursor(trainings[0]) if has_newer else None
+        )
+        return message, keyboard
+
+    @staticmethod
+    def _history_cursor(training: Dict) -> str:
+        return f"{training['session_date']}|{training['session_time']}|{training['training_session_id']}"
 
     async def show_profile(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user = self.db.get_user(update.effective_user.id)
-        subscription = self.db.get_active_subscription(user['id'])
-        total_trainings = self.db.get_training_count(user['id'], 'all')
-
-        message = (
-            f"👤 <b>Ваш профиль</b>\n\n"
-            f"Имя: {user['first_name']} {user['last_name'] or ''}\n"
-            f"Телефон: {user['phone'] or 'Не указан'}\n"
-            f"Дата регистрации: {format_date(user['registration_date'])}\n\n"
-            f"🎾 Всего тренировок: <b>{total_trainings}</b>\n"
+        user = await self.db.get_user(update.effective_user.id)
+        subscription = await self.db.get_active_subscription(user['id'])
+        total_trainings = await self.db.get_training_count(user['id'], 'all')
+
+        await update.message.reply_text(
+            render_profile(user, subscription, total_trainings), parse_mode=ParseMode.HTML
         )
 
-        if subscription:
-            message += (
-                f"💰 Активный абонемент: {subscription['subscription_number']}\n"
-                f"Баланс: {format_amount(subscription['current_balance'])}"
+    async def set_price(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/setprice <минуты> <участники> <цена> — изменение прайс-листа администратором"""
+        if update.effective_user.id not in config.ADMIN_IDS:
+            return
+
+        try:
+            duration, participants, price = context.args
+            duration, participants = int(duration), int(participants)
+            price = parse_amount(price)
+            if duration <= 0 or participants <= 0 or price <= 0:
+                raise ValueError
+        except ValueError:
+            await update.message.reply_text(
+                "Использование: /setprice <минуты> <участники> <цена>\n"
+                "Например: /setprice 60 1 1500"
             )
+            return
+
+        await self.db.set_price(duration, participants, price)
+        await update.message.reply_text(
+            f"✅ Цена обновлена: {duration} мин, {participants} чел. — {format_amount(price)}"
+        )
+
+    async def coach_directory(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/coach [add|remove <имя>] — список тренеров и его изменение"""
+        await self._edit_directory(update, context, 'coaches', 'coach', "👨‍🏫 Тренеры")
+
+    async def court_directory(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/court [add <название>[; покрытие]|remove <название>] — список кортов и его изменение"""
+        await self._edit_directory(update, context, 'courts', 'court', "🎾 Корты")
+
+    async def _edit_directory(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                              table: str, command: str, title: str):
+        if update.effective_user.id not in config.ADMIN_IDS:
+            return
+
+        action = context.args[0] if context.args else None
+        name = ' '.join(context.args[1:])
+        surface = None
+        if table == 'courts' and ';' in name:
+            name, surface = (part.strip() for part in name.split(';', 1))
+        if action is None:
+            entries = self.db.get_coaches() if table == 'coaches' else self.db.get_courts()
+            await update.message.reply_text(
+                f"{title}:\n" + ("\n".join(f"• {entry}" for entry in entries.values()) or "список пуст")
+            )
+            return
+        if action not in ('add', 'remove') or not name:
+            usage = "add <название>[; покрытие]|remove <название>" if table == 'courts' else "add|remove <имя>"
+            await update.message.reply_text(f"Использование: /{command} [{usage}]")
+            return
+
+        if await self.db.set_directory_entry(table, name, action == 'add', surface or None):
+            await update.message.reply_text(f"✅ {'Добавлено' if action == 'add' else 'Скрыто'}: {name}")
         else:
-            message += "❌ Нет активного абонемента"
+            await update.message.reply_text(f"❌ Не найдено: {name}")
+
+    async def cache_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/cachestats — состояние кэшей пользователей и абонементов"""
+        if update.effective_user.id not in config.ADMIN_IDS:
+            return
+
+        names = {'users': 'Пользователи', 'subscriptions': 'Абонементы'}
+        message = "🗂 <b>Кэши</b>\n"
+        for name, stats in (await self.db.cache_stats()).items():
+            message += (
+                f"\n<b>{names[name]}</b>: {stats['size']} записей\n"
+                f"Попадания: {stats['hits']}, промахи: {stats['misses']} "
+                f"({stats['hit_rate']:.0%})\n"
+            )
 
         await update.message.reply_text(message, parse_mode=ParseMode.HTML)
 
+    async def club_summary(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/club [week|month|year|all] — сводка по клубу для администраторов"""
+        if update.effective_user.id not in config.ADMIN_IDS:
+            return
+
+        period = context.args[0] if context.args else 'month'
+        if period not in ('week', 'month', 'year', 'all'):
+            await update.message.reply_text("Использование: /club [week|month|year|all]")
+            return
+
+        summary = await self.db.get_club_summary(period)
+        lines = [
+            f"🏟 <b>Клуб за {get_period_name(period)}</b>",
+            "",
+            f"💰 Выручка: <b>{format_amount(summary['revenue'])}</b>",
+            f"🎾 Тренировок: <b>{summary['sessions']}</b>, игроков: {summary['participants']}",
+            f"⏱ Загрузка кортов: {summary['minutes'] / 60:.1f} ч",
+            "",
+            "<b>Тренеры:</b>",
+        ]
+        for coach, sessions, minutes, amount in summary['by_coach'][:10]:
+            lines.append(f"• {coach or 'Без тренера'}: {sessions} трен., {minutes / 60:.1f} ч, {format_amount(amount)}")
+
+        lines += ["", "<b>Корты:</b>"]
+        for court, sessions, minutes, amount in summary['by_court']:
+            lines.append(f"• {court or 'Не указан'}: {sessions} трен., {minutes / 60:.1f} ч")
+
+        lines += ["", "<b>Форматы:</b>"]
+        for participants, sessions, players, amount in summary['by_format']:
+            lines.append(f"• {participants} чел.: {sessions} трен., {format_amount(amount)}")
+
+        lines += [
+            "",
+            f"📝 Активных абонементов: {summary['active_subscriptions']}",
+            f"💳 Остаток на абонементах: <b>{format_amount(summary['liabilities'])}</b>",
+            f"<i>Данные на {summary['generated_at']:%d.%m.%Y %H:%M}</i>",
+        ]
+
+        await update.message.reply_text("\n".join(lines), parse_mode=ParseMode.HTML)
+
+    async def broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/broadcast <текст> — рассылка сообщения всем пользователям"""
+        if update.effective_user.id not in config.ADMIN_IDS:
+            return
+
+        text = update.message.text.partition(' ')[2].strip()
+        if not text:
+            await update.message.reply_text("Использование: /broadcast <текст сообщения>")
+            return
+
+        await update.message.reply_text("📣 Рассылка запущена")
+        context.application.create_task(
+            self._broadcast(update.effective_chat.id, text),
+            update=update
+        )
+
+    async def _broadcast(self, admin_chat_id: int, text: str, batch_size: int = 500):
+        """Обходит пользователей пачками и ставит сообщения в очередь отправки"""
+        results = {'sent': 0, 'failed': 0}
+
+        def count_result(future: asyncio.Future):
+            results['failed' if future.exception() else 'sent'] += 1
+
+        last_id = 0
+        while True:
+            users = await self.db.get_user_chat_ids(last_id, batch_size)
+            if not users:
+                break
+            last_id = users[-1][0]
+            for _, telegram_id in users:
+                # enqueue ждет свободного места, поэтому в памяти не больше размера очереди
+                future = await self.send_queue.enqueue(telegram_id, text)
+                future.add_done_callback(count_result)
+
+        await self.send_queue.join()
+        await self.send_queue.enqueue(
+            admin_chat_id,
+            f"✅ Рассылка завершена: доставлено {results['sent']}, ошибок {results['failed']}"
+        )
+
+    ALERT_TEMPLATES = {
+        'low_balance': "⚠️ На абонементе {number} осталось {balance}.\nНе забудьте пополнить абонемент.",
+        'exhausted': "❌ На абонементе {number} не хватает средств на тренировку (остаток {balance}).\n"
+                     "Оформите новый абонемент через меню.",
+        'expiring': "⏳ Абонемент {number} действует до {end_date}. Остаток: {balance}.",
+        'expired': "⌛ Срок действия абонемента {number} истек.",
+    }
+
+    async def notify_subscriptions(self, context: ContextTypes.DEFAULT_TYPE):
+        """Периодическая задача: предупреждения о балансе и сроке абонементов"""
+        alerts = await self.db.collect_subscription_alerts(
+            config.LOW_BALANCE_THRESHOLD, config.EXPIRY_NOTICE_DAYS
+        )
+        for alert in alerts:
+            text = self.ALERT_TEMPLATES[alert['kind']].format(
+                number=alert['subscription_number'],
+                balance=format_amount(alert['balance']),
+                end_date=format_date(alert['end_date']) if alert['end_date'] else ''
+            )
+            # Очередь ограничена по размеру и сама выдерживает лимиты Telegram
+            await self.send_queue.enqueue(alert['telegram_id'], text)
+        if alerts:
+            logger.info("Поставлено в очередь уведомлений об абонементах: %s", len(alerts))
+
+    async def ledger_maintenance(self, context: ContextTypes.DEFAULT_TYPE):
+        """Периодическая задача: снимки балансов и сверка абонементов с журналом"""
+        snapshots = await self.db.take_balance_snapshots()
+        mismatches = await self.db.reconcile_balances()
+        logger.info("Снимков балансов: %s, расхождений с журналом: %s", snapshots, len(mismatches))
+        if not mismatches:
+            return
+
+        lines = [f"⚠️ Балансы расходятся с журналом операций: {len(mismatches)}"]
+        for subscription_id, number, balance, ledger_balance in mismatches[:10]:
+            lines.append(f"• {number}: {format_amount(balance)}, по журналу {format_amount(ledger_balance)}")
+        for admin_id in config.ADMIN_IDS:
+            await self.send_queue.enqueue(admin_id, "\n".join(lines))
+
+    # Telegram не принимает от ботов файлы больше 50 МБ
+    MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+    async def export_ledger(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/export [telegram_id] — выгрузка журнала операций клуба или одного игрока"""
+        if update.effective_user.id not in config.ADMIN_IDS:
+            return
+
+        try:
+            telegram_id = int(context.args[0]) if context.args else None
+        except ValueError:
+            await update.message.reply_text("Использование: /export [telegram_id]")
+            return
+
+        await update.message.reply_text("⏳ Готовлю выгрузку...")
+
+        with tempfile.TemporaryFile() as f:
+            # Выгрузка идет в отдельном потоке и на диск, не занимая пул БД и память
+            rows = await asyncio.to_thread(
+                write_ledger_csv, self.db.db, f, telegram_id, True
+            )
+            size = f.tell()
+            if size > self.MAX_DOCUMENT_SIZE:
+                await update.message.reply_text(
+                    "❌ Выгрузка слишком велика для Telegram.\n"
+                    "Воспользуйтесь командой: python cli.py export"
+                )
+                return
+
+            f.seek(0)
+            filename = f"ledger_{telegram_id or 'club'}.csv.gz"
+            await update.message.reply_document(
+                document=f,
+                filename=filename,
+                caption=f"📄 Журнал операций: {rows} строк"
+            )
+
     async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(
             "Действие отменено.",
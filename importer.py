@@ -0,0 +1,288 @@
+"""Массовый импорт истории тренировок из CSV или JSON.
+
+Каждая запись — участие одного игрока в тренировке:
+
+    telegram_id, first_name, last_name, phone,
+    subscription_number, initial_amount,
+    session_date, session_time, duration_minutes, participants_count,
+    court_type, coach_name, amount
+
+Суммы указываются в рублях. Пользователи, абонементы, тренеры и корты
+создаются при первом упоминании; amount, если не указан, берется из прайс-листа. Файл читается потоково и записывается
+пачками в отдельных транзакциях, поэтому расход памяти не зависит от его размера.
+
+Тренеры и корты, которых нет в справочниках, создаются скрытыми: в истории
+часто записан тип покрытия, а не корт, и предлагать его при записи нельзя.
+Администратор может вернуть нужные записи командами /coach и /court.
+"""
+import csv
+import json
+import time
+from datetime import datetime
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from database import Database
+from utils import format_phone, parse_amount
+
+REQUIRED_FIELDS = ('telegram_id', 'first_name', 'subscription_number', 'initial_amount',
+                   'session_date', 'duration_minutes', 'participants_count')
+
+
+def read_csv(path: str) -> Iterator[Dict]:
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        yield from csv.DictReader(f)
+
+
+def read_json(path: str, chunk_size: int = 1 << 16) -> Iterator[Dict]:
+    """Читает JSON Lines или JSON-массив объектов, не загружая файл целиком"""
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8-sig') as f:
+        buffer = f.read(chunk_size).lstrip()
+        in_array = buffer.startswith('[')
+        if in_array:
+            buffer = buffer[1:]
+
+        while True:
+            buffer = buffer.lstrip().lstrip(',').lstrip()
+            if in_array and buffer.startswith(']'):
+                return
+            try:
+                record, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                more = f.read(chunk_size)
+                if not more:
+                    if buffer.strip():
+                        raise
+                    return
+                buffer += more
+                continue
+            yield record
+            buffer = buffer[end:]
+
+
+def read_records(path: str) -> Iterator[Dict]:
+    if path.lower().endswith(('.json', '.jsonl', '.ndjson')):
+        return read_json(path)
+    return read_csv(path)
+
+
+def _parse_date(value: str) -> str:
+    value = value.strip()
+    for fmt in ('%Y-%m-%d', '%d.%m.%Y'):
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            pass
+    raise ValueError(f"неизвестный формат даты: {value}")
+
+
+def _parse_time(value: str) -> str:
+    value = value.strip()
+    for fmt in ('%H:%M:%S', '%H:%M', '%H.%M'):
+        try:
+            return datetime.strptime(value, fmt).time().isoformat()
+        except ValueError:
+            pass
+    raise ValueError(f"неизвестный формат времени: {value}")
+
+
+def _optional(record: Dict, field: str) -> Optional[str]:
+    value = record.get(field)
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+class TrainingImporter:
+    """Импорт записей пачками с проверкой баланса абонементов.
+
+    Балансы абонементов ведутся в памяти по ходу импорта: запись, для которой
+    не хватает средств или не найдена цена, отклоняется, а не прерывает импорт.
+    """
+
+    def __init__(self, db: Database, chunk_size: int = 5000,
+                 progress: Callable[[Dict], None] = None):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self._user_ids = {}
+        self._subscriptions = {}
+        # Справочники: таблица -> {имя из файла: id}
+        self._directory_ids = {table: {} for table in Database.DIRECTORIES}
+        self.stats = {'rows': 0, 'imported': 0, 'rejected': 0, 'elapsed': 0.0}
+        self.errors = []
+
+    def run(self, records: Iterable[Dict]) -> Dict:
+        started = time.perf_counter()
+        records = iter(records)
+        while True:
+            chunk = list(islice(records, self.chunk_size))
+            if not chunk:
+                break
+            self._import_chunk(chunk)
+            self.stats['elapsed'] = time.perf_counter() - started
+            if self.progress:
+                self.progress(self.stats)
+        self.stats['elapsed'] = time.perf_counter() - started
+        self.db.load_directories()
+        return self.stats
+
+    def _reject(self, line: int, reason: str):
+        self.stats['rejected'] += 1
+        # Храним только первые ошибки, чтобы память не росла вместе с файлом
+        if len(self.errors) < 100:
+            self.errors.append((line, reason))
+
+    def _import_chunk(self, chunk: List[Dict]):
+        first_line = self.stats['rows'] + 1
+        self.stats['rows'] += len(chunk)
+
+        with self.db.write_connection() as conn:
+            rows = []
+            for line, record in enumerate(chunk, first_line):
+                try:
+                    row = self._prepare(conn, record)
+                except (KeyError, TypeError, ValueError) as e:
+                    self._reject(line, str(e))
+                    continue
+                row['line'] = line
+                rows.append(row)
+
+            # Проверяем баланс и формируем строки для вставки
+            accepted = []
+            charges = {}
+            for row in rows:
+                subscription = self._subscriptions[row['subscription_number']]
+                if subscription['balance'] < row['amount']:
+                    self._reject(row['line'], f"недостаточно средств на абонементе {row['subscription_number']}")
+                    continue
+                subscription['balance'] -= row['amount']
+                charges[subscription['id']] = charges.get(subscription['id'], 0) + row['amount']
+                row['subscription_id'] = subscription['id']
+                accepted.append(row)
+
+            if not accepted:
+                return
+
+            # Писатель единственный и держит блокировку, поэтому id новых
+            # тренировок идут подряд после текущего значения последовательности
+            last_id = conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'training_sessions'"
+            ).fetchone()[0]
+            conn.executemany('''
+                INSERT INTO training_sessions (session_date, session_time, duration_minutes, court_id, coach_id)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(row['session_date'], row['session_time'], row['duration'], row['court_id'], row['coach_id'])
+                  for row in accepted])
+            for session_id, row in enumerate(accepted, last_id + 1):
+                row['session_id'] = session_id
+
+            conn.executemany('''
+                INSERT INTO training_participants
+                (training_session_id, user_id, subscription_id, amount_paid, participants_count,
+                 session_date, session_time)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [(row['session_id'], row['user_id'], row['subscription_id'], row['amount'], row['participants'],
+                   row['session_date'], row['session_time'])
+                  for row in accepted])
+
+            conn.executemany('''
+                INSERT INTO transactions
+                (user_id, subscription_id, training_session_id, transaction_type, amount, description, created_at)
+                VALUES (?, ?, ?, 'training', ?, ?, ?)
+            ''', [(row['user_id'], row['subscription_id'], row['session_id'], row['amount'],
+                   f"Тренировка: {row['duration']}мин, {row['participants']} чел.",
+                   f"{row['session_date']} {row['session_time']}")
+                  for row in accepted])
+
+            conn.executemany(self.db.USER_STATS_UPSERT, [
+                (row['user_id'], row['session_date'], row['participants'], row['duration'], row['amount'])
+                for row in accepted
+            ])
+            conn.executemany(self.db.CLUB_STATS_UPSERT, [
+                (row['session_date'], row['coach_id'] or 0, row['court_id'] or 0, row['participants'],
+                 1, 1, row['duration'], row['amount'])
+                for row in accepted
+            ])
+
+            conn.executemany(
+                'UPDATE subscriptions SET current_balance = current_balance - ? WHERE id = ?',
+                [(amount, subscription_id) for subscription_id, amount in charges.items()]
+            )
+
+        self.stats['imported'] += len(accepted)
+
+    def _prepare(self, conn, record: Dict) -> Dict:
+        missing = [field for field in REQUIRED_FIELDS if not _optional(record, field)]
+        if missing:
+            raise ValueError(f"не заполнены поля: {', '.join(missing)}")
+
+        duration = int(record['duration_minutes'])
+        participants = int(record['participants_count'])
+        amount = _optional(record, 'amount')
+        amount = parse_amount(amount) if amount else self.db.get_price(duration, participants)
+        if amount is None:
+            raise ValueError(f"нет цены для {duration} мин, {participants} чел.")
+
+        session_date = _parse_date(str(record['session_date']))
+        session_time = _optional(record, 'session_time')
+        session_time = _parse_time(session_time) if session_time else '00:00:00'
+        row = {
+            'user_id': self._resolve_user(conn, record),
+            'subscription_number': str(record['subscription_number']).strip(),
+            'session_date': session_date,
+            'session_time': session_time,
+            'duration': duration,
+            'participants': participants,
+            'court_id': self._resolve_directory(conn, 'courts', _optional(record, 'court_type')),
+            'coach_id': self._resolve_directory(conn, 'coaches', _optional(record, 'coach_name')),
+            'amount': amount,
+        }
+        self._resolve_subscription(conn, row, record)
+        return row
+
+    def _resolve_user(self, conn, record: Dict) -> int:
+        telegram_id = int(record['telegram_id'])
+        user_id = self._user_ids.get(telegram_id)
+        if user_id is None:
+            phone = _optional(record, 'phone')
+            conn.execute('''
+                INSERT OR IGNORE INTO users (telegram_id, first_name, last_name, phone)
+                VALUES (?, ?, ?, ?)
+            ''', (telegram_id, record['first_name'].strip(), _optional(record, 'last_name'),
+                  format_phone(phone) if phone else None))
+            user_id = conn.execute('SELECT id FROM users WHERE telegram_id = ?', (telegram_id,)).fetchone()[0]
+            self._user_ids[telegram_id] = user_id
+        return user_id
+
+    def _resolve_directory(self, conn, table: str, name: Optional[str]) -> Optional[int]:
+        if name is None:
+            return None
+        ids = self._directory_ids[table]
+        if name not in ids:
+            ids.update(self.db.resolve_directory_ids(conn, table, [name], active=False))
+        return ids[name]
+
+    def _resolve_subscription(self, conn, row: Dict, record: Dict):
+        number = row['subscription_number']
+        if number in self._subscriptions:
+            if self._subscriptions[number]['user_id'] != row['user_id']:
+                raise ValueError(f"абонемент {number} принадлежит другому пользователю")
+            return
+
+        initial_amount = parse_amount(record['initial_amount'])
+        created = conn.execute('''
+            INSERT OR IGNORE INTO subscriptions (user_id, subscription_number, initial_amount, current_balance, start_date)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (row['user_id'], number, initial_amount, initial_amount, row['session_date'])).rowcount
+        subscription_id, user_id, balance = conn.execute(
+            'SELECT id, user_id, current_balance FROM subscriptions WHERE subscription_number = ?',
+            (number,)
+        ).fetchone()
+        if created:
+            self.db.record_topup(conn, subscription_id)
+        if user_id != row['user_id']:
+            raise ValueError(f"абонемент {number} принадлежит другому пользователю")
+        self._subscriptions[number] = {'id': subscription_id, 'user_id': user_id, 'balance': balance}
@@ -1,50 +1,205 @@
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Dict, List, Optional
+
 from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton
 
+from utils import duration_label, name_key, participants_label
+
+
+class StaticReplyKeyboard(ReplyKeyboardMarkup):
+    """Неизменяемая клавиатура, сериализованная один раз при создании.
+
+    Bot API вызывает to_dict у reply_markup при каждой отправке; для
+    постоянных клавиатур отдаем готовый словарь.
+    """
+
+    __slots__ = ('_serialized',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        with self._unfrozen():
+            self._serialized = super().to_dict()
+
+    def to_dict(self, recursive: bool = True) -> dict:
+        # Поверхностная копия: вызывающий код может дополнять словарь верхнего уровня
+        return dict(self._serialized)
+
+
+CANCEL = '❌ Отмена'
+SKIP = 'Пропустить'
+NOW = '▶️ Сейчас'
+
+# Клавиатуры не меняются, поэтому создаются один раз при импорте.
+# Объекты python-telegram-bot неизменяемы, и один экземпляр можно
+# безопасно отдавать во все ответы.
+MAIN_MENU = StaticReplyKeyboard([
+    ['🎾 Добавить тренировку', '💰 Баланс абонемента'],
+    ['📊 Статистика', '📝 Новый абонемент'],
+    ['📋 История тренировок', '👤 Профиль']
+], resize_keyboard=True)
+
+PARTNERS_KEYBOARD = StaticReplyKeyboard([
+    [SKIP, CANCEL]
+], resize_keyboard=True)
+
+STATS_PERIOD_KEYBOARD = StaticReplyKeyboard([
+    ['📅 За неделю', '📅 За месяц'],
+    ['📅 За год', '📅 За все время'],
+    ['❌ Отмена']
+], resize_keyboard=True)
+
+PARTICIPANTS_FILTER_KEYBOARD = StaticReplyKeyboard([
+    ['Все', '1 человек', '2 человека'],
+    ['3 человека', '4 человека', '❌ Отмена']
+], resize_keyboard=True)
+
+REMOVE_KEYBOARD = ReplyKeyboardRemove()
+
+
+
+def _menu_keyboard(labels: List[str], per_row: int = 2, last: str = CANCEL) -> StaticReplyKeyboard:
+    """Кнопки по per_row в ряд, last («Отмена») — в последнем ряду, если там есть место"""
+    rows = [labels[i:i + per_row] for i in range(0, len(labels), per_row)]
+    if rows and len(rows[-1]) < per_row:
+        rows[-1].append(last)
+    else:
+        rows.append([last])
+    return StaticReplyKeyboard(rows, resize_keyboard=True)
+
+
+class BookingOptions:
+    """Клавиатуры записи на тренировку, построенные по прайс-листу.
+
+    Для каждой кнопки заранее известно ее значение, поэтому разбор ответа —
+    поиск в словаре. Кроме текста кнопки принимается и просто число.
+    """
+
+    def __init__(self, prices: Dict[tuple, int], version: int = 0):
+        self.version = version
+        self._durations = {}
+        self._participants = {}
+        self._participants_keyboards = {}
+
+        formats = {}
+        for duration, participants in sorted(prices):
+            formats.setdefault(duration, []).append(participants)
+
+        for duration, counts in formats.items():
+            self._durations[duration_label(duration)] = duration
+            self._durations[str(duration)] = duration
+            options = {}
+            for participants in counts:
+                options[participants_label(participants)] = participants
+                options[str(participants)] = participants
+            self._participants[duration] = options
+            self._participants_keyboards[duration] = _menu_keyboard(
+                [participants_label(participants) for participants in counts]
+            )
+        self.duration_keyboard = _menu_keyboard([duration_label(duration) for duration in formats])
+
+    def parse_duration(self, text: str) -> Optional[int]:
+        return self._durations.get(text.strip())
+
+    def parse_participants(self, duration: int, text: str) -> Optional[int]:
+        return self._participants.get(duration, {}).get(text.strip())
+
+    def participants_keyboard(self, duration: int) -> Optional[StaticReplyKeyboard]:
+        return self._participants_keyboards.get(duration)
+
+
+_booking_options = None
+
+
+def get_booking_options(prices: Dict[tuple, int], version: int) -> BookingOptions:
+    """Варианты записи для текущей версии прайс-листа; пересобираются только после ее изменения"""
+    global _booking_options
+    options = _booking_options
+    if options is None or options.version != version:
+        options = _booking_options = BookingOptions(prices, version)
+    return options
+
+
+class DirectoryOptions:
+    """Клавиатура выбора тренера или корта из справочника.
+
+    Ответ сопоставляется с записью по ключу имени, поэтому введенное вручную
+    «иванов  иван» найдет кнопку «Иванов Иван».
+    """
+
+    def __init__(self, entries: Dict[int, str], version: int = 0):
+        self.version = version
+        self._ids = {name_key(name): entry_id for entry_id, name in entries.items()}
+        self.keyboard = _menu_keyboard(list(entries.values()), last=SKIP)
+
+    def parse(self, text: str) -> Optional[int]:
+        return self._ids.get(name_key(text))
+
+
+_directory_options = {}
+
+
+def get_directory_options(kind: str, entries: Dict[int, str], version: int) -> DirectoryOptions:
+    """Варианты выбора для текущей версии справочников; пересобираются только после их изменения"""
+    options = _directory_options.get(kind)
+    if options is None or options.version != version:
+        options = _directory_options[kind] = DirectoryOptions(entries, version)
+    return options
+
+
+WEEKDAYS = ('Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс')
+
+
+@lru_cache(maxsize=4)
+def booking_days(today: date, days: int) -> Dict[str, str]:
+    """Кнопки выбора дня тренировки на days дней вперед: текст -> дата ISO"""
+    labels = {}
+    for offset in range(days):
+        day = today + timedelta(days=offset)
+        if offset == 0:
+            label = 'Сегодня'
+        elif offset == 1:
+            label = 'Завтра'
+        else:
+            label = f"{WEEKDAYS[day.weekday()]} {day:%d.%m}"
+        labels[label] = day.isoformat()
+    return labels
+
+
+@lru_cache(maxsize=4)
+def get_booking_date_keyboard(today: date, days: int) -> StaticReplyKeyboard:
+    return _menu_keyboard([NOW, *booking_days(today, days)], per_row=3)
+
+
+def get_time_slots_keyboard(slots: List[str]) -> StaticReplyKeyboard:
+    return _menu_keyboard(slots, per_row=4)
+
+
 def get_main_menu():
-    keyboard = [
-        ['🎾 Добавить тренировку', '💰 Баланс абонемента'],
-        ['📊 Статистика', '📝 Новый абонемент'],
-        ['📋 История тренировок', '👤 Профиль']
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-def get_duration_keyboard():
-    keyboard = [
-        ['60 минут', '90 минут'],
-        ['120 минут', '❌ Отмена']
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-def get_participants_keyboard():
-    keyboard = [
-        ['1 человек', '2 человека'],
-        ['3 человека', '4 человека'],
-        ['❌ Отмена']
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-def get_court_type_keyboard():
-    keyboard = [
-        ['Крытый корт', 'Открытый корт'],
-        ['Грунт', 'Хард'],
-        ['Пропустить']
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    return MAIN_MENU
+
+def get_partners_keyboard():
+    return PARTNERS_KEYBOARD
 
 def get_stats_period_keyboard():
-    keyboard = [
-        ['📅 За неделю', '📅 За месяц'],
-        ['📅 За год', '📅 За все время'],
-        ['❌ Отмена']
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    return STATS_PERIOD_KEYBOARD
 
 def get_participants_filter_keyboard():
-    keyboard = [
-        ['Все', '1 человек', '2 человека'],
-        ['3 человека', '4 человека', '❌ Отмена']
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    return PARTICIPANTS_FILTER_KEYBOARD
+
+def get_history_navigation_keyboard(older_cursor: str = None, newer_cursor: str = None):
+    buttons = []
+    if older_cursor:
+        buttons.append(InlineKeyboardButton('⬅️ Старше', callback_data=f'history:older:{older_cursor}'))
+    if newer_cursor:
+        buttons.append(InlineKeyboardButton('Новее ➡️', callback_data=f'history:newer:{newer_cursor}'))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+def get_invitation_keyboard(invitation_id: int):
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton('✅ Подтвердить', callback_data=f'invite:accept:{invitation_id}'),
+        InlineKeyboardButton('❌ Отклонить', callback_data=f'invite:decline:{invitation_id}'),
+    ]])
 
 def remove_keyboard():
-    return ReplyKeyboardRemove()
\ No newline at end of file
+    return REMOVE_KEYBOARD
\ No newline at end of file
@@ -0,0 +1,309 @@
+"""Нагрузочное тестирование бота без подключения к Telegram.
+
+Скрипт поднимает настоящее приложение из bot.build_application, подменяя
+HTTP-слой Bot API фейковым бэкендом, и прогоняет через обработчики
+синтетические обновления от множества пользователей одновременно:
+регистрация, абонемент, запись тренировки, статистика, история и профиль.
+
+С --db-mode inline запросы к БД выполняются прямо в цикле событий, как до
+переноса их в пул потоков; --db-mode both прогоняет сценарий в обоих режимах
+на отдельных базах и сравнивает пропускную способность.
+
+Пример запуска:
+    python loadtest.py --users 2000 --concurrency 200 --api-latency 20
+    python loadtest.py --users 1000 --db-mode both
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from itertools import count
+from typing import Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest, RequestData
+
+from bot import build_application
+from database import Database, AsyncDatabase
+
+# Счетчик запросов текущего обновления; AsyncDatabase передает контекст в поток пула
+current_queries = contextvars.ContextVar('current_queries', default=None)
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'TennisBot', 'username': 'tennis_bot'}
+
+# Корт, который создается в базе теста; в сценарии выбирается его кнопка
+LOADTEST_COURT = 'Корт 1 (Хард)'
+
+# Сценарий одного пользователя: (название шага, текст сообщения)
+SCENARIO = [
+    ('start', '/start'),
+    ('register', 'Иван'),
+    ('register', 'Петров'),
+    ('register', '+7 912 345 67 89'),
+    ('subscription', '📝 Новый абонемент'),
+    ('subscription', 'AB-{user_id}'),
+    ('subscription', '20000'),
+    ('booking', '🎾 Добавить тренировку'),
+    ('booking', '60 минут'),
+    ('booking', '2 человека'),
+    ('booking', 'Пропустить'),
+    # Все записывают текущие тренировки на один корт: занятость проверяется только при бронировании
+    ('booking', LOADTEST_COURT),
+    ('booking', 'Пропустить'),
+    ('booking', '▶️ Сейчас'),
+    ('stats', '📊 Статистика'),
+    ('stats', '📅 За месяц'),
+    ('history', '📋 История тренировок'),
+    ('profile', '👤 Профиль'),
+    ('balance', '💰 Баланс абонемента'),
+]
+
+
+class FakeRequest(BaseRequest):
+    """Имитация Bot API: отвечает на вызовы успешно, опционально с задержкой сети"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = defaultdict(int)
+        self._message_ids = count(1)
+        self._initialized = False
+
+    async def initialize(self):
+        self._initialized = True
+
+    async def shutdown(self):
+        # Как HTTPXRequest: после shutdown запросы невозможны
+        self._initialized = False
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None,
+                         pool_timeout=None) -> Tuple[int, bytes]:
+        if not self._initialized:
+            raise RuntimeError("This HTTPXRequest is not initialized!")
+        api_method = url.rsplit('/', 1)[-1]
+        self.calls[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        params = request_data.parameters if request_data else {}
+        if api_method == 'getMe':
+            result = BOT_USER
+        elif api_method.startswith(('send', 'edit')):
+            result = {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+                'from': BOT_USER,
+                'text': params.get('text', ''),
+            }
+        else:
+            result = True
+
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+class CountingDatabase(Database):
+    """Database, подсчитывающая выполненные SQL-запросы"""
+
+    def __init__(self, *args, **kwargs):
+        self.queries = 0
+        super().__init__(*args, **kwargs)
+
+    def _connect(self):
+        conn = super()._connect()
+        conn.set_trace_callback(self._trace)
+        return conn
+
+    def _trace(self, statement: str):
+        if statement.lstrip()[:6].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE'):
+            self.queries += 1
+            counter = current_queries.get()
+            if counter is not None:
+                counter[0] += 1
+
+
+class InlineDatabase(AsyncDatabase):
+    """Те же корутины, что у AsyncDatabase, но запрос выполняется в цикле событий и блокирует его"""
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def __getattr__(self, name):
+        method = getattr(self.db, name)
+        if not callable(method):
+            return method
+
+        async def wrapper(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        setattr(self, name, wrapper)
+        return wrapper
+
+    def close(self):
+        self.db.close()
+
+
+def make_update(bot, update_id: int, user_id: int, text: str) -> Update:
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return Update.de_json({'update_id': update_id, 'message': message}, bot)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run_user(application: Application, user_id: int,
+                   update_ids: count, semaphore: asyncio.Semaphore, results: Dict):
+    async with semaphore:
+        for step, text in SCENARIO:
+            update = make_update(application.bot, next(update_ids), user_id, text.format(user_id=user_id))
+            counter = [0]
+            token = current_queries.set(counter)
+            started = time.perf_counter()
+            try:
+                await application.process_update(update)
+            finally:
+                current_queries.reset(token)
+            results[step]['latency'].append(time.perf_counter() - started)
+            results[step]['queries'] += counter[0]
+
+
+async def run(args, mode: str = 'pool') -> Dict:
+    if args.db:
+        # Каждому режиму своя база: повторный прогон по той же базе шел бы по другому сценарию
+        db_path = args.db if args.db_mode != 'both' else f'{args.db}.{mode}'
+    else:
+        db_path = os.path.join(tempfile.mkdtemp(prefix='loadtest-'), 'loadtest.db')
+    database = CountingDatabase(db_path)
+    database.set_directory_entry('courts', 'Корт 1', True, surface='Хард')
+    if mode == 'inline':
+        db = InlineDatabase(database)
+    else:
+        db = AsyncDatabase(database, workers=args.pool_size)
+
+    request = FakeRequest(latency=args.api_latency / 1000)
+    builder = Application.builder().token('123456:LOADTEST').request(request).get_updates_request(FakeRequest())
+    application = build_application(db, builder, persistence_interval=args.persistence_interval)
+
+    results = defaultdict(lambda: {'latency': [], 'queries': 0})
+    update_ids = count(1)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    await application.initialize()
+    # start() запускает периодическое сохранение состояния, как в боевом режиме
+    await application.start()
+    queries_before = database.queries
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(
+            run_user(application, 100000 + i, update_ids, semaphore, results)
+            for i in range(args.users)
+        ))
+    finally:
+        elapsed = time.perf_counter() - started
+        await application.stop()
+        # Как run_polling: post_stop досылает очередь сообщений до закрытия бота
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        db.close()
+
+    return {
+        'mode': mode,
+        'elapsed': elapsed,
+        'queries': database.queries - queries_before,
+        'steps': results,
+        'api_calls': dict(request.calls),
+        'persistence': application.persistence,
+        'db_path': db_path,
+    }
+
+
+def report(args, summary: Dict):
+    all_latencies = [value for step in summary['steps'].values() for value in step['latency']]
+    total_updates = len(all_latencies)
+
+    print(f"Нагрузочный тест {datetime.now():%Y-%m-%d %H:%M:%S}")
+    where = f"потоков БД: {args.pool_size}" if summary['mode'] == 'pool' else "БД в цикле событий"
+    print(f"Пользователей: {args.users}, одновременно: {args.concurrency}, "
+          f"задержка API: {args.api_latency} мс, {where}")
+    print(f"База данных: {summary['db_path']}\n")
+
+    header = f"{'шаг':<14}{'обновлений':>11}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'запросов/обн':>14}"
+    print(header)
+    print('-' * len(header))
+    rows = list(summary['steps'].items()) + [('ИТОГО', {'latency': all_latencies, 'queries': summary['queries']})]
+    for step, data in rows:
+        latencies = data['latency']
+        print(f"{step:<14}{len(latencies):>11}"
+              f"{percentile(latencies, 50) * 1000:>10.2f}"
+              f"{percentile(latencies, 95) * 1000:>10.2f}"
+              f"{percentile(latencies, 99) * 1000:>10.2f}"
+              f"{data['queries'] / len(latencies):>14.2f}")
+
+    print(f"\nВремя: {summary['elapsed']:.2f} с, пропускная способность: "
+          f"{total_updates / summary['elapsed']:.0f} обновлений/с")
+    print(f"Средняя задержка: {statistics.mean(all_latencies) * 1000:.2f} мс")
+    print(f"Вызовы Bot API: {summary['api_calls']}")
+
+    persistence = summary['persistence']
+    print(f"Сохранение состояния: {persistence.batches} пакетов, {persistence.rows_written} записей, "
+          f"{persistence.write_time * 1000:.1f} мс "
+          f"({persistence.write_time / total_updates * 1e6:.1f} мкс на обновление)")
+
+
+def throughput(summary: Dict) -> float:
+    return sum(len(step['latency']) for step in summary['steps'].values()) / summary['elapsed']
+
+
+def report_comparison(summaries: List[Dict]):
+    print("Сравнение режимов БД:")
+    for summary in summaries:
+        name = 'пул потоков' if summary['mode'] == 'pool' else 'в цикле событий'
+        print(f"  {name:<18}{throughput(summary):>8.0f} обновлений/с")
+    inline, pool = (next(summary for summary in summaries if summary['mode'] == mode) for mode in ('inline', 'pool'))
+    print(f"  пул потоков / в цикле событий: {throughput(pool) / throughput(inline):.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест обработчиков бота')
+    parser.add_argument('--users', type=int, default=1000, help='число симулируемых пользователей')
+    parser.add_argument('--concurrency', type=int, default=100, help='число одновременно активных пользователей')
+    parser.add_argument('--api-latency', type=float, default=0, help='задержка ответа Bot API, мс')
+    parser.add_argument('--pool-size', type=int, default=4, help='число потоков пула БД')
+    parser.add_argument('--persistence-interval', type=float, default=1,
+                        help='интервал сохранения состояния диалогов, с')
+    parser.add_argument('--db', help='путь к файлу БД (по умолчанию — временный файл)')
+    parser.add_argument('--db-mode', choices=('pool', 'inline', 'both'), default='pool',
+                        help='где выполнять запросы к БД: в пуле потоков, в цикле событий или сравнить оба')
+    args = parser.parse_args()
+
+    modes = ('inline', 'pool') if args.db_mode == 'both' else (args.db_mode,)
+    summaries = []
+    for mode in modes:
+        summaries.append(asyncio.run(run(args, mode)))
+        report(args, summaries[-1])
+        print()
+    if len(summaries) > 1:
+        report_comparison(summaries)
+
+
+if __name__ == '__main__':
+    main()
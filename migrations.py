@@ -0,0 +1,525 @@
+"""Версионные миграции схемы БД.
+
+Версия схемы хранится в PRAGMA user_version и равна числу примененных
+шагов из MIGRATIONS. Каждый шаг выполняется в своей транзакции вместе с
+повышением версии, поэтому прерванный запуск продолжится с того же шага.
+Если схема актуальна, запуск обходится одним чтением заголовка БД.
+
+Шаги только дописываются в конец списка; примененные шаги не меняются.
+"""
+import logging
+import time
+from typing import Callable, List, Tuple
+
+from utils import clean_name, name_key
+
+logger = logging.getLogger(__name__)
+
+# Индексы исходной схемы; покрывающие колонки позволяют
+# отвечать на запрос без обращения к самой таблице
+BASELINE_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS idx_users_phone ON users (phone)',
+    'CREATE INDEX IF NOT EXISTS idx_subscriptions_user_status '
+    'ON subscriptions (user_id, status, created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_subscriptions_status_balance '
+    'ON subscriptions (status, current_balance)',
+    'CREATE INDEX IF NOT EXISTS idx_subscriptions_status_end '
+    'ON subscriptions (status, end_date)',
+    'CREATE INDEX IF NOT EXISTS idx_price_list_format '
+    'ON price_list (duration_minutes, participants_count, is_active, price)',
+    'CREATE INDEX IF NOT EXISTS idx_transactions_user_type_date '
+    'ON transactions (user_id, transaction_type, created_at, amount)',
+    'CREATE INDEX IF NOT EXISTS idx_transactions_subscription '
+    'ON transactions (subscription_id, id, transaction_type, amount, created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_training_participants_user '
+    'ON training_participants (user_id, training_session_id, participants_count, amount_paid)',
+    'CREATE INDEX IF NOT EXISTS idx_training_sessions_date '
+    'ON training_sessions (session_date, session_time)',
+    # Расписание корта и тренера на день: поиск пересечений идет по узкому диапазону индекса
+    'CREATE INDEX IF NOT EXISTS idx_training_sessions_court_schedule '
+    'ON training_sessions (court_id, session_date, session_time, duration_minutes)',
+    'CREATE INDEX IF NOT EXISTS idx_training_sessions_coach_schedule '
+    'ON training_sessions (coach_id, session_date, session_time, duration_minutes)',
+)
+
+# Журнал операций только дополняется: исправления вносятся новыми записями
+LEDGER_TRIGGERS = {
+    'transactions_no_update': '''
+        CREATE TRIGGER IF NOT EXISTS transactions_no_update BEFORE UPDATE ON transactions
+        BEGIN SELECT RAISE(ABORT, 'журнал операций нельзя изменять'); END
+    ''',
+    'transactions_no_delete': '''
+        CREATE TRIGGER IF NOT EXISTS transactions_no_delete BEFORE DELETE ON transactions
+        BEGIN SELECT RAISE(ABORT, 'журнал операций нельзя изменять'); END
+    ''',
+}
+
+# Ниже — SQL исходной схемы в том виде, в каком его применяет шаг baseline.
+# Он не ссылается на Database: дальнейшие изменения запросов бота не должны
+# менять то, что уже применено к существующим базам.
+BASELINE_DIRECTORIES = ('coaches', 'courts')
+
+# Начальные пополнения абонементов; начатые задним числом датируются началом
+BASELINE_TOPUPS = '''
+    INSERT INTO transactions (user_id, subscription_id, transaction_type, amount, description, created_at)
+    SELECT user_id, id, 'topup', initial_amount, 'Пополнение абонемента ' || subscription_number,
+           CASE WHEN start_date < date(created_at) THEN start_date ELSE created_at END
+    FROM subscriptions s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM transactions t
+        WHERE t.subscription_id = s.id AND t.transaction_type = 'topup'
+    )
+'''
+
+# Накопительная статистика по истории тренировок
+BASELINE_ROLLUPS = {
+    'user_training_stats': '''
+        SELECT tp.user_id, ts.session_date, tp.participants_count,
+               COUNT(*), SUM(ts.duration_minutes), SUM(tp.amount_paid)
+        FROM training_participants tp
+        JOIN training_sessions ts ON tp.training_session_id = ts.id
+        GROUP BY tp.user_id, ts.session_date, tp.participants_count
+    ''',
+    'club_training_stats': '''
+        SELECT day, coach_id, court_id, participants_count,
+               COUNT(*), SUM(players), SUM(duration_minutes), SUM(amount)
+        FROM (
+            SELECT ts.session_date AS day, COALESCE(ts.coach_id, 0) AS coach_id,
+                   COALESCE(ts.court_id, 0) AS court_id, tp.participants_count,
+                   ts.duration_minutes, COUNT(*) AS players, SUM(tp.amount_paid) AS amount
+            FROM training_participants tp
+            JOIN training_sessions ts ON tp.training_session_id = ts.id
+            GROUP BY ts.id, tp.participants_count
+        )
+        GROUP BY day, coach_id, court_id, participants_count
+    ''',
+}
+
+# Типы кортов, которыми раньше заполнялся справочник кортов
+LEGACY_COURTS = ('Крытый корт', 'Открытый корт', 'Грунт', 'Хард')
+
+# Денежные колонки по таблицам
+MONEY_COLUMNS = {
+    'subscriptions': ('initial_amount', 'current_balance'),
+    'price_list': ('price',),
+    'training_participants': ('amount_paid',),
+    'transactions': ('amount',),
+    'balance_snapshots': ('balance',),
+    'user_training_stats': ('amount',),
+    'club_training_stats': ('amount',),
+}
+
+
+def _baseline(db, conn):
+    """Схема до появления версий.
+
+    Базы того времени могли быть созданы любой из прежних версий бота,
+    поэтому шаг идемпотентен и дописывает недостающее.
+    """
+    # Таблица пользователей
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE NOT NULL,
+            first_name TEXT NOT NULL,
+            last_name TEXT,
+            phone TEXT,
+            registration_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT TRUE
+        )
+    ''')
+
+    # Таблица абонементов
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            subscription_number TEXT UNIQUE NOT NULL,
+            initial_amount DECIMAL(10,2) NOT NULL,
+            current_balance DECIMAL(10,2) NOT NULL,
+            start_date DATE NOT NULL,
+            end_date DATE,
+            status TEXT DEFAULT 'active',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+
+    # Таблица прайс-листа
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS price_list (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            duration_minutes INTEGER NOT NULL,
+            participants_count INTEGER NOT NULL,
+            price DECIMAL(10,2) NOT NULL,
+            description TEXT,
+            is_active BOOLEAN DEFAULT TRUE
+        )
+    ''')
+
+    # Справочники тренеров и кортов; name_key защищает от дублей,
+    # отличающихся регистром и пробелами
+    for table in BASELINE_DIRECTORIES:
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                name_key TEXT UNIQUE NOT NULL,
+                is_active BOOLEAN DEFAULT TRUE
+            )
+        ''')
+
+    # Таблица тренировок
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS training_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_date DATE NOT NULL,
+            session_time TIME NOT NULL,
+            duration_minutes INTEGER NOT NULL,
+            court_id INTEGER REFERENCES courts(id),
+            coach_id INTEGER REFERENCES coaches(id),
+            notes TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Таблица участников тренировок
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS training_participants (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            training_session_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            subscription_id INTEGER NOT NULL,
+            amount_paid DECIMAL(10,2) NOT NULL,
+            participants_count INTEGER NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (training_session_id) REFERENCES training_sessions(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (subscription_id) REFERENCES subscriptions(id) ON DELETE CASCADE
+        )
+    ''')
+
+    # Таблица транзакций
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            subscription_id INTEGER NOT NULL,
+            training_session_id INTEGER,
+            transaction_type TEXT NOT NULL,
+            amount DECIMAL(10,2) NOT NULL,
+            description TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (subscription_id) REFERENCES subscriptions(id) ON DELETE CASCADE,
+            FOREIGN KEY (training_session_id) REFERENCES training_sessions(id) ON DELETE SET NULL
+        )
+    ''')
+
+    # Состояние бота: диалоги и user_data, переживающие перезапуск
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bot_state (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data TEXT NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (kind, key)
+        )
+    ''')
+
+    for trigger in LEDGER_TRIGGERS.values():
+        conn.execute(trigger)
+
+    # Снимки балансов: баланс абонемента с учетом операций до last_transaction_id включительно
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS balance_snapshots (
+            subscription_id INTEGER NOT NULL,
+            last_transaction_id INTEGER NOT NULL,
+            balance DECIMAL(10,2) NOT NULL,
+            taken_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (subscription_id, last_transaction_id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Накопительная статистика: пользователь x день x число участников
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_training_stats (
+            user_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            participants_count INTEGER NOT NULL,
+            trainings INTEGER NOT NULL DEFAULT 0,
+            minutes INTEGER NOT NULL DEFAULT 0,
+            amount DECIMAL(10,2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, participants_count)
+        ) WITHOUT ROWID
+    ''')
+
+    # Тренеры и корты хранились в тренировках строками
+    _migrate_directories(conn)
+
+    # Статистика клуба: день x тренер x корт x число участников (0 - не указан)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS club_training_stats (
+            day DATE NOT NULL,
+            coach_id INTEGER NOT NULL DEFAULT 0,
+            court_id INTEGER NOT NULL DEFAULT 0,
+            participants_count INTEGER NOT NULL,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            participants INTEGER NOT NULL DEFAULT 0,
+            minutes INTEGER NOT NULL DEFAULT 0,
+            amount DECIMAL(10,2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, coach_id, court_id, participants_count)
+        ) WITHOUT ROWID
+    ''')
+
+    for index in BASELINE_INDEXES:
+        conn.execute(index)
+
+    # Заполняем прайс-лист начальными данными
+    _init_price_list(conn)
+
+    # Пополнения появились в журнале позже абонементов: дописываем недостающие
+    conn.execute(BASELINE_TOPUPS)
+
+    # Статистика появилась после тренировок: заполняем ее по истории
+    if conn.execute('SELECT 1 FROM training_participants LIMIT 1').fetchone():
+        for table, query in BASELINE_ROLLUPS.items():
+            if not conn.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone():
+                conn.execute(f'INSERT INTO {table} {query}')
+
+
+def _migrate_directories(conn):
+    """Переносит строковые тренеров и корты из тренировок в справочники"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(training_sessions)')}
+    if 'coach_name' not in columns:
+        return
+
+    for table, column, old_column in (('coaches', 'coach_id', 'coach_name'),
+                                      ('courts', 'court_id', 'court_type')):
+        # Варианты написания сводятся по name_key; именем в справочнике
+        # становится самый частый из них
+        names = conn.execute(f'''
+            SELECT {old_column} FROM training_sessions
+            WHERE trim(coalesce({old_column}, '')) != ''
+            GROUP BY {old_column} ORDER BY COUNT(*) DESC
+        ''').fetchall()
+        conn.executemany(
+            f'INSERT OR IGNORE INTO {table} (name, name_key) VALUES (?, ?)',
+            [(clean_name(name), name_key(name)) for name, in names]
+        )
+        conn.execute(f'ALTER TABLE training_sessions ADD COLUMN {column} INTEGER REFERENCES {table}(id)')
+        conn.execute(f'''
+            UPDATE training_sessions SET {column} = (
+                SELECT id FROM {table} WHERE name_key = name_key(training_sessions.{old_column})
+            )
+            WHERE trim(coalesce({old_column}, '')) != ''
+        ''')
+
+    # Индексы расписания построены по строковым колонкам и будут созданы заново
+    conn.execute('DROP INDEX IF EXISTS idx_training_sessions_court_schedule')
+    conn.execute('DROP INDEX IF EXISTS idx_training_sessions_coach_schedule')
+    conn.execute('ALTER TABLE training_sessions DROP COLUMN coach_name')
+    conn.execute('ALTER TABLE training_sessions DROP COLUMN court_type')
+    # Статистика клуба была разбита по строкам: пересчитается по истории
+    conn.execute('DROP TABLE IF EXISTS club_training_stats')
+    logger.info('Тренеры и корты перенесены в справочники: %s и %s',
+                *(conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in ('coaches', 'courts')))
+
+
+def _init_price_list(conn):
+    """Инициализация прайс-листа"""
+    # Заполняем только пустую таблицу, чтобы не затирать цены, измененные через /setprice
+    if conn.execute('SELECT 1 FROM price_list LIMIT 1').fetchone():
+        return
+
+    prices = [
+        (60, 1, 1500, "Индивидуальная 60 мин"),
+        (90, 1, 2000, "Индивидуальная 90 мин"),
+        (120, 1, 2500, "Индивидуальная 120 мин"),
+        (60, 2, 800, "Вдвоем 60 мин"),
+        (90, 2, 1200, "Вдвоем 90 мин"),
+        (120, 2, 1600, "Вдвоем 120 мин"),
+        (60, 3, 600, "Втроем 60 мин"),
+        (90, 3, 900, "Втроем 90 мин"),
+        (120, 3, 1200, "Втроем 120 мин"),
+        (60, 4, 500, "Вчетвером 60 мин"),
+        (90, 4, 750, "Вчетвером 90 мин"),
+        (120, 4, 1000, "Вчетвером 120 мин"),
+    ]
+
+    for duration, participants, price, description in prices:
+        conn.execute('''
+            INSERT OR IGNORE INTO price_list 
+            (duration_minutes, participants_count, price, description)
+            VALUES (?, ?, ?, ?)
+        ''', (duration, participants, price, description))
+
+
+def _price_list_unique(db, conn):
+    """Уникальный формат в прайс-листе.
+
+    INSERT OR IGNORE при заполнении прайс-листа не защищал от дублей: из
+    повторов оставляем действующую и самую новую запись.
+    """
+    conn.execute('''
+        DELETE FROM price_list WHERE id NOT IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY duration_minutes, participants_count
+                    ORDER BY is_active DESC, id DESC
+                ) AS position
+                FROM price_list
+            )
+            WHERE position = 1
+        )
+    ''')
+    conn.execute('DROP INDEX IF EXISTS idx_price_list_format')
+    conn.execute('''
+        CREATE UNIQUE INDEX idx_price_list_format
+        ON price_list (duration_minutes, participants_count)
+    ''')
+
+
+def _money_in_kopecks(db, conn):
+    """Суммы в целых копейках вместо рублей с плавающей точкой.
+
+    Колонки объявлены как DECIMAL и имеют числовое сродство: целые значения
+    в них хранятся как INTEGER, поэтому перестраивать таблицы не нужно.
+    Триггер, запрещающий изменять журнал, снимается только на время пересчета.
+    """
+    conn.execute('DROP TRIGGER IF EXISTS transactions_no_update')
+    for table, columns in MONEY_COLUMNS.items():
+        assignments = ', '.join(f'{column} = CAST(round({column} * 100) AS INTEGER)' for column in columns)
+        conn.execute(f'UPDATE {table} SET {assignments}')
+    conn.execute(LEDGER_TRIGGERS['transactions_no_update'])
+
+    # Цена выбранного формата в незавершенных диалогах записи на тренировку
+    conn.execute('''
+        UPDATE bot_state
+        SET data = json_set(data, '$.price', CAST(round(json_extract(data, '$.price') * 100) AS INTEGER))
+        WHERE kind = 'user_data' AND json_extract(data, '$.price') IS NOT NULL
+    ''')
+
+
+def _participants_session_time(db, conn):
+    """Дата и время тренировки в training_participants.
+
+    История игрока листается по (дата, время, id тренировки); с этими
+    колонками в индексе по user_id страница читается без сортировки.
+    """
+    conn.execute('ALTER TABLE training_participants ADD COLUMN session_date DATE')
+    conn.execute('ALTER TABLE training_participants ADD COLUMN session_time TIME')
+    conn.execute('''
+        UPDATE training_participants SET (session_date, session_time) = (
+            SELECT session_date, session_time FROM training_sessions
+            WHERE training_sessions.id = training_participants.training_session_id
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX idx_training_participants_history
+        ON training_participants (user_id, session_date, session_time, training_session_id,
+                                  participants_count, amount_paid)
+    ''')
+
+
+def _training_invitations(db, conn):
+    """Приглашения партнеров в тренировку.
+
+    С абонемента партнера оплата списывается только после того, как он
+    сам подтвердит участие.
+    """
+    conn.execute('''
+        CREATE TABLE training_invitations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            training_session_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            invited_by INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            responded_at DATETIME,
+            UNIQUE (training_session_id, user_id),
+            FOREIGN KEY (training_session_id) REFERENCES training_sessions(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (invited_by) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+
+
+def _courts_surface(db, conn):
+    """Покрытие — свойство корта, а не отдельный корт.
+
+    Справочник кортов раньше заполнялся типами покрытия: четыре «корта» на
+    весь клуб не позволяли проверять занятость. Неиспользованные типы
+    удаляются, а встречающиеся в истории скрываются из выбора; настоящие
+    корты администратор добавляет командой /court.
+    """
+    conn.execute('ALTER TABLE courts ADD COLUMN surface TEXT')
+    keys = [name_key(court) for court in LEGACY_COURTS]
+    placeholders = ', '.join('?' for _ in keys)
+    conn.execute(f'''
+        DELETE FROM courts
+        WHERE name_key IN ({placeholders})
+          AND NOT EXISTS (SELECT 1 FROM training_sessions WHERE court_id = courts.id)
+    ''', keys)
+    conn.execute(f'''
+        UPDATE courts SET surface = name, is_active = FALSE WHERE name_key IN ({placeholders})
+    ''', keys)
+
+
+def _create_index(sql: str) -> Callable:
+    """Шаг, строящий один индекс.
+
+    В режиме WAL читатели не ждут построения, а блокировка записи держится
+    только на время этого шага.
+    """
+    def step(db, conn):
+        conn.execute(sql)
+    return step
+
+
+# Шаги по порядку: версия схемы после шага равна его номеру, начиная с 1
+MIGRATIONS: List[Tuple[str, Callable]] = [
+    ('baseline', _baseline),
+    ('price_list_unique', _price_list_unique),
+    # Поиск открытой тренировки при записи соединяет участников по тренировке
+    ('training_participants_session_index', _create_index(
+        'CREATE INDEX IF NOT EXISTS idx_training_participants_session '
+        'ON training_participants (training_session_id, participants_count, user_id)'
+    )),
+    ('money_in_kopecks', _money_in_kopecks),
+    ('participants_session_time', _participants_session_time),
+    ('training_invitations', _training_invitations),
+    ('courts_surface', _courts_surface),
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_version(conn) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(db) -> List[Tuple[int, str, float]]:
+    """Применяет недостающие шаги; возвращает (версия, шаг, секунды) для примененных"""
+    with db.get_connection() as conn:
+        version = get_version(conn)
+    if version == SCHEMA_VERSION:
+        return []
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Схема БД версии {version} новее поддерживаемой ({SCHEMA_VERSION})")
+
+    applied = []
+    for number, (name, step) in enumerate(MIGRATIONS, 1):
+        if number <= version:
+            continue
+        started = time.perf_counter()
+        with db.write_connection() as conn:
+            # Шаг мог применить другой процесс, пока мы ждали блокировку
+            if get_version(conn) >= number:
+                continue
+            step(db, conn)
+            conn.execute(f'PRAGMA user_version = {number}')
+        elapsed = time.perf_counter() - started
+        logger.info('Миграция %s (%s) применена за %.3f с', number, name, elapsed)
+        applied.append((number, name, elapsed))
+    return applied
@@ -0,0 +1,201 @@
+"""Очередь исходящих сообщений с ограничением скорости отправки.
+
+Telegram ограничивает ботов примерно 30 сообщениями в секунду в целом и
+одним сообщением в секунду в один чат; при превышении API отвечает
+RetryAfter. SendQueue отправляет сообщения в фоне, соблюдая оба лимита,
+и повторяет отправку после RetryAfter и сетевых ошибок.
+"""
+import asyncio
+import heapq
+import logging
+import time
+from itertools import count
+from typing import Callable, Dict, Optional
+
+from telegram.error import Forbidden, NetworkError, RetryAfter, BadRequest
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько ждать до появления токена (0 — можно отправлять сейчас)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class SendQueue:
+    """Фоновая отправка сообщений с глобальным и поканальным лимитами.
+
+    Сообщения хранятся в куче по времени готовности: если чат исчерпал свой
+    лимит, его сообщение откладывается, а очередь продолжает отправлять в
+    другие чаты. Размер очереди ограничен — enqueue ждет, пока освободится
+    место, что сдерживает массовые рассылки.
+    """
+
+    # Сколько поканальных корзин держать, прежде чем выбросить полные
+    MAX_CHATS = 10000
+
+    def __init__(self, bot, rate: float = 25, chat_rate: float = 1, max_size: int = 1000,
+                 max_retries: int = 3, clock: Callable[[], float] = time.monotonic):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.max_retries = max_retries
+        self.clock = clock
+        # Емкость 1: сообщения идут равномерно, без всплесков сверх лимита
+        self._global = TokenBucket(rate, 1, clock())
+        self._resume_at = 0.0
+        self._chats = {}
+        self._heap = []
+        self._order = count()
+        self._slots = asyncio.Semaphore(max_size)
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._pending = 0
+        self._worker = None
+        self._in_flight = set()
+
+        self.stats = {'sent': 0, 'failed': 0, 'retried': 0}
+
+    async def enqueue(self, chat_id: int, text: str, **kwargs) -> asyncio.Future:
+        """Ставит сообщение в очередь; возвращает future с результатом отправки"""
+        await self._slots.acquire()
+        self._pending += 1
+        self._idle.clear()
+        future = asyncio.get_running_loop().create_future()
+        self._push(self.clock(), {'chat_id': chat_id, 'text': text, 'kwargs': kwargs,
+                                  'attempt': 0, 'future': future})
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        return future
+
+    async def join(self):
+        """Ждет, пока все поставленные сообщения будут отправлены или отброшены"""
+        await self._idle.wait()
+
+    async def stop(self):
+        """Отправляет оставшиеся сообщения и останавливает фоновую задачу"""
+        await self.join()
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def _push(self, ready_at: float, item: Dict):
+        heapq.heappush(self._heap, (ready_at, next(self._order), item))
+        self._wakeup.set()
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHATS:
+                # Корзины давно молчавших чатов полны, их можно создать заново
+                self._chats = {key: value for key, value in self._chats.items() if value.wait_time(now) > 0}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, 1, now)
+        return bucket
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = self.clock()
+            ready_at, _, item = self._heap[0]
+            if ready_at > now:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), ready_at - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            delay = max(self._resume_at - now, self._global.wait_time(now))
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            heapq.heappop(self._heap)
+            chat_delay = self._chat_bucket(item['chat_id'], now).wait_time(now)
+            if chat_delay:
+                self._push(now + chat_delay, item)
+                continue
+
+            self._global.consume(now)
+            self._chats[item['chat_id']].consume(now)
+            # Отправляем, не дожидаясь ответа: темп задают лимиты, а не задержка сети
+            task = asyncio.create_task(self._send(item))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, item: Dict):
+        try:
+            result = await self.bot.send_message(chat_id=item['chat_id'], text=item['text'], **item['kwargs'])
+        except RetryAfter as e:
+            # Telegram просит подождать: откладываем и чат, и всю очередь
+            logger.warning("RetryAfter %s с при отправке в чат %s", e.retry_after, item['chat_id'])
+            self._resume_at = self.clock() + e.retry_after
+            self._retry(item, self._resume_at)
+            return
+        except (Forbidden, BadRequest) as e:
+            # Пользователь заблокировал бота или чат недоступен — повтор не поможет
+            self._finish(item, error=e)
+            return
+        except NetworkError as e:
+            self._retry(item, self.clock() + 2 ** item['attempt'], error=e)
+            return
+        except Exception as e:
+            # Прочие ошибки (например, ChatMigrated) не должны оставлять сообщение
+            # незавершенным: иначе не освободится слот и join() будет ждать вечно
+            logger.exception("Ошибка при отправке в чат %s", item['chat_id'])
+            self._finish(item, error=e)
+            return
+
+        self.stats['sent'] += 1
+        self._finish(item, result=result)
+
+    def _retry(self, item: Dict, ready_at: float, error: Optional[Exception] = None):
+        item['attempt'] += 1
+        if item['attempt'] > self.max_retries:
+            self._finish(item, error=error or RuntimeError("превышено число попыток отправки"))
+            return
+        self.stats['retried'] += 1
+        self._push(ready_at, item)
+
+    def _finish(self, item: Dict, result=None, error: Optional[Exception] = None):
+        if error is not None:
+            self.stats['failed'] += 1
+            logger.info("Не удалось отправить сообщение в чат %s: %s", item['chat_id'], error)
+        future = item['future']
+        if not future.done():
+            if error is not None:
+                future.set_exception(error)
+                # Результат рассылок обычно не ждут — не даем asyncio ругаться на необработанную ошибку
+                future.exception()
+            else:
+                future.set_result(result)
+        self._slots.release()
+        self._pending -= 1
+        if not self._pending:
+            self._idle.set()
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import time
+from typing import Dict, Optional
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from database import AsyncDatabase
+
+
+class SQLitePersistence(BasePersistence):
+    """Хранит состояния диалогов и user_data в основной базе SQLite.
+
+    Application передает изменения не на каждое обновление, а раз в
+    update_interval секунд. Все изменения одного такого прохода копятся в
+    памяти и записываются в БД одной транзакцией.
+    """
+
+    def __init__(self, db: AsyncDatabase, update_interval: float = 10):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.db = db
+        self._pending = {}
+        self._write_task = None
+        self._writes = set()
+
+        # Счетчики для оценки накладных расходов
+        self.batches = 0
+        self.rows_written = 0
+        self.write_time = 0.0
+
+    async def get_user_data(self) -> Dict[int, Dict]:
+        rows = await self.db.load_bot_state('user_data')
+        return {int(user_id): json.loads(data) for user_id, data in rows.items()}
+
+    async def get_conversations(self, name: str) -> Dict:
+        rows = await self.db.load_bot_state(f'conversation:{name}')
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows.items()}
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        self._schedule(f'conversation:{name}', json.dumps(key), None if new_state is None else json.dumps(new_state))
+
+    async def update_user_data(self, user_id: int, data: Dict) -> None:
+        self._schedule('user_data', str(user_id), json.dumps(data, ensure_ascii=False) if data else None)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._schedule('user_data', str(user_id), None)
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        # Дожидаемся и запланированной, и уже начатой записи
+        if self._writes:
+            await asyncio.gather(*self._writes)
+        if self._pending:
+            await self._write_pending()
+
+    def _schedule(self, kind: str, key: str, data: Optional[str]):
+        self._pending[(kind, key)] = data
+        if self._write_task is None:
+            self._write_task = asyncio.create_task(self._write_pending())
+            self._writes.add(self._write_task)
+            self._write_task.add_done_callback(self._writes.discard)
+
+    async def _write_pending(self):
+        # Уступаем циклу событий, чтобы Application успел передать все изменения текущего прохода
+        await asyncio.sleep(0)
+        pending, self._pending = self._pending, {}
+        self._write_task = None
+        if not pending:
+            return
+
+        started = time.perf_counter()
+        await self.db.save_bot_state([(kind, key, data) for (kind, key), data in pending.items()])
+        self.write_time += time.perf_counter() - started
+        self.batches += 1
+        self.rows_written += len(pending)
+
+    # Данные чатов, бота и callback_data не используются
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        return {}
+
+    async def get_bot_data(self) -> Dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: Dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict) -> None:
+        pass
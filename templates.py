@@ -0,0 +1,115 @@
+"""Шаблоны ответов бота: баланс, статистика, профиль и история.
+
+Тексты разобраны один раз при импорте — в обработчике остается подставить
+значения одним вызовом str.format. Пользовательские данные экранируются,
+так как сообщения отправляются с разметкой HTML.
+"""
+from html import escape
+from typing import Dict, List, Optional
+
+from utils import format_amount, format_date, get_period_name, participants_label
+
+_BALANCE = (
+    "💰 <b>Ваш абонемент</b>\n"
+    "Номер: {number}\n"
+    "Начальная сумма: {initial}\n"
+    "Текущий баланс: <b>{balance}</b>\n"
+    "Дата начала: {start}"
+).format
+_BALANCE_END = "\nДействует до: {}".format
+NO_SUBSCRIPTION = (
+    "❌ У вас нет активного абонемента.\n"
+    "Добавьте новый абонемент через меню."
+)
+
+_STATS = (
+    "📊 <b>Статистика за {period}</b>\n\n"
+    "💰 Потрачено: <b>{spent}</b>\n"
+    "🎾 Всего тренировок: <b>{count}</b>"
+).format
+_STATS_FORMATS = "\n\n<b>По числу участников:</b>"
+_STATS_FORMAT = "\n• {label}: {count}".format
+
+_PROFILE = (
+    "👤 <b>Ваш профиль</b>\n\n"
+    "Имя: {first_name} {last_name}\n"
+    "Телефон: {phone}\n"
+    "Дата регистрации: {registered}\n\n"
+    "🎾 Всего тренировок: <b>{trainings}</b>\n"
+).format
+_PROFILE_SUBSCRIPTION = (
+    "💰 Активный абонемент: {number}\n"
+    "Баланс: {balance}"
+).format
+_PROFILE_NO_SUBSCRIPTION = "❌ Нет активного абонемента"
+
+HISTORY_TITLE_LATEST = "📋 <b>Последние тренировки:</b>"
+HISTORY_TITLE = "📋 <b>История тренировок:</b>"
+_HISTORY_ITEM = (
+    "📅 {date}\n"
+    "   ⏱ {duration} мин | 👥 {participants} чел. | 💰 {amount}\n"
+).format
+_HISTORY_PLACE = "   🎾 {court}{coach}\n".format
+
+
+def render_balance(subscription: Optional[Dict]) -> str:
+    if not subscription:
+        return NO_SUBSCRIPTION
+    message = _BALANCE(
+        number=escape(subscription['subscription_number']),
+        initial=format_amount(subscription['initial_amount']),
+        balance=format_amount(subscription['current_balance']),
+        start=format_date(subscription['start_date'])
+    )
+    if subscription['end_date']:
+        message += _BALANCE_END(format_date(subscription['end_date']))
+    return message
+
+
+def render_stats(period: str, stats: Dict) -> str:
+    parts = [_STATS(
+        period=get_period_name(period),
+        spent=format_amount(stats['spent']),
+        count=stats['count']
+    )]
+    # Разбивка строится по фактическим форматам, включая добавленные через /setprice
+    by_participants = stats['by_participants']
+    if by_participants:
+        parts.append(_STATS_FORMATS)
+        parts.extend(_STATS_FORMAT(label=participants_label(participants), count=count)
+                     for participants, count in sorted(by_participants.items()))
+    return "".join(parts)
+
+
+def render_profile(user: Dict, subscription: Optional[Dict], total_trainings: int) -> str:
+    message = _PROFILE(
+        first_name=escape(user['first_name']),
+        last_name=escape(user['last_name'] or ''),
+        phone=escape(user['phone'] or 'Не указан'),
+        registered=format_date(user['registration_date']),
+        trainings=total_trainings
+    )
+    if subscription:
+        return message + _PROFILE_SUBSCRIPTION(
+            number=escape(subscription['subscription_number']),
+            balance=format_amount(subscription['current_balance'])
+        )
+    return message + _PROFILE_NO_SUBSCRIPTION
+
+
+def render_history(title: str, trainings: List[Dict]) -> str:
+    parts = [title, "\n\n"]
+    for training in trainings:
+        parts.append(_HISTORY_ITEM(
+            date=format_date(training['session_date']),
+            duration=training['duration_minutes'],
+            participants=training['participants_count'],
+            amount=format_amount(training['amount_paid'])
+        ))
+        if training['court_type'] or training['coach_name']:
+            parts.append(_HISTORY_PLACE(
+                court=escape(training['court_type'] or ''),
+                coach=f" | 👨‍🏫 {escape(training['coach_name'])}" if training['coach_name'] else ''
+            ))
+        parts.append("\n")
+    return "".join(parts).rstrip("\n")
@@ -0,0 +1,28 @@
+def _subscription(db, telegram_id, amount):
+    db.register_user(telegram_id, f'Игрок {telegram_id}')
+    user_id = db.get_user(telegram_id)['id']
+    return user_id, db.create_subscription(user_id, f'A-{telegram_id}', amount)
+
+
+def _kinds(alerts):
+    return sorted((alert['subscription_number'], alert['kind']) for alert in alerts)
+
+
+def test_charges_raise_balance_alerts(db):
+    cheapest = min(db.get_prices().values())
+    low_balance = cheapest * 3
+    _, first = _subscription(db, 1, cheapest * 5)
+    _, second = _subscription(db, 2, cheapest * 5)
+    # Первый запуск только запоминает, с какой операции начинать
+    assert db.collect_subscription_alerts(low_balance, 7) == []
+
+    assert db.update_subscription_balance(first, cheapest * 5 - cheapest // 2)
+    assert db.update_subscription_balance(second, cheapest * 3)
+    assert _kinds(db.collect_subscription_alerts(low_balance, 7)) == [('A-1', 'exhausted'), ('A-2', 'low_balance')]
+    # Остаток еще не нулевой: абонемент остается действующим
+    assert db.get_active_subscription(db.get_user(1)['id'])['current_balance'] == cheapest - cheapest // 2
+
+    assert db.collect_subscription_alerts(low_balance, 7) == []
+    assert db.update_subscription_balance(first, cheapest - cheapest // 2)
+    assert _kinds(db.collect_subscription_alerts(low_balance, 7)) == [('A-1', 'exhausted')]
+    assert db.get_active_subscription(db.get_user(1)['id']) is None
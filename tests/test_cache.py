@@ -0,0 +1,42 @@
+from cache import MISSING, TTLCache
+
+
+def test_set_skipped_after_invalidate_during_fetch():
+    cache = TTLCache(maxsize=10, ttl=60)
+    generation = cache.generation('key')
+    cache.invalidate('key')  # запись закоммичена, пока читатель ходил в БД
+    cache.set('key', 'old', generation)
+    assert cache.get('key') is MISSING
+
+    generation = cache.generation('key')
+    cache.set('key', 'new', generation)
+    assert cache.get('key') == 'new'
+
+
+def test_trimmed_generations_stay_safe():
+    cache = TTLCache(maxsize=2, ttl=60)
+    generation = cache.generation('key')
+    cache.invalidate('key')
+    for other in range(5):
+        cache.invalidate(other)
+    cache.set('key', 'old', generation)
+    assert cache.get('key') is MISSING
+
+
+def test_stale_subscription_not_cached(db, monkeypatch):
+    db.register_user(1, 'Анна')
+    user_id = db.get_user(1)['id']
+    subscription_id = db.create_subscription(user_id, 'A-1', 500000)
+
+    fetch = db._fetch_active_subscription
+
+    def fetch_then_charge(key):
+        stale = fetch(key)
+        # Списание коммитится между чтением и записью в кэш
+        db.update_subscription_balance(subscription_id, 100000)
+        return stale
+
+    monkeypatch.setattr(db, '_fetch_active_subscription', fetch_then_charge)
+    assert db.get_active_subscription(user_id)['current_balance'] == 500000
+    monkeypatch.setattr(db, '_fetch_active_subscription', fetch)
+    assert db.get_active_subscription(user_id)['current_balance'] == 400000
@@ -0,0 +1,99 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from database import AsyncDatabase, Database
+
+PLAYERS = 20
+# Каждый абонемент покрывает ровно TRAININGS тренировок, а попыток втрое больше
+TRAININGS = 10
+ATTEMPTS = 3
+
+
+def test_parallel_bookings_never_overdraw(tmp_path):
+    """Сотни одновременных записей из двух «процессов» с общей базой.
+
+    У каждого экземпляра Database свой пул потоков и своя блокировка записи,
+    поэтому между ними сериализацию обеспечивает только BEGIN IMMEDIATE.
+    """
+    path = str(tmp_path / 'bot.db')
+    first = Database(path)
+    second = Database(path)
+    price = first.get_price(60, 1)
+
+    payers = []
+    for telegram_id in range(1, PLAYERS + 1):
+        first.register_user(telegram_id, f'Игрок {telegram_id}')
+        user_id = first.get_user(telegram_id)['id']
+        payers.append((user_id, first.create_subscription(user_id, f'A-{telegram_id}', price * TRAININGS)))
+
+    async def book(db, payer):
+        try:
+            await db.add_group_training([payer], 60, 1)
+            return True
+        except ValueError as e:
+            assert str(e) == "Недостаточно средств на абонементе"
+            return False
+
+    async def run():
+        pools = [AsyncDatabase(first, workers=8), AsyncDatabase(second, workers=8)]
+        attempts = [(pools[index % 2], payer)
+                    for index, payer in enumerate(payer for payer in payers for _ in range(TRAININGS * ATTEMPTS))]
+        results = await asyncio.gather(*(book(db, payer) for db, payer in attempts))
+        for pool in pools:
+            pool.close()
+        return list(zip((payer for _, payer in attempts), results))
+
+    try:
+        results = asyncio.run(run())
+        assert len(results) == PLAYERS * TRAININGS * ATTEMPTS
+
+        booked = {payer: 0 for payer in payers}
+        for payer, ok in results:
+            booked[payer] += ok
+        assert set(booked.values()) == {TRAININGS}
+
+        with first.get_connection() as conn:
+            balances = dict(conn.execute('SELECT id, current_balance FROM subscriptions'))
+            participants = conn.execute('SELECT COUNT(*) FROM training_participants').fetchone()[0]
+        assert set(balances.values()) == {0}
+        assert participants == PLAYERS * TRAININGS
+        # Баланс каждого абонемента совпадает с суммой по журналу операций
+        assert first.reconcile_balances(full=True) == []
+        assert first.check_training_stats() == []
+    finally:
+        first.close()
+        second.close()
+
+
+def test_parallel_group_bookings_are_all_or_nothing(tmp_path):
+    """Групповые записи списывают со всех абонементов или ни с одного"""
+    db = Database(str(tmp_path / 'bot.db'))
+    price = db.get_price(60, 2)
+    try:
+        payers = []
+        for telegram_id in range(1, 5):
+            db.register_user(telegram_id, f'Игрок {telegram_id}')
+            user_id = db.get_user(telegram_id)['id']
+            # У первых двух игроков разный запас: пары с ними упираются в меньший
+            amount = price * (5 if telegram_id == 1 else 8)
+            payers.append((user_id, db.create_subscription(user_id, f'A-{telegram_id}', amount)))
+
+        pairs = [(payers[0], payers[1]), (payers[0], payers[2]), (payers[1], payers[3])] * 40
+
+        def book(pair):
+            try:
+                db.add_group_training(list(pair), 60, 2)
+                return True
+            except ValueError:
+                return False
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            list(executor.map(book, pairs))
+
+        with db.get_connection() as conn:
+            balances = [row[0] for row in conn.execute('SELECT current_balance FROM subscriptions')]
+        assert min(balances) >= 0
+        assert db.reconcile_balances(full=True) == []
+        assert db.check_training_stats() == []
+    finally:
+        db.close()
@@ -0,0 +1,40 @@
+import sqlite3
+
+from database import Database
+
+
+def test_no_courts_seeded(db):
+    assert db.get_courts() == {}
+
+
+def test_court_surface_in_label(db):
+    db.set_directory_entry('courts', 'Корт 1', True, surface='Грунт')
+    db.set_directory_entry('courts', 'Корт  1', True)
+    assert list(db.get_courts().values()) == ['Корт 1 (Грунт)']
+
+
+def test_legacy_surfaces_removed_from_courts(tmp_path):
+    path = str(tmp_path / 'bot.db')
+    Database(path).close()
+
+    # Справочник в том виде, в каком его заполняли прежние версии
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute('ALTER TABLE courts DROP COLUMN surface')
+        conn.executemany('INSERT INTO courts (name, name_key) VALUES (?, ?)',
+                         [('Крытый корт', 'крытый корт'), ('Грунт', 'грунт'), ('Корт 7', 'корт 7')])
+        conn.execute('''
+            INSERT INTO training_sessions (session_date, session_time, duration_minutes, court_id)
+            SELECT '2024-01-01', '10:00:00', 60, id FROM courts WHERE name = 'Грунт'
+        ''')
+        conn.execute('PRAGMA user_version = 6')
+    conn.close()
+
+    db = Database(path)
+    try:
+        assert list(db.get_courts().values()) == ['Корт 7']
+        with db.get_connection() as conn:
+            rows = conn.execute('SELECT name, surface, is_active FROM courts ORDER BY id').fetchall()
+        assert rows == [('Грунт', 'Грунт', 0), ('Корт 7', None, 1)]
+    finally:
+        db.close()
@@ -0,0 +1,152 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def _player(db, telegram_id, amount=500000):
+    db.register_user(telegram_id, f'Игрок {telegram_id}', phone=f'+7900000{telegram_id:04d}')
+    user_id = db.get_user(telegram_id)['id']
+    subscription_id = db.create_subscription(user_id, f'A-{telegram_id}', amount)
+    return user_id, subscription_id
+
+
+def _participants(db, training_id):
+    with db.get_connection() as conn:
+        return {row[0] for row in conn.execute(
+            'SELECT user_id FROM training_participants WHERE training_session_id = ?', (training_id,)
+        )}
+
+
+def test_strangers_not_merged(db):
+    first = _player(db, 1)
+    second = _player(db, 2)
+    first_id, _ = db.add_group_training([first], 60, 2)
+    second_id, _ = db.add_group_training([second], 60, 2)
+    assert first_id != second_id
+
+
+def test_joins_session_of_listed_partner(db):
+    first = _player(db, 1)
+    second = _player(db, 2)
+    start = datetime.now().replace(microsecond=0) + timedelta(days=1)
+    training_id, _ = db.add_group_training([first], 60, 2, start=start)
+    joined_id, _ = db.add_group_training([second], 60, 2, start=start, partner_ids=[first[0]])
+    assert joined_id == training_id
+    assert _participants(db, training_id) == {first[0], second[0]}
+
+
+def test_partner_charged_only_after_accepting(db):
+    organizer = _player(db, 1)
+    partner = _player(db, 2)
+    training_id, _ = db.add_group_training([organizer], 60, 2, partner_ids=[partner[0]])
+    [(invitation_id, user_id)] = db.create_invitations(training_id, organizer[0], [partner[0]])
+    assert user_id == partner[0]
+    assert db.get_active_subscription(partner[0])['current_balance'] == 500000
+
+    price = db.get_price(60, 2)
+    invitation = db.respond_invitation(invitation_id, partner[0], accept=True)
+    assert invitation['balance'] == 500000 - price
+    assert db.get_active_subscription(partner[0])['current_balance'] == 500000 - price
+    assert _participants(db, training_id) == {organizer[0], partner[0]}
+
+    with pytest.raises(ValueError):
+        db.respond_invitation(invitation_id, partner[0], accept=True)
+
+
+def test_invitation_of_other_user_rejected(db):
+    organizer = _player(db, 1)
+    partner = _player(db, 2)
+    stranger = _player(db, 3)
+    training_id, _ = db.add_group_training([organizer], 60, 2)
+    [(invitation_id, _)] = db.create_invitations(training_id, organizer[0], [partner[0]])
+    with pytest.raises(ValueError):
+        db.respond_invitation(invitation_id, stranger[0], accept=True)
+    assert db.get_active_subscription(stranger[0])['current_balance'] == 500000
+
+
+def test_invitation_stays_pending_without_funds(db):
+    organizer = _player(db, 1)
+    partner = _player(db, 2, amount=100)
+    training_id, _ = db.add_group_training([organizer], 60, 2)
+    [(invitation_id, _)] = db.create_invitations(training_id, organizer[0], [partner[0]])
+    with pytest.raises(ValueError):
+        db.respond_invitation(invitation_id, partner[0], accept=True)
+
+    invitation = db.respond_invitation(invitation_id, partner[0], accept=False)
+    assert invitation['status'] == 'declined'
+    assert _participants(db, training_id) == {organizer[0]}
+
+
+def test_invitation_closed_when_partner_joins_on_their_own(db):
+    db.set_price(60, 3, 60000)
+    organizer = _player(db, 1)
+    partner = _player(db, 2)
+    start = datetime.now().replace(microsecond=0) + timedelta(days=1)
+    training_id, _ = db.add_group_training([organizer], 60, 3, start=start)
+    [(invitation_id, _)] = db.create_invitations(training_id, organizer[0], [partner[0]])
+
+    joined_id, balances = db.add_group_training([partner], 60, 3, start=start, partner_ids=[organizer[0]])
+    assert joined_id == training_id
+    assert balances[partner[0]] == 500000 - 60000
+    with pytest.raises(ValueError):
+        db.respond_invitation(invitation_id, partner[0], accept=True)
+
+    # Даже если приглашение осталось открытым, второй раз партнер не платит
+    with db.write_connection() as conn:
+        conn.execute("UPDATE training_invitations SET status = 'pending' WHERE id = ?", (invitation_id,))
+    with pytest.raises(ValueError):
+        db.respond_invitation(invitation_id, partner[0], accept=True)
+
+    with db.get_connection() as conn:
+        rows = conn.execute('SELECT COUNT(*) FROM training_participants WHERE user_id = ?',
+                            (partner[0],)).fetchone()[0]
+    assert rows == 1
+    assert db.get_active_subscription(partner[0])['current_balance'] == 500000 - 60000
+    assert db.reconcile_balances(full=True) == []
+
+
+def _court(db, name='Корт 1'):
+    db.set_directory_entry('courts', name, True)
+    return next(court_id for court_id, label in db.get_courts().items() if label == name)
+
+
+def test_current_trainings_skip_court_check(db):
+    court_id = _court(db)
+    first = _player(db, 1)
+    second = _player(db, 2)
+    db.add_group_training([first], 60, 1, court_id=court_id)
+    db.add_group_training([second], 60, 1, court_id=court_id)
+
+
+def test_booking_conflicts_on_same_court(db):
+    court_id = _court(db)
+    first = _player(db, 1)
+    second = _player(db, 2)
+    start = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time()).replace(hour=10)
+    db.add_group_training([first], 60, 1, court_id=court_id, start=start)
+    with pytest.raises(ValueError, match='Корт занят'):
+        db.add_group_training([second], 60, 1, court_id=court_id, start=start + timedelta(minutes=30))
+    db.add_group_training([second], 60, 1, court_id=court_id, start=start + timedelta(minutes=60))
+    assert db.get_active_subscription(second[0])['current_balance'] == 500000 - db.get_price(60, 1)
+
+
+def test_booking_past_midnight_rejected(db):
+    first = _player(db, 1)
+    start = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time()).replace(hour=23, minute=30)
+    with pytest.raises(ValueError, match='полуночи'):
+        db.add_group_training([first], 60, 1, start=start)
+
+
+def test_conflict_with_training_from_previous_evening(db):
+    court_id = _court(db)
+    first = _player(db, 1)
+    day = datetime.now().date() + timedelta(days=1)
+    # Текущая тренировка, записанная поздно вечером, идет и после полуночи
+    with db.write_connection() as conn:
+        conn.execute('''
+            INSERT INTO training_sessions (session_date, session_time, duration_minutes, court_id)
+            VALUES (?, '23:30:00', 60, ?)
+        ''', (day.isoformat(), court_id))
+    start = datetime.combine(day + timedelta(days=1), datetime.min.time()).replace(minute=15)
+    with pytest.raises(ValueError, match='Корт занят'):
+        db.add_group_training([first], 60, 1, court_id=court_id, start=start)
@@ -0,0 +1,47 @@
+from importer import TrainingImporter
+
+
+def _record(**fields):
+    record = {
+        'telegram_id': '1', 'first_name': 'Иван', 'subscription_number': 'A-1', 'initial_amount': '10000',
+        'session_date': '01.02.2024', 'duration_minutes': '60', 'participants_count': '1', 'amount': '500',
+    }
+    record.update(fields)
+    return record
+
+
+def _sessions(db):
+    with db.get_connection() as conn:
+        return conn.execute('SELECT session_time FROM training_sessions ORDER BY id').fetchall()
+
+
+def test_session_time_normalized(db):
+    importer = TrainingImporter(db)
+    stats = importer.run([
+        _record(session_time='9:00'),
+        _record(session_time='9.30'),
+        _record(session_time='18:45:00'),
+        _record(),
+        _record(session_time='утром'),
+        _record(session_time='25:00'),
+    ])
+
+    assert stats['imported'] == 4
+    assert stats['rejected'] == 2
+    assert [line for line, _ in importer.errors] == [5, 6]
+    assert _sessions(db) == [('09:00:00',), ('09:30:00',), ('18:45:00',), ('00:00:00',)]
+
+
+def test_unknown_directory_entries_created_hidden(db):
+    db.set_directory_entry('courts', 'Корт 1', True, surface='Хард')
+    stats = TrainingImporter(db).run([
+        _record(court_type='Грунт', coach_name='Иванов Иван'),
+        _record(court_type='корт 1'),
+    ])
+
+    assert stats['imported'] == 2
+    assert list(db.get_courts().values()) == ['Корт 1 (Хард)']
+    assert db.get_coaches() == {}
+    with db.get_connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM courts WHERE is_active = FALSE').fetchone()[0] == 1
+    assert db.check_training_stats() == []
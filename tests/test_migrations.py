@@ -0,0 +1,160 @@
+import os
+import sqlite3
+
+import migrations
+from database import Database
+
+# Размер истории в базе до появления версий; для прогона на объеме боевой базы
+# задайте, например, MIGRATION_TEST_SESSIONS=1000000
+SESSIONS = int(os.getenv('MIGRATION_TEST_SESSIONS', '100000'))
+USERS = 1000
+
+# Схема первой версии бота: тренеры и корты строками, суммы в рублях
+LEGACY_SCHEMA = '''
+    CREATE TABLE users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        telegram_id INTEGER UNIQUE NOT NULL,
+        first_name TEXT NOT NULL,
+        last_name TEXT,
+        phone TEXT,
+        registration_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+        is_active BOOLEAN DEFAULT TRUE
+    );
+    CREATE TABLE subscriptions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        subscription_number TEXT UNIQUE NOT NULL,
+        initial_amount DECIMAL(10,2) NOT NULL,
+        current_balance DECIMAL(10,2) NOT NULL,
+        start_date DATE NOT NULL,
+        end_date DATE,
+        status TEXT DEFAULT 'active',
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    );
+    CREATE TABLE price_list (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        duration_minutes INTEGER NOT NULL,
+        participants_count INTEGER NOT NULL,
+        price DECIMAL(10,2) NOT NULL,
+        description TEXT,
+        is_active BOOLEAN DEFAULT TRUE
+    );
+    CREATE TABLE training_sessions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_date DATE NOT NULL,
+        session_time TIME NOT NULL,
+        duration_minutes INTEGER NOT NULL,
+        court_type TEXT,
+        coach_name TEXT,
+        notes TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE training_participants (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        training_session_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        subscription_id INTEGER NOT NULL,
+        amount_paid DECIMAL(10,2) NOT NULL,
+        participants_count INTEGER NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (training_session_id) REFERENCES training_sessions(id) ON DELETE CASCADE,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+        FOREIGN KEY (subscription_id) REFERENCES subscriptions(id) ON DELETE CASCADE
+    );
+    CREATE TABLE transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        subscription_id INTEGER NOT NULL,
+        training_session_id INTEGER,
+        transaction_type TEXT NOT NULL,
+        amount DECIMAL(10,2) NOT NULL,
+        description TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+        FOREIGN KEY (subscription_id) REFERENCES subscriptions(id) ON DELETE CASCADE,
+        FOREIGN KEY (training_session_id) REFERENCES training_sessions(id) ON DELETE SET NULL
+    );
+'''
+
+LEGACY_DATA = f'''
+    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {USERS})
+    INSERT INTO users (telegram_id, first_name, phone) SELECT 1000 + i, 'Игрок ' || i, '+7900' || i FROM n;
+
+    INSERT INTO subscriptions (user_id, subscription_number, initial_amount, current_balance, start_date)
+    SELECT id, 'A-' || id, 1000000.55, 1000000.55, '2023-01-01' FROM users;
+
+    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {SESSIONS})
+    INSERT INTO training_sessions (session_date, session_time, duration_minutes, court_type, coach_name)
+    SELECT date('2023-01-01', '+' || (i % 700) || ' days'), printf('%02d:00:00', 8 + i % 14), 60,
+           CASE i % 4 WHEN 0 THEN 'Грунт' WHEN 1 THEN ' грунт' WHEN 2 THEN 'Хард' END,
+           CASE i % 4 WHEN 0 THEN 'Иванов Иван' WHEN 1 THEN 'Иванов Иван' WHEN 2 THEN 'иванов  иван' END
+    FROM n;
+
+    INSERT INTO training_participants (training_session_id, user_id, subscription_id, amount_paid, participants_count)
+    SELECT ts.id, s.id, s.id, 800.4, 2
+    FROM training_sessions ts
+    JOIN subscriptions s ON s.id IN (ts.id % {USERS} + 1, (ts.id + 1) % {USERS} + 1);
+
+    INSERT INTO transactions (user_id, subscription_id, training_session_id, transaction_type, amount, description)
+    SELECT user_id, subscription_id, training_session_id, 'training', amount_paid, 'Тренировка: 60мин, 2 чел.'
+    FROM training_participants;
+
+    UPDATE subscriptions SET current_balance = initial_amount - spent.amount
+    FROM (SELECT subscription_id, SUM(amount) AS amount FROM transactions GROUP BY subscription_id) AS spent
+    WHERE spent.subscription_id = subscriptions.id;
+'''
+
+
+def test_migrate_legacy_database(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA + LEGACY_DATA)
+    conn.close()
+
+    db = Database(path)
+    try:
+        applied = db.applied_migrations
+        assert [number for number, _, _ in applied] == list(range(1, migrations.SCHEMA_VERSION + 1))
+        # Время каждого шага видно в выводе pytest -s
+        print(f"\nМиграция базы с {SESSIONS} тренировками:")
+        for number, name, elapsed in applied:
+            print(f"  {number:2d} {name:40s} {elapsed:8.3f} с")
+
+        assert db.reconcile_balances(full=True) == []
+        assert db.check_training_stats() == []
+        assert list(db.get_coaches().values()) == ['Иванов Иван']
+        # Типы покрытия из истории остаются в старых тренировках, но не предлагаются как корты
+        assert db.get_courts() == {}
+        with db.get_connection() as conn:
+            assert conn.execute('SELECT current_balance FROM subscriptions WHERE id = 1').fetchone()[0] == \
+                100000055 - 80040 * conn.execute(
+                    'SELECT COUNT(*) FROM training_participants WHERE subscription_id = 1'
+                ).fetchone()[0]
+            assert conn.execute('SELECT COUNT(*) FROM courts').fetchone()[0] == 2
+    finally:
+        db.close()
+
+    # Повторный запуск ничего не применяет
+    db = Database(path)
+    try:
+        assert db.applied_migrations == []
+    finally:
+        db.close()
+
+
+def test_migrate_resumes_from_recorded_version(tmp_path):
+    path = str(tmp_path / 'bot.db')
+    Database(path).close()
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute('DROP TABLE training_invitations')
+        conn.execute('ALTER TABLE courts DROP COLUMN surface')
+        conn.execute('PRAGMA user_version = 5')
+    conn.close()
+
+    db = Database(path)
+    try:
+        assert [name for _, name, _ in db.applied_migrations] == ['training_invitations', 'courts_surface']
+    finally:
+        db.close()
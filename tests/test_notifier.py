@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+from telegram.error import ChatMigrated, RetryAfter
+
+from notifier import SendQueue
+
+# Запас на планирование задач цикла событий при сравнении интервалов
+TOLERANCE = 0.005
+
+
+class FailingBot:
+    async def send_message(self, chat_id, text, **kwargs):
+        raise ChatMigrated(chat_id + 1)
+
+
+class RecordingBot:
+    """Записывает время каждой отправки; retry_after — чаты, первая отправка в которые получает RetryAfter"""
+
+    def __init__(self, retry_after=None):
+        self.sent = []
+        self.attempts = []
+        self.retry_after = dict(retry_after or {})
+
+    async def send_message(self, chat_id, text, **kwargs):
+        now = time.monotonic()
+        self.attempts.append((now, chat_id))
+        if chat_id in self.retry_after:
+            raise RetryAfter(self.retry_after.pop(chat_id))
+        self.sent.append((now, chat_id, text))
+        return text
+
+
+def _send_all(bot, messages, **options):
+    async def scenario():
+        queue = SendQueue(bot, **options)
+        futures = [await queue.enqueue(chat_id, text) for chat_id, text in messages]
+        await asyncio.wait_for(queue.stop(), timeout=10)
+        return queue, [future.result() for future in futures]
+
+    return asyncio.run(scenario())
+
+
+def _gaps(times):
+    return [later - earlier for earlier, later in zip(times, times[1:])]
+
+
+def test_unexpected_telegram_error_releases_message():
+    async def scenario():
+        queue = SendQueue(FailingBot(), rate=1000, chat_rate=1000)
+        future = await queue.enqueue(1, 'текст')
+        await asyncio.wait_for(queue.stop(), timeout=2)
+        return queue, future
+
+    queue, future = asyncio.run(scenario())
+    assert isinstance(future.exception(), ChatMigrated)
+    assert queue.stats['failed'] == 1
+    assert queue._pending == 0
+
+
+def test_global_rate_spaces_all_messages():
+    bot = RecordingBot()
+    messages = [(chat_id, f'сообщение {chat_id}') for chat_id in range(20)]
+    queue, results = _send_all(bot, messages, rate=50, chat_rate=1000)
+
+    assert results == [text for _, text in messages]
+    assert queue.stats['sent'] == 20
+    assert min(_gaps([sent_at for sent_at, _, _ in bot.sent])) >= 1 / 50 - TOLERANCE
+
+
+def test_chat_rate_spaces_messages_to_one_chat():
+    bot = RecordingBot()
+    messages = [(1, f'первому {index}') for index in range(5)] + [(2, f'второму {index}') for index in range(5)]
+    _send_all(bot, messages, rate=1000, chat_rate=10)
+
+    for chat_id in (1, 2):
+        times = [sent_at for sent_at, sent_chat, _ in bot.sent if sent_chat == chat_id]
+        assert len(times) == 5
+        assert min(_gaps(times)) >= 1 / 10 - TOLERANCE
+    # Пока первый чат ждет своей очереди, сообщения второму не задерживаются
+    first_of_second = next(sent_at for sent_at, chat_id, _ in bot.sent if chat_id == 2)
+    assert first_of_second - bot.sent[0][0] < 1 / 10
+
+
+def test_retry_after_pauses_whole_queue():
+    bot = RecordingBot(retry_after={1: 1})
+    messages = [(1, 'первому'), (2, 'второму'), (3, 'третьему')]
+    queue, results = _send_all(bot, messages, rate=100, chat_rate=1000)
+
+    assert results == ['первому', 'второму', 'третьему']
+    assert queue.stats['retried'] == 1
+    assert bot.attempts[0][1] == 1
+    failed_at = bot.attempts[0][0]
+    # После RetryAfter ничего не отправляется, пока не истечет пауза, в том числе в другие чаты
+    assert len(bot.sent) == 3
+    assert min(sent_at for sent_at, _, _ in bot.sent) >= failed_at + 1 - TOLERANCE
+
+
+def test_idle_chat_buckets_are_pruned():
+    bot = RecordingBot()
+    queue = SendQueue(bot, rate=1000, chat_rate=1000)
+    queue.MAX_CHATS = 10
+
+    async def scenario():
+        for chat_id in range(100):
+            await queue.enqueue(chat_id, 'рассылка')
+            await asyncio.sleep(0.002)
+        await asyncio.wait_for(queue.stop(), timeout=10)
+
+    asyncio.run(scenario())
+    assert len(bot.sent) == 100
+    assert len(queue._chats) <= queue.MAX_CHATS
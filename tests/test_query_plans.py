@@ -0,0 +1,229 @@
+"""Планы запросов Database на заполненной базе.
+
+Каждый метод вызывается с включенной трассировкой SQL, и для каждого
+выполненного запроса строится EXPLAIN QUERY PLAN. Полный проход по таблице
+(SCAN) допускается только там, где он задуман — список ниже с причинами;
+неожиданная сортировка во временном B-дереве выводится предупреждением.
+
+Статистика планировщика (ANALYZE) в базе бота не собирается, поэтому планы
+от объема не зависят; для прогона на объеме боевой базы задайте, например,
+QUERY_PLAN_ROWS=1000000.
+"""
+import os
+import re
+import warnings
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from database import Database
+
+ROWS = int(os.getenv('QUERY_PLAN_ROWS', '100000'))
+USERS = 1000
+
+# Справочники и прайс-лист в несколько строк загружаются в память целиком,
+# в том числе после каждого изменения
+LOOKUP_TABLES = {'price_list', 'coaches', 'courts'}
+
+# Метод -> таблицы истории, которые он читает целиком, и почему
+ALLOWED_SCANS = {
+    # Сверка и пересчет по определению проходят по всей истории
+    'reconcile_balances': {'subscriptions', 'transactions'},
+    'rebuild_training_stats': {'training_participants', 'training_sessions', 'user_training_stats',
+                               'club_training_stats'},
+    'check_training_stats': {'training_participants', 'training_sessions', 'user_training_stats',
+                             'club_training_stats'},
+    # Полная выгрузка журнала для администратора
+    'iter_ledger_all': {'transactions'},
+}
+
+# Метод -> сортировки во временном B-дереве, которые ожидаются: они идут по
+# небольшой выборке (строки одного игрока, дня или периода статистики)
+ALLOWED_SORTS = {
+    'add_group_training': 'тренировки одного дня',
+    'iter_ledger': 'журнал одного игрока',
+    'collect_subscription_alerts': 'операции после прошлой проверки',
+    'take_balance_snapshots': 'операции после прошлого снимка',
+    'get_stats_summary': 'статистика игрока за период',
+    'get_club_summary': 'статистика клуба за период',
+    'load_directories': 'справочники',
+    'set_directory_entry': 'справочники',
+    'rebuild_training_stats': 'пересчет по всей истории',
+    'check_training_stats': 'сверка по всей истории',
+}
+
+SCAN = re.compile(r'\bSCAN (\w+)')
+SOURCE = re.compile(r'\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(?!WHERE|ON|JOIN|LEFT|SET|GROUP|ORDER|LIMIT|USING)(\w+))?',
+                    re.IGNORECASE)
+TEMP_BTREE = 'USE TEMP B-TREE'
+# Служебные команды и DDL планов не имеют
+UNPLANNED = ('BEGIN', 'COMMIT', 'ROLLBACK', 'PRAGMA', 'CREATE', 'DROP', 'ALTER', 'SAVEPOINT', 'RELEASE')
+
+SEED = f'''
+    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {USERS})
+    INSERT INTO users (telegram_id, first_name, phone) SELECT 1000 + i, 'Игрок ' || i, '+7900' || i FROM n;
+
+    INSERT INTO subscriptions (user_id, subscription_number, initial_amount, current_balance, start_date, end_date)
+    SELECT id, 'A-' || id, 100000000, 100000000, '2023-01-01', date('now', '+' || (id % 30) || ' days')
+    FROM users;
+
+    INSERT INTO transactions (user_id, subscription_id, transaction_type, amount, description)
+    SELECT user_id, id, 'topup', initial_amount, 'Пополнение абонемента ' || subscription_number
+    FROM subscriptions;
+
+    INSERT INTO coaches (name, name_key) VALUES ('Иванов Иван', 'иванов иван');
+    INSERT INTO courts (name, name_key, surface) VALUES ('Корт 1', 'корт 1', 'Хард');
+
+    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {ROWS // 2})
+    INSERT INTO training_sessions (session_date, session_time, duration_minutes, court_id, coach_id)
+    SELECT date('now', '-' || (i % 700) || ' days'), printf('%02d:00:00', 8 + i % 14), 60,
+           CASE WHEN i % 2 THEN 1 END, CASE WHEN i % 3 THEN 1 END
+    FROM n;
+
+    INSERT INTO training_participants
+    (training_session_id, user_id, subscription_id, amount_paid, participants_count, session_date, session_time)
+    SELECT ts.id, s.id, s.id, 80000, 2, ts.session_date, ts.session_time
+    FROM training_sessions ts
+    JOIN subscriptions s ON s.id IN (ts.id % {USERS} + 1, (ts.id + 1) % {USERS} + 1);
+
+    INSERT INTO transactions (user_id, subscription_id, training_session_id, transaction_type, amount, description)
+    SELECT user_id, subscription_id, training_session_id, 'training', amount_paid, 'Тренировка: 60мин, 2 чел.'
+    FROM training_participants;
+
+    UPDATE subscriptions SET current_balance = initial_amount - spent.amount
+    FROM (
+        SELECT subscription_id, SUM(amount) AS amount FROM transactions
+        WHERE transaction_type = 'training' GROUP BY subscription_id
+    ) AS spent
+    WHERE spent.subscription_id = subscriptions.id;
+'''
+
+
+@pytest.fixture(scope='module')
+def seeded(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('plans') / 'bot.db')
+    Database(path).close()
+    db = Database(path)
+    with db.write_connection() as conn:
+        for statement in SEED.split(';'):
+            if statement.strip():
+                conn.execute(statement)
+    db.rebuild_training_stats()
+    db.load_directories()
+    yield db
+    db.close()
+
+
+def _exercise(db):
+    """Вызывает каждый метод Database, обращающийся к БД; отдает (имя, вызов)"""
+    user = db.get_user(1001)
+    user_id = user['id']
+    subscription = db.get_active_subscription(user_id)
+    partner_id = db.get_user(1002)['id']
+    partner_subscription = db.get_active_subscription(partner_id)['id']
+    tomorrow = datetime.combine(date.today() + timedelta(days=1), datetime.min.time())
+
+    yield 'user_exists', lambda: db.user_exists(1001)
+    yield 'register_user', lambda: db.register_user(5000, 'Новый', phone='+79990000000')
+    yield 'get_user', lambda: db._fetch_user(1003)
+    yield 'get_users_by_phones', lambda: db.get_users_by_phones(['+79001', '+79002'])
+    yield 'get_user_chat_ids', lambda: db.get_user_chat_ids(100, 100)
+    yield 'create_subscription', lambda: db.create_subscription(user_id, 'NEW-1', 100000)
+    yield 'get_active_subscription', lambda: db._fetch_active_subscription(user_id)
+    yield 'update_subscription_balance', lambda: db.update_subscription_balance(subscription['id'], 100)
+    yield 'take_balance_snapshots', db.take_balance_snapshots
+    yield 'get_balance_at', lambda: db.get_balance_at(subscription['id'], '2024-01-01')
+    yield 'reconcile_balances', lambda: (db.reconcile_balances(), db.reconcile_balances(full=True))
+    yield 'load_prices', db.load_prices
+    yield 'set_price', lambda: db.set_price(60, 1, 150000)
+    yield 'load_directories', db.load_directories
+    yield 'set_directory_entry', lambda: (db.set_directory_entry('courts', 'Корт 2', True, surface='Грунт'),
+                                          db.set_directory_entry('coaches', 'Петров', False))
+
+    def resolve():
+        with db.write_connection() as conn:
+            db.resolve_directory_ids(conn, 'coaches', ['Сидоров'])
+    yield 'resolve_directory_ids', resolve
+
+    def book():
+        db.add_group_training([(user_id, subscription['id'])], 60, 2)
+        training_id, _ = db.add_group_training([(user_id, subscription['id'])], 60, 2, court_id=1, coach_id=1,
+                                               start=tomorrow.replace(hour=21))
+        db.add_group_training([(partner_id, partner_subscription)], 60, 2, start=tomorrow.replace(hour=21),
+                              partner_ids=[user_id])
+        return training_id
+    yield 'add_group_training', book
+
+    def invite():
+        training_id, _ = db.add_group_training([(user_id, subscription['id'])], 60, 2,
+                                               start=tomorrow.replace(hour=7))
+        [(invitation_id, _)] = db.create_invitations(training_id, user_id, [partner_id])
+        db.respond_invitation(invitation_id, partner_id, accept=True)
+    yield 'invitations', invite
+
+    yield 'get_availability', lambda: db.get_availability(date.today(), 7, 60, [1], coach_id=1)
+    yield 'iter_ledger', lambda: list(db.iter_ledger(1001))
+    yield 'iter_ledger_all', lambda: sum(1 for _ in db.iter_ledger())
+    yield 'save_bot_state', lambda: db.save_bot_state([('user_data', '1001', '{}'), ('user_data', '1002', None)])
+    yield 'load_bot_state', lambda: db.load_bot_state('user_data')
+    yield 'collect_subscription_alerts', lambda: db.collect_subscription_alerts(5000000, 7)
+    yield 'get_spent_amount', lambda: db.get_spent_amount(user_id, 'month')
+    yield 'get_training_count', lambda: db.get_training_count(user_id, 'year', participants=2)
+    yield 'get_stats_summary', lambda: (db.get_stats_summary(user_id, 'month'), db.get_stats_summary(user_id, 'all'))
+    yield 'rebuild_training_stats', db.rebuild_training_stats
+    yield 'check_training_stats', db.check_training_stats
+    yield 'get_club_summary', lambda: db.get_club_summary('year')
+
+    def history():
+        page = db.get_user_trainings(user_id)
+        cursor = (page[-1]['session_date'], page[-1]['session_time'], page[-1]['training_session_id'])
+        db.get_user_trainings(user_id, before=cursor)
+        db.get_user_trainings(user_id, after=cursor)
+    yield 'get_user_trainings', history
+
+
+def _plans(db):
+    """(метод, запрос, строки плана) для всех запросов, выполненных методами"""
+    statements = []
+    reader = db.get_connection()
+    with db.write_connection() as writer:
+        pass
+    for conn in (reader, writer):
+        conn.set_trace_callback(statements.append)
+
+    try:
+        executed = []
+        for name, call in _exercise(db):
+            statements.clear()
+            call()
+            executed.extend((name, sql) for sql in statements if not sql.lstrip().upper().startswith(UNPLANNED))
+    finally:
+        for conn in (reader, writer):
+            conn.set_trace_callback(None)
+
+    with db.get_connection() as conn:
+        for name, sql in executed:
+            details = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+            yield name, sql, details
+
+
+def test_no_full_scans(seeded):
+    with seeded.get_connection() as conn:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    scans = []
+    sorts = []
+    for name, sql, details in _plans(seeded):
+        # Псевдонимы таблиц в запросе; подзапросы и VALUES таблицами не являются
+        aliases = {alias or table: table for table, alias in SOURCE.findall(sql) if table in tables}
+        for detail in details:
+            match = SCAN.search(detail)
+            table = match and aliases.get(match.group(1))
+            if table and table not in LOOKUP_TABLES and table not in ALLOWED_SCANS.get(name, ()):
+                scans.append(f"{name}: {detail}\n{sql.strip()}")
+            if TEMP_BTREE in detail and name not in ALLOWED_SORTS:
+                sorts.append(f"{name}: {detail}")
+
+    for sort in sorts:
+        warnings.warn(f"Сортировка во временном B-дереве — {sort}")
+    assert not scans, "Полный проход по таблице:\n\n" + "\n\n".join(scans)
@@ -0,0 +1,13 @@
+from templates import render_stats
+
+
+def test_stats_breakdown_lists_every_format():
+    text = render_stats('month', {'spent': 150000, 'count': 5, 'by_participants': {6: 2, 1: 3}})
+    assert '• 1 человек: 3' in text
+    assert '• 6 человек: 2' in text
+    assert text.index('1 человек') < text.index('6 человек')
+
+
+def test_stats_without_trainings_has_no_breakdown():
+    text = render_stats('week', {'spent': 0, 'count': 0, 'by_participants': {}})
+    assert 'По числу участников' not in text
@@ -0,0 +1,15 @@
+import pytest
+
+from utils import MAX_AMOUNT, parse_amount
+
+
+def test_parse_amount():
+    assert parse_amount('1 500,50') == 150050
+    assert parse_amount('0.29') == 29
+    assert parse_amount(str(MAX_AMOUNT // 100)) == MAX_AMOUNT
+
+
+@pytest.mark.parametrize('text', ['1e30', '9' * 40, '-1e30', '1.005', 'nan', 'сто'])
+def test_parse_amount_rejects(text):
+    with pytest.raises(ValueError):
+        parse_amount(text)
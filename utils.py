@@ -1,4 +1,6 @@
 from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
 import re
 
 def validate_phone(phone: str) -> bool:
@@ -15,14 +17,73 @@ def format_phone(phone: str) -> str:
         digits = '7' + digits
     return f"+{digits}"
 
+# Одни и те же даты и суммы повторяются из сообщения в сообщение,
+# поэтому готовые строки кэшируются
+@lru_cache(maxsize=4096)
 def format_date(date_str: str) -> str:
     """Форматирование даты"""
     date_obj = datetime.fromisoformat(date_str)
     return date_obj.strftime('%d.%m.%Y')
 
-def format_amount(amount: float) -> str:
-    """Форматирование суммы"""
-    return f"{amount:,.2f} ₽".replace(',', ' ')
+@lru_cache(maxsize=4096)
+def format_amount(amount: int) -> str:
+    """Форматирование суммы в копейках: 150050 -> '1 500.50 ₽'"""
+    sign = '-' if amount < 0 else ''
+    rubles, kopecks = divmod(abs(amount), 100)
+    return f"{sign}{rubles:,}.{kopecks:02d} ₽".replace(',', ' ')
+
+def amount_to_str(amount: int) -> str:
+    """Сумма в копейках как число рублей для выгрузок: 150050 -> '1500.50'"""
+    sign = '-' if amount < 0 else ''
+    rubles, kopecks = divmod(abs(amount), 100)
+    return f"{sign}{rubles}.{kopecks:02d}"
+
+# Наибольшая сумма в копейках (100 млн ₽): с запасом помещается в INTEGER
+# SQLite даже в итогах по всей истории
+MAX_AMOUNT = 100_000_000_00
+
+def parse_amount(text: str) -> int:
+    """Сумма в рублях из текста ('1500', '1 500,50') в копейках.
+
+    Разбор идет через Decimal, поэтому '0.29' дает ровно 29 копеек.
+    ValueError, если это не число, в нем дробные копейки или по модулю
+    оно больше MAX_AMOUNT.
+    """
+    try:
+        value = Decimal(str(text).strip().replace(' ', '').replace(',', '.'))
+    except InvalidOperation:
+        raise ValueError(f"Неверная сумма: {text}") from None
+    if not value.is_finite() or abs(value) * 100 > MAX_AMOUNT:
+        raise ValueError(f"Неверная сумма: {text}")
+    if value * 100 != (value * 100).to_integral_value():
+        raise ValueError(f"Неверная сумма: {text}")
+    return int(value * 100)
+
+def clean_name(name: str) -> str:
+    """Имя без лишних пробелов"""
+    return ' '.join(name.split())
+
+def name_key(name: str) -> str:
+    """Ключ для сравнения имен без учета регистра, пробелов и буквы ё"""
+    return clean_name(name).casefold().replace('ё', 'е')
+
+def plural(number: int, forms: tuple) -> str:
+    """Форма слова для числа: plural(2, ('минута', 'минуты', 'минут')) -> 'минуты'"""
+    number = abs(number) % 100
+    if 11 <= number <= 14:
+        return forms[2]
+    number %= 10
+    if number == 1:
+        return forms[0]
+    if 2 <= number <= 4:
+        return forms[1]
+    return forms[2]
+
+def duration_label(duration: int) -> str:
+    return f"{duration} {plural(duration, ('минута', 'минуты', 'минут'))}"
+
+def participants_label(participants: int) -> str:
+    return f"{participants} {plural(participants, ('человек', 'человека', 'человек'))}"
 
 def get_period_name(period: str) -> str:
     periods = {